@@ -26,3 +26,12 @@ def step_impl(context):
 @step('behave finds {number:d} feature files')
 def step_impl(context, number):
     assert len(context.config.paths) == 3
+
+
+@then('the tests in this feature are sharded by the names behave reports for them')
+def step_impl(context):
+    import __main__ as pex
+    from behave.reporter.junit import JUnitReporter
+    expected = JUnitReporter(context.config).make_feature_filename(context.feature) + '.'
+    prefix = pex._feature_prefix(context.config.paths)(context.feature.filename)
+    assert prefix == expected, '%s != %s' % (prefix, expected)
@@ -10,3 +10,7 @@ Feature: Please Integration with Behave - Test Feature 1
     And behave finds 3 feature files
     When we implement 6 tests
     Then behave will test them for us!
+
+  Scenario: Shard tests in subdirectories
+    Given we have behave installed
+    Then the tests in this feature are sharded by the names behave reports for them
@@ -0,0 +1,203 @@
+"""Tests on how test pexes record which files each test executes (PEX_RECORD_TEST_IMPACT) and
+select the tests that changed files affect (PEX_TEST_CHANGED_FILES)."""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import __main__ as pex
+
+
+class FakeCoverageData:
+    """Stands in for coverage's CoverageData, with the contexts that executed each file's lines."""
+
+    def __init__(self, contexts):
+        self.contexts = contexts
+
+    def measured_files(self):
+        return list(self.contexts)
+
+    def contexts_by_lineno(self, filename):
+        return {line: {context} for line, context in enumerate(self.contexts[filename], 1)}
+
+
+class FakeCoverage:
+    def __init__(self, data):
+        self.data = data
+
+    def get_data(self):
+        return self.data
+
+
+def src(filename):
+    """Returns the absolute path of a source file in the repo."""
+    return os.path.join(os.getcwd(), filename)
+
+
+class ImpactMapTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+
+    def write_impact_map(self, data, workers=()):
+        env = {'RESULTS_FILE': os.path.join(self.tmp, 'test.results')}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(pex, 'COVERAGE', FakeCoverage(data)), \
+                mock.patch.object(pex, '_WORKER_IMPACT', list(workers)):
+            pex.write_impact_map()
+        with open(os.path.join(self.tmp, pex.IMPACT_FILE)) as f:
+            impact = json.load(f)
+        files = impact['files']
+        return (
+            {test: {files[i] for i in indices} for test, indices in impact['tests'].items()},
+            set(files),
+            {files[i] for i in impact['global']},
+        )
+
+    def test_impact(self):
+        tests, files, shared = pex._impact(FakeCoverageData({
+            src('lib/a.py'): ['test_a', 'test_b'],
+            src('lib/b.py'): ['test_b'],
+            src('lib/shared.py'): [pex.SHARED_CONTEXT, 'test_a'],
+            src('lib/imported.py'): [''],
+        }))
+        self.assertEqual({
+            'test_a': ['lib/a.py', 'lib/shared.py'],
+            'test_b': ['lib/a.py', 'lib/b.py'],
+        }, tests)
+        self.assertEqual(['lib/a.py', 'lib/b.py', 'lib/imported.py', 'lib/shared.py'], files)
+        self.assertEqual(['lib/shared.py'], shared)
+
+    def test_impact_excludes_files_outside_the_repo(self):
+        tests, files, shared = pex._impact(FakeCoverageData({
+            src('lib/a.py'): ['test_a'],
+            src(os.path.join(pex.MODULE_DIR, 'six.py')): ['test_a'],
+            src(os.path.join('.bootstrap', 'plz.py')): [''],
+            src('__main__.py'): [''],
+            '/usr/lib/python3/json/__init__.py': ['test_a'],
+        }))
+        self.assertEqual({'test_a': ['lib/a.py']}, tests)
+        self.assertEqual(['lib/a.py'], files)
+
+    def test_write_impact_map(self):
+        tests, files, global_files = self.write_impact_map(FakeCoverageData({
+            src('lib/a.py'): ['test_a'],
+            src('lib/shared.py'): [pex.SHARED_CONTEXT, 'test_b'],
+            src('lib/imported.py'): [''],
+        }))
+        self.assertEqual({'test_a': {'lib/a.py'}, 'test_b': {'lib/shared.py'}}, tests)
+        self.assertEqual({'lib/a.py', 'lib/imported.py', 'lib/shared.py'}, files)
+        # Files executed outside the tests or between them may affect any test.
+        self.assertEqual({'lib/imported.py', 'lib/shared.py'}, global_files)
+
+    def test_write_impact_map_merges_workers(self):
+        workers = [
+            ({'test_a': ['lib/b.py'], 'test_c': ['lib/c.py']}, ['lib/b.py', 'lib/c.py'], []),
+            ({'test_d': ['lib/a.py']}, ['lib/a.py', 'lib/fixture.py'], ['lib/fixture.py']),
+        ]
+        tests, files, global_files = self.write_impact_map(FakeCoverageData({
+            src('lib/a.py'): ['test_a'],
+            src('lib/fixture.py'): ['test_a'],
+        }), workers)
+        self.assertEqual({
+            'test_a': {'lib/a.py', 'lib/b.py', 'lib/fixture.py'},
+            'test_c': {'lib/c.py'},
+            'test_d': {'lib/a.py'},
+        }, tests)
+        self.assertEqual({'lib/a.py', 'lib/b.py', 'lib/c.py', 'lib/fixture.py'}, files)
+        # A file that's shared in any worker is global, even if it's attributed to tests elsewhere.
+        self.assertEqual({'lib/fixture.py'}, global_files)
+
+
+TESTS = ['a_test.ATest.test_a', 'b_test.BTest.test_b']
+
+
+class AffectedTestsTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        files = ['lib/a.py', 'lib/b.py', 'lib/shared.py', 'test/a_test.py', 'test/b_test.py']
+        impact_map = os.path.join(self.tmp, 'impact.json')
+        with open(impact_map, 'w') as f:
+            json.dump({
+                'files': files,
+                'global': [2],
+                'tests': {
+                    'a_test.ATest.test_a': [0, 3],
+                    'b_test.BTest.test_b': [1, 4],
+                },
+            }, f)
+        self.env = {
+            'PEX_TEST_IMPACT_MAP': impact_map,
+            'PEX_TEST_CHANGED_FILES': os.path.join(self.tmp, 'changed'),
+            'RESULTS_FILE': os.path.join(self.tmp, 'test.results'),
+        }
+        patcher = mock.patch.object(pex, '_IMPACT_MAP', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def changed(self, *filenames):
+        with open(self.env['PEX_TEST_CHANGED_FILES'], 'w') as f:
+            f.write(''.join(filename + '\n' for filename in filenames))
+
+    def affected_tests(self, test_names):
+        with mock.patch.dict(os.environ, self.env):
+            return pex.affected_tests(test_names)
+
+    def affected_files(self, filenames, prefix=None):
+        with mock.patch.dict(os.environ, self.env):
+            return pex.affected_files(filenames, prefix)
+
+    def test_no_changed_files(self):
+        del self.env['PEX_TEST_CHANGED_FILES']
+        self.assertEqual([True, True], self.affected_tests(TESTS))
+
+    def test_affected_tests(self):
+        self.changed('lib/a.py')
+        self.assertEqual([True, False], self.affected_tests(TESTS))
+
+    def test_new_tests_are_affected(self):
+        self.changed('lib/a.py')
+        tests = ['b_test.BTest.test_b', 'b_test.BTest.test_new']
+        self.assertEqual([False, True], self.affected_tests(tests))
+
+    def test_changed_global_file_affects_all_tests(self):
+        self.changed('lib/shared.py')
+        self.assertEqual([True, True], self.affected_tests(TESTS))
+
+    def test_changed_file_not_in_map_affects_all_tests(self):
+        self.changed('lib/a.py', 'lib/data.json')
+        self.assertEqual([True, True], self.affected_tests(TESTS))
+
+    def test_affected_files(self):
+        self.changed('lib/b.py')
+        self.assertEqual(['test/b_test.py'],
+                         self.affected_files(['test/a_test.py', 'test/b_test.py']))
+
+    def test_affected_files_with_prefix(self):
+        self.changed('lib/a.py')
+        prefix = lambda filename: os.path.basename(filename)[:-len('.py')] + '.'
+        filenames = ['test/a_test.py', 'test/b_test.py', 'test/new_test.py']
+        self.assertEqual(['test/a_test.py', 'test/new_test.py'],
+                         self.affected_files(filenames, prefix))
+
+    def test_affected_files_with_changed_global_file(self):
+        self.changed('lib/shared.py')
+        self.assertEqual(['test/a_test.py', 'test/b_test.py'],
+                         self.affected_files(['test/a_test.py', 'test/b_test.py']))
+
+    def test_unaffected_files_leave_a_record(self):
+        self.changed('lib/b.py')
+        self.assertEqual([], self.affected_files(['test/a_test.py']))
+        results = self.env['RESULTS_FILE']
+        self.assertTrue(os.path.exists(os.path.join(results, 'unaffected-empty.xml')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,9 @@
+"""Part of a test on PEX_MEMPROFILE."""
+
+BLOCKS = [bytearray(1 << 20) for _ in range(8)]
+
+if __name__ == '__main__':
+    # Import ourselves as a normal module, so that the blocks it allocates are still allocated when
+    # the profile is written at exit.
+    from test import memory_profile_main
+    print(sum(len(block) for block in memory_profile_main.BLOCKS))
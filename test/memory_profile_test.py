@@ -0,0 +1,56 @@
+"""Test on PEX_MEMPROFILE, which reports where a pex allocates memory."""
+
+import inspect
+import os
+import subprocess
+import tempfile
+import tracemalloc
+import types
+import unittest
+from unittest import mock
+
+import memory_profiler
+
+
+class MemoryProfileTest(unittest.TestCase):
+
+    def test_report(self):
+        """Test that running a pex with PEX_MEMPROFILE set writes a report on it."""
+        with tempfile.TemporaryDirectory() as tmp:
+            report = os.path.join(tmp, 'memprofile.txt')
+            env = dict(os.environ, PEX_MEMPROFILE=report)
+            output = subprocess.check_output(['test/memory_profile_main.pex'], env=env)
+            self.assertEqual(str(8 << 20), output.strip().decode('utf-8'))
+            with open(report) as f:
+                contents = f.read()
+        self.assertIn('By package:', contents)
+        self.assertRegex(contents, r'memory_profile_main\.py:3 \(test\)')
+        # The blocks it allocated are attributed to its package.
+        line = next(line for line in contents.splitlines() if line.endswith(' first-party  test'))
+        self.assertGreaterEqual(float(line.split()[0]), 8 * 1024)
+
+    def test_tracebacks_without_raw_traces(self):
+        """Test that we fall back to tracemalloc's public API if its private one isn't there."""
+        tracemalloc.start(5)
+        try:
+            line = inspect.currentframe().f_lineno + 1
+            blocks = [bytearray(1 << 16) for _ in range(16)]
+            raw = _size(memory_profiler._tracebacks(), line)
+            # take_snapshot() uses the private API itself, so it's only hidden from memory_profiler.
+            changed = types.SimpleNamespace(take_snapshot=tracemalloc.take_snapshot,
+                                            _get_traces=lambda: [(1, 2)])
+            with mock.patch.object(memory_profiler, 'tracemalloc', changed):
+                fallback = _size(memory_profiler._tracebacks(), line)
+            absent = types.SimpleNamespace(take_snapshot=tracemalloc.take_snapshot)
+            with mock.patch.object(memory_profiler, 'tracemalloc', absent):
+                missing = _size(memory_profiler._tracebacks(), line)
+        finally:
+            tracemalloc.stop()
+        self.assertGreaterEqual(raw, len(blocks) << 16)
+        self.assertEqual(raw, fallback)
+        self.assertEqual(raw, missing)
+
+
+def _size(tracebacks, line):
+    """Returns the size of the memory allocated at the given line of this file."""
+    return sum(size for frames, size, _ in tracebacks if frames[0] == (__file__, line))
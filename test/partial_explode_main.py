@@ -0,0 +1,17 @@
+"""Part of a test on PEX_PARTIAL_EXPLODE."""
+
+import json
+
+import coverage
+import six
+
+try:
+    from coverage import tracer
+except ImportError:  # There's no native tracer on this platform.
+    tracer = None
+
+print(json.dumps({
+    'coverage': coverage.__file__,
+    'tracer': tracer and tracer.__file__,
+    'six': six.__file__,
+}))
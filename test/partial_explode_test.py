@@ -0,0 +1,33 @@
+"""Test on PEX_PARTIAL_EXPLODE, which only extracts the packages containing native code."""
+
+import json
+import os
+import subprocess
+import tempfile
+import unittest
+
+
+class PartialExplodeTest(unittest.TestCase):
+
+    def test_partial_explode(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, PEX_PARTIAL_EXPLODE='1', PEX_CACHE_DIR=tmp)
+            output = subprocess.check_output(['test/partial_explode_main.pex'], env=env)
+            files = json.loads(output)
+            if not files['tracer']:
+                self.skipTest('coverage has no native code on this platform')
+            # coverage contains native code, so it's imported from the cache directory...
+            (entry,) = os.listdir(tmp)
+            self.assertRegex(entry, r'^pex-.*-partial$')
+            package = os.path.dirname(files['coverage'])
+            self.assertTrue(package.startswith(os.path.join(tmp, entry) + os.sep))
+            self.assertEqual(package, os.path.dirname(files['tracer']))
+            # ...but six doesn't, so it's still imported from the pex.
+            self.assertIn('partial_explode_main.pex' + os.sep, files['six'])
+            self.assertFalse(files['six'].startswith(tmp))
+            # Nothing else is extracted (apart from the cache's own bookkeeping).
+            for dirpath, _, filenames in os.walk(os.path.join(tmp, entry)):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    if dirpath != os.path.join(tmp, entry) or not filename.startswith('.'):
+                        self.assertTrue(path.startswith(package + os.sep), path)
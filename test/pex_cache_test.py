@@ -0,0 +1,141 @@
+"""Tests on the pex cache, which is kept within PEX_CACHE_MAX_BYTES by evicting the least recently
+used entries, and can be inspected and pruned with PEX_CACHE_COMMAND."""
+
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import __main__ as pex
+import pex_cache
+
+
+class PexCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = tmp.name
+        self.cache = pex_cache.PexCache(self.path)
+        # Entries in the order they were last used, the oldest first.
+        self.entries = [
+            self.add_entry('pex-a', 1),
+            self.add_entry(os.path.join(pex_cache.PexCache.EXTENSIONS, '123-456'), 2),
+            self.add_entry('pex-b', 3),
+            self.add_entry('pex-c', 4),
+        ]
+
+    def add_entry(self, name, age):
+        """Adds an entry to the cache that was last used the given number of hours ago."""
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.join(path, 'pkg'))
+        with open(os.path.join(path, 'pkg', 'mod.py'), 'w') as f:
+            f.write('x = 1\n' * 1000)
+        last_use = time.time() - (5 - age) * 3600
+        os.utime(path, (last_use, last_use))
+        return path
+
+    def sizes(self):
+        return {path: size for path, size, _ in self.cache.entries()}
+
+    def present(self):
+        return [path for path in self.entries if os.path.exists(path)]
+
+    def test_entries(self):
+        self.assertEqual(self.entries, [path for path, _, _ in self.cache.entries()])
+        for size in self.sizes().values():
+            self.assertGreater(size, 6000)
+
+    def test_prune_evicts_least_recently_used(self):
+        sizes = self.sizes()
+        # Only the two newest entries fit.
+        max_bytes = sizes[self.entries[2]] + sizes[self.entries[3]]
+        self.assertEqual(self.entries[:2], self.cache.prune(max_bytes))
+        self.assertEqual(self.entries[2:], self.present())
+        self.assertEqual(max_bytes, sum(self.sizes().values()))
+        # Nothing is left of the evicted entries.
+        self.assertEqual(['extensions', 'pex-b', 'pex-c'], sorted(os.listdir(self.path)))
+
+    def test_prune_within_limit(self):
+        self.assertEqual([], self.cache.prune(sum(self.sizes().values())))
+        self.assertEqual(self.entries, self.present())
+
+    def test_locked_entry_survives(self):
+        # Another process is running the oldest pex (a separate PexCache locks it on a separate
+        # file description, which conflicts with eviction the same way another process would).
+        running = pex_cache.PexCache(self.path)
+        self.assertTrue(running.acquire(self.entries[0]))
+        self.assertEqual(self.entries[1:], self.cache.prune(0))
+        self.assertEqual(self.entries[:1], self.present())
+        # Acquiring it marks it as recently used.
+        self.assertGreater(os.stat(self.entries[0]).st_mtime, time.time() - 60)
+
+    def test_acquire_missing_entry(self):
+        self.assertFalse(self.cache.acquire(os.path.join(self.path, 'pex-d')))
+
+    def test_prune_removes_abandoned_staging_directories(self):
+        abandoned = os.path.join(self.path, '.staging-pex-d-abc')
+        recent = os.path.join(self.path, '.staging-pex-e-def')
+        os.mkdir(abandoned)
+        os.mkdir(recent)
+        stale = time.time() - pex_cache.PexCache.STALE_SECONDS - 60
+        os.utime(abandoned, (stale, stale))
+        self.cache.prune(sum(self.sizes().values()))
+        self.assertFalse(os.path.exists(abandoned))
+        # This one might still be being written to.
+        self.assertTrue(os.path.exists(recent))
+
+    def main(self, command, max_bytes=None):
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            code = pex_cache.main(command, self.path, max_bytes)
+        return code, stdout.getvalue(), stderr.getvalue()
+
+    def test_list(self):
+        code, stdout, _ = self.main('list')
+        self.assertEqual(0, code)
+        lines = [line.split() for line in stdout.splitlines()]
+        self.assertEqual(self.entries, [line[3] for line in lines])
+        sizes = self.sizes()
+        self.assertEqual([sizes[path] for path in self.entries], [int(line[2]) for line in lines])
+
+    def test_size(self):
+        self.assertEqual((0, '%d\n' % sum(self.sizes().values()), ''), self.main('size'))
+
+    def test_prune(self):
+        sizes = self.sizes()
+        code, stdout, _ = self.main('prune', sizes[self.entries[3]])
+        self.assertEqual(0, code)
+        self.assertEqual(self.entries[:3], stdout.splitlines())
+        self.assertEqual(self.entries[3:], self.present())
+
+    def test_prune_everything(self):
+        code, stdout, _ = self.main('prune')
+        self.assertEqual(0, code)
+        self.assertEqual(self.entries, stdout.splitlines())
+        self.assertEqual([], self.present())
+
+    def test_unknown_command(self):
+        code, stdout, stderr = self.main('clean')
+        self.assertEqual(1, code)
+        self.assertEqual('', stdout)
+        self.assertIn('Unknown PEX_CACHE_COMMAND clean', stderr)
+
+    def test_cache_command(self):
+        """Test that a pex runs the command on its cache instead of itself if PEX_CACHE_COMMAND is
+        set."""
+        sizes = self.sizes()
+        env = dict(os.environ, PEX_CACHE_COMMAND='prune', PEX_CACHE_DIR=self.path,
+                   PEX_CACHE_MAX_BYTES=str(sizes[self.entries[3]]))
+        output = subprocess.check_output([sys.executable, pex.PEX], env=env)
+        self.assertEqual(self.entries[:3], output.decode('utf-8').splitlines())
+        self.assertEqual(self.entries[3:], self.present())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""Tests on serving invocations of a pex from a warm process (PEX_SERVER)."""
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+import __main__ as pex
+
+pex_server = pex.import_bootstrap('pex_server')
+
+STAMP = 'abc123'
+
+
+def main():
+    """The 'entry point' that the server runs, which does whatever its arguments say."""
+    command = sys.argv[1]
+    if command == 'exit':
+        return int(sys.argv[2])
+    elif command == 'echo':
+        print(os.environ['PEX_SERVER_TEST_VALUE'], os.getcwd())
+    elif command == 'wait':
+        def terminated(signum, frame):
+            os.write(1, b'terminated\n')
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+
+        signal.signal(signal.SIGTERM, terminated)
+        print('ready')
+        sys.stdout.flush()
+        while True:
+            signal.pause()
+    return 0
+
+
+@unittest.skipUnless(pex_server.supported(), 'pex servers are not supported on this platform')
+class PexServerTest(unittest.TestCase):
+
+    def setUp(self):
+        # Not a TemporaryDirectory, which the served children would delete when they exit.
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.path = pex_server.socket_path(os.path.join(self.tmp, 'cache'), STAMP)
+        self.server = self.fork(self.serve)
+        self.addCleanup(self.stop_server)
+        # Wait for the server to start listening.
+        deadline = time.time() + 30
+        while not os.path.exists(self.path):
+            self.assertLess(time.time(), deadline, 'Timed out waiting for the server to start')
+            time.sleep(0.01)
+
+    def serve(self):
+        # The server's buffered output mustn't end up on its clients' output.
+        with open(os.devnull, 'w') as devnull:
+            os.dup2(devnull.fileno(), 1)
+        sys.stdout = open(1, 'w', buffering=4096, closefd=False)
+        sys.stdout.write('unflushed server output')
+        return pex_server.serve(self.path, STAMP, main, idle_timeout=60)
+
+    def stop_server(self):
+        os.kill(self.server, signal.SIGKILL)
+        os.waitpid(self.server, 0)
+
+    @staticmethod
+    def fork(f):
+        """Runs f in a child process, which exits with what it returns."""
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = f()
+            finally:
+                os._exit(code if isinstance(code, int) else 1)
+        return pid
+
+    def connect(self, *args, **env):
+        """Starts a client for the server with the given arguments and environment, returning its
+        pid and a file that its output can be read from."""
+        r, w = os.pipe()
+
+        def client():
+            os.dup2(w, 1)
+            sys.argv = ['test.pex'] + list(args)
+            os.environ.update(env)
+            return pex_server.connect(self.path, STAMP)
+
+        pid = self.fork(client)
+        os.close(w)
+        return pid, os.fdopen(r)
+
+    def test_exit_code(self):
+        for code in (0, 3):
+            pid, output = self.connect('exit', str(code))
+            with output:
+                self.assertEqual('', output.read())
+            self.assertEqual(code, os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]))
+
+    def test_environment(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(self.tmp)
+        pid, output = self.connect('echo', PEX_SERVER_TEST_VALUE='hello')
+        with output:
+            self.assertEqual('hello %s\n' % self.tmp, output.read())
+        self.assertEqual(0, os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]))
+
+    def test_signals_forwarded(self):
+        pid, output = self.connect('wait')
+        with output:
+            self.assertEqual('ready\n', output.readline())
+            os.kill(pid, signal.SIGTERM)
+            self.assertEqual('terminated\n', output.read())
+        self.assertEqual(-signal.SIGTERM, os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1]))
+
+    def test_wrong_stamp(self):
+        self.assertIsNone(pex_server.connect(self.path, 'def456'))
+
+    def test_no_server(self):
+        self.assertIsNone(pex_server.connect(self.path + '.missing', STAMP))
+
+
+if __name__ == '__main__':
+    unittest.main()
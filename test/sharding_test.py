@@ -0,0 +1,89 @@
+"""Tests on how test pexes split their tests between shards (TEST_SHARD_INDEX/TEST_TOTAL_SHARDS)."""
+
+import json
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+import __main__ as pex
+
+SHARDS = 4
+
+
+class ShardingTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        # Empty shards leave a record in the results, which we don't want mixed up with ours.
+        self.env = {'RESULTS_FILE': os.path.join(self.tmp, 'test.results')}
+
+    def shards(self, items, durations):
+        """Returns the items in each shard, sharding them twice to check that it's deterministic."""
+        shards = []
+        for index in range(SHARDS):
+            env = dict(self.env, TEST_SHARD_INDEX=str(index), TEST_TOTAL_SHARDS=str(SHARDS))
+            with mock.patch.dict(os.environ, env):
+                shard = pex.shard(items, durations)
+                self.assertEqual(shard, pex.shard(list(items), list(durations)))
+            shards.append(shard)
+        return shards
+
+    def assertPartitioned(self, items, shards):
+        """Asserts that each item is in exactly one shard, in the original order."""
+        self.assertEqual(sorted(items), sorted(item for shard in shards for item in shard))
+        for shard in shards:
+            self.assertEqual(sorted(shard, key=items.index), shard)
+
+    def test_balanced(self):
+        rand = random.Random(42)
+        durations = [rand.uniform(0.1, 10.0) for _ in range(100)]
+        items = ['test_%d' % i for i in range(len(durations))]
+        shards = self.shards(items, durations)
+        self.assertPartitioned(items, shards)
+        by_item = dict(zip(items, durations))
+        totals = [sum(by_item[item] for item in shard) for shard in shards]
+        # Each item goes to the lightest shard so far, so they can't end up further apart than that.
+        self.assertLessEqual(max(totals) - min(totals), max(durations))
+
+    def test_unknown_durations(self):
+        """Test that tests with no recorded duration are given the average one."""
+        items = ['slow', 'a', 'b', 'c', 'd', 'e']
+        shards = self.shards(items, [10.0, 2.0, None, None, None, None])
+        self.assertPartitioned(items, shards)
+        self.assertIn(['slow'], shards)
+
+    def test_no_durations(self):
+        items = ['test_%d' % i for i in range(10)]
+        shards = self.shards(items, [None] * len(items))
+        self.assertPartitioned(items, shards)
+        self.assertEqual([3, 3, 2, 2], [len(shard) for shard in shards])
+
+    def test_empty_shards(self):
+        shards = self.shards(['a', 'b'], [1.0, 1.0])
+        self.assertEqual([['a'], ['b'], [], []], shards)
+        self.assertEqual(['shard-2-empty.xml', 'shard-3-empty.xml'],
+                         sorted(os.listdir(self.env['RESULTS_FILE'])))
+
+    def test_one_shard(self):
+        with mock.patch.dict(os.environ, {'TEST_TOTAL_SHARDS': '1', 'TEST_SHARD_INDEX': '0'}):
+            self.assertEqual(['a', 'b'], pex.shard(['a', 'b'], [None, 1.0]))
+
+    def test_invalid_shard(self):
+        with mock.patch.dict(os.environ, {'TEST_TOTAL_SHARDS': '2', 'TEST_SHARD_INDEX': '2'}):
+            with self.assertRaises(ValueError):
+                pex.test_shard()
+
+    def test_test_cases(self):
+        """Test sharding the test cases in this file, as the unittest runner does."""
+        tests = [test.id() for test, _ in pex.list_classes(pex.get_suite([]))]
+        timings = os.path.join(self.tmp, 'test.timings')
+        with open(timings, 'w') as f:
+            json.dump({test: float(i) for i, test in enumerate(tests)}, f)
+        with mock.patch.object(pex, '_DURATIONS', None), \
+                mock.patch.dict(os.environ, {'PEX_TEST_TIMINGS': timings}):
+            durations = pex.test_durations()
+        self.assertPartitioned(tests, self.shards(tests, [durations[test] for test in tests]))
@@ -0,0 +1,105 @@
+"""Tests on running a test pex's tests in parallel worker processes (PEX_TEST_WORKERS)."""
+
+import os
+import signal
+import tempfile
+import unittest
+from unittest import mock
+from xml.etree import ElementTree
+
+import __main__ as pex
+
+
+def run_group(group, index):
+    """Runs a 'group of tests', each of which is the number of failures or something to do."""
+    failures = 0
+    for test in group:
+        if test == 'kill':
+            os.kill(os.getpid(), signal.SIGKILL)
+        elif test == 'raise':
+            raise RuntimeError('this worker is broken')
+        elif test == 'exit':
+            raise SystemExit(3)
+        failures += test
+    return failures
+
+
+def run_group_with_coverage(group, index):
+    """Runs a 'group of tests' that each cover the given lines of a file named after the worker."""
+    pex.COVERAGE.get_data().add_lines({'/src/worker_%d.py' % index: group, '/src/common.py': group})
+    return 0
+
+
+class FakeCoverage:
+    """Stands in for a coverage.Coverage that's collecting data in memory."""
+
+    def __init__(self):
+        from coverage import CoverageData
+        self.data = CoverageData(no_disk=True)
+
+    def stop(self):
+        pass
+
+    def get_data(self):
+        return self.data
+
+
+class TestWorkersTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.results = os.path.join(tmp.name, 'test.results')
+        patcher = mock.patch.dict(os.environ, {'RESULTS_FILE': self.results})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_in_workers(self, groups, run=run_group):
+        # Make sure the workers can't hang the test indefinitely.
+        signal.signal(signal.SIGALRM, lambda *args: self.fail('Timed out waiting for workers'))
+        signal.alarm(60)
+        try:
+            return pex.run_in_workers(groups, run)
+        finally:
+            signal.alarm(0)
+
+    def crash_reports(self):
+        """Returns the error messages of the crash reports in the results, by worker."""
+        reports = {}
+        for filename in sorted(os.listdir(self.results)):
+            tree = ElementTree.parse(os.path.join(self.results, filename))
+            self.assertEqual('1', tree.getroot().get('errors'))
+            reports[filename] = [error.get('message') for error in tree.iter('error')]
+        return reports
+
+    def test_failures_totalled(self):
+        self.assertEqual(0, self.run_in_workers([[0, 0], [0]]))
+        self.assertEqual(5, self.run_in_workers([[1, 2], [0], [2]]))
+        self.assertFalse(os.path.exists(self.results))
+
+    def test_exit(self):
+        self.assertEqual(4, self.run_in_workers([[1], ['exit']]))
+        self.assertFalse(os.path.exists(self.results))
+
+    def test_killed(self):
+        """Test that a worker that's killed outright is reported as a failure."""
+        self.assertEqual(2, self.run_in_workers([[1], [0, 'kill'], [0]]))
+        reports = self.crash_reports()
+        self.assertEqual(['worker-1-crash.xml'], list(reports))
+        self.assertRegex(reports['worker-1-crash.xml'][0], r'Test worker 1 exited abnormally')
+
+    def test_exception(self):
+        self.assertEqual(2, self.run_in_workers([['raise'], ['kill']]))
+        self.assertEqual(['worker-0-crash.xml', 'worker-1-crash.xml'], list(self.crash_reports()))
+
+    def test_coverage_merged(self):
+        """Test that the coverage that each worker collects is merged into ours."""
+        coverage = FakeCoverage()
+        coverage.get_data().add_lines({'/src/common.py': [10]})
+        with mock.patch.object(pex, 'COVERAGE', coverage):
+            self.assertEqual(0, self.run_in_workers([[1, 2], [3], [4, 5]], run_group_with_coverage))
+        data = coverage.get_data()
+        workers = {'/src/worker_0.py', '/src/worker_1.py', '/src/worker_2.py'}
+        self.assertEqual({'/src/common.py'} | workers, set(data.measured_files()))
+        self.assertEqual([1, 2, 3, 4, 5, 10], sorted(data.lines('/src/common.py')))
+        self.assertEqual([3], data.lines('/src/worker_1.py'))
@@ -0,0 +1,29 @@
+import unittest
+from unittest import FunctionTestCase, TestCase
+
+# Imported test classes have their tests loaded from here too.
+from test.unittest_selection.beta import BetaTest
+
+
+class AlphaTest(unittest.TestCase):
+    def test_one(self):
+        pass
+
+    def test_one_more(self):
+        pass
+
+    def test_two(self):
+        pass
+
+
+class AlphaOtherTest(TestCase):
+    def test_one(self):
+        pass
+
+    def runTest(self):
+        pass
+
+
+class AlphaRunTest(TestCase):
+    def runTest(self):
+        pass
@@ -0,0 +1,13 @@
+import unittest
+
+
+class CustomTest(unittest.TestCase):
+    def test_loaded(self):
+        pass
+
+    def test_not_loaded(self):
+        pass
+
+
+def load_tests(loader, tests, pattern):
+    return unittest.TestSuite([CustomTest('test_loaded')])
@@ -0,0 +1,9 @@
+import unittest
+
+# SharedTest is named after the module it comes from, which isn't one of the test modules.
+from test.unittest_selection.shared import SharedTest
+
+
+class GammaTest(unittest.TestCase):
+    def test_one(self):
+        pass
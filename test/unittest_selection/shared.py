@@ -0,0 +1,7 @@
+import unittest
+
+
+# This isn't one of the test modules, but it's imported into one.
+class SharedTest(unittest.TestCase):
+    def test_shared(self):
+        pass
@@ -0,0 +1,106 @@
+"""Tests on how the unittest runner selects the tests named on the command line."""
+
+import unittest
+from unittest import mock
+
+import __main__ as pex
+
+MODULES = [
+    'test/unittest_selection/alpha.py',
+    'test/unittest_selection/beta.py',
+    'test/unittest_selection/custom.py',
+    'test/unittest_selection/pkg/gamma.py',
+]
+
+
+class Loader(unittest.TestLoader):
+    """Loads tests the way Python 3.11+ does, which skips unittest's own classes."""
+
+    def loadTestsFromTestCase(self, testCaseClass):
+        if testCaseClass in (unittest.TestCase, unittest.FunctionTestCase):
+            return self.suiteClass()
+        return super().loadTestsFromTestCase(testCaseClass)
+
+
+class UnittestSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(pex, 'TEST_NAMES', MODULES)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def select(self, *test_names):
+        """Returns the ids of the tests selected, checking them against filtering all of them."""
+        selected = [test.id() for test, _ in pex.list_classes(pex.get_suite(list(test_names)))]
+        self.assertEqual(len(selected), len(set(selected)))
+        loader = Loader()
+        expected = {
+            test.id()
+            for module in pex.import_tests()
+            for test, name in pex.list_classes(loader.loadTestsFromModule(module))
+            if any(test_name in name for test_name in test_names)
+        }
+        self.assertEqual(expected, set(selected))
+        return sorted(test_id.rpartition('unittest_selection.')[2] for test_id in selected)
+
+    def test_exact_name(self):
+        self.assertEqual(['alpha.AlphaTest.test_two'],
+                         self.select('test.unittest_selection.alpha.AlphaTest.test_two'))
+
+    def test_full_name(self):
+        """Test the names as list_classes gives them, with the module name twice."""
+        name = 'test.unittest_selection.pkg.gamma.test.unittest_selection.pkg.gamma.GammaTest'
+        self.assertEqual(['pkg.gamma.GammaTest.test_one'], self.select(name + '.test_one'))
+
+    def test_prefix(self):
+        self.assertEqual(['alpha.AlphaTest.test_one', 'alpha.AlphaTest.test_one_more'],
+                         self.select('AlphaTest.test_on'))
+
+    def test_class(self):
+        self.assertEqual(['alpha.AlphaOtherTest.test_one'], self.select('AlphaOtherTest'))
+
+    def test_class_and_method(self):
+        self.assertEqual(['alpha.AlphaOtherTest.test_one', 'alpha.AlphaTest.test_one',
+                          'alpha.AlphaTest.test_one_more', 'beta.BetaTest.test_one',
+                          'pkg.gamma.GammaTest.test_one'],
+                         self.select('Test.test_one'))
+
+    def test_run_test(self):
+        self.assertEqual(['alpha.AlphaRunTest.runTest'], self.select('AlphaRunTest'))
+
+    def test_several_names(self):
+        self.assertEqual(['alpha.AlphaTest.test_two', 'beta.BetaTest.test_one'],
+                         self.select('AlphaTest.test_two', 'beta.BetaTest', 'test_two'))
+
+    def test_module(self):
+        self.assertEqual(['beta.BetaTest.test_one'], self.select('unittest_selection.beta'))
+
+    def test_package(self):
+        self.assertEqual(['pkg.gamma.GammaTest.test_one'], self.select('unittest_selection.pkg'))
+
+    def test_imported_class(self):
+        """Test that a class imported into another test module is only selected once."""
+        self.assertEqual(['beta.BetaTest.test_one'], self.select('BetaTest'))
+
+    def test_class_from_unlisted_module(self):
+        """Test that a class imported from a module that isn't a test module is found, although
+        it's named after that module rather than the one it's imported into."""
+        self.assertEqual(['shared.SharedTest.test_shared'], self.select('SharedTest'))
+        self.assertEqual(['shared.SharedTest.test_shared'],
+                         self.select('unittest_selection.shared.SharedTest'))
+        self.assertEqual(['shared.SharedTest.test_shared'],
+                         self.select('unittest_selection.shared'))
+
+    def test_imported_base_classes(self):
+        """Test that unittest's own classes aren't taken as tests, as loadTestsFromModule does."""
+        with self.assertRaises(Exception):
+            pex.get_suite(['FunctionTestCase', 'unittest.case'], raise_on_empty=True)
+
+    def test_load_tests(self):
+        self.assertEqual(['custom.CustomTest.test_loaded'], self.select('CustomTest'))
+        self.assertEqual([], self.select('CustomTest.test_not_loaded'))
+
+    def test_no_match(self):
+        self.assertEqual([], self.select('NoSuchTest'))
+        with self.assertRaisesRegex(Exception, 'No matching tests found'):
+            pex.get_suite(['NoSuchTest'], raise_on_empty=True)
@@ -0,0 +1,74 @@
+"""Measures the start-up latency of a pex when many copies of it are launched simultaneously.
+
+Each round launches the given number of processes at once and reports the distribution of the
+time each one took to complete. The first round starts from an empty pex cache (unless --warm is
+given) so includes the cost of exploding the pex; subsequent rounds start with it already in place.
+
+Usage:
+    plz run //tools/please_pex/benchmark:concurrent_start -- -n 200 plz-out/bin/tools/please_pex/benchmark/hello.pex
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+
+
+def launch(pex, env, barrier, results, i):
+    barrier.wait()
+    start = time.perf_counter()
+    subprocess.run([pex], env=env, check=True, stdout=subprocess.DEVNULL)
+    results[i] = time.perf_counter() - start
+
+
+def run_round(pex, env, processes):
+    """Starts the given number of processes at the same time and returns their latencies."""
+    results = [0.0] * processes
+    barrier = threading.Barrier(processes)
+    threads = [threading.Thread(target=launch, args=(pex, env, barrier, results, i)) for i in range(processes)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def percentile(latencies, p):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))]
+
+
+def report(name, latencies, wall):
+    latencies = sorted(latencies)
+    print('%-6s n=%d wall=%.3fs mean=%.3fs p50=%.3fs p90=%.3fs p99=%.3fs max=%.3fs' % (
+        name, len(latencies), wall, statistics.mean(latencies), percentile(latencies, 50),
+        percentile(latencies, 90), percentile(latencies, 99), latencies[-1],
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('pex', help='The pex to launch; it should exit promptly')
+    parser.add_argument('-n', '--processes', type=int, default=50, help='Number of simultaneous launches')
+    parser.add_argument('-r', '--rounds', type=int, default=3, help='Number of rounds to run')
+    parser.add_argument('--warm', action='store_true', help='Populate the pex cache before the first round')
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp(prefix='pex_bench_')
+    env = dict(os.environ, PEX_CACHE_DIR=cache_dir)
+    try:
+        if args.warm:
+            subprocess.run([args.pex], env=env, check=True, stdout=subprocess.DEVNULL)
+        for i in range(args.rounds):
+            latencies, wall = run_round(args.pex, env, args.processes)
+            report('warm' if i > 0 or args.warm else 'cold', latencies, wall)
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
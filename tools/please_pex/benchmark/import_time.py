@@ -0,0 +1,54 @@
+"""Compares the start-up time of a pex importing from its code archive and from the zip file.
+
+The pex should have been built with the CodeArchive option set, and should exit promptly; each
+round runs it once with PEX_CODE_ARCHIVE=1 and once with PEX_CODE_ARCHIVE=0 (i.e. importing
+through zipimport as usual), in alternating order so neither is favoured by the other warming
+the page cache.
+
+Usage:
+    plz -o python.codearchive:true build //tools/please_pex/benchmark:imports
+    plz run //tools/please_pex/benchmark:import_time -- plz-out/bin/tools/please_pex/benchmark/imports.pex
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import time
+
+
+MODES = {'code archive': '1', 'zipimport': '0'}
+
+
+def run(pex, mode):
+    """Runs the pex once and returns how long it took."""
+    env = dict(os.environ, PEX_CODE_ARCHIVE=MODES[mode])
+    start = time.perf_counter()
+    subprocess.run([pex], env=env, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('pex', help='The pex to run')
+    parser.add_argument('-r', '--rounds', type=int, default=20, help='Number of times to run it in each mode')
+    args = parser.parse_args()
+
+    for mode in MODES:
+        run(args.pex, mode)  # Warm up the page cache and the extension module cache.
+    results = {mode: [] for mode in MODES}
+    for i in range(args.rounds):
+        for mode in (list(MODES) if i % 2 else reversed(MODES)):
+            results[mode].append(run(args.pex, mode))
+    for mode, latencies in results.items():
+        latencies.sort()
+        print('%-12s n=%d mean=%.1fms p50=%.1fms min=%.1fms max=%.1fms' % (
+            mode, len(latencies), statistics.mean(latencies) * 1000,
+            latencies[len(latencies) // 2] * 1000, latencies[0] * 1000, latencies[-1] * 1000,
+        ))
+    speedup = statistics.median(results['zipimport']) / statistics.median(results['code archive'])
+    print('code archive is %.2fx as fast as zipimport' % speedup)
+
+
+if __name__ == '__main__':
+    main()
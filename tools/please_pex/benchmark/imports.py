@@ -0,0 +1,7 @@
+import google.protobuf.descriptor_pb2
+import google.protobuf.json_format
+import packaging.requirements
+import packaging.specifiers
+import packaging.version
+import pygments.formatters.html
+import pygments.lexers.python
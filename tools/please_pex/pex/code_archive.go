@@ -0,0 +1,40 @@
+package pex
+
+import (
+	"bytes"
+	"fmt"
+	"os"
+	"os/exec"
+	"path/filepath"
+)
+
+// codeArchivePath is the zip file member within the .pex archive containing the marshalled code
+// objects of its pure-Python modules, which plz.py imports them from at run time.
+const codeArchivePath = ".bootstrap/PLZ_CODE_ARCHIVE"
+
+// buildCodeArchive runs code_archive.py with the given interpreter to compile the pure-Python
+// modules in the build directory rooted at dir (and the dependencies in it) into a code archive.
+// Modules under any of the given roots are left out.
+func buildCodeArchive(interpreter string, optimisationLevel int, dir, out string, exclude []string) ([]byte, error) {
+	out, err := filepath.Abs(out)
+	if err != nil {
+		return nil, err
+	}
+	args := []string{"-S"}
+	for i := 0; i < optimisationLevel; i++ {
+		args = append(args, "-O")
+	}
+	args = append(args, "-", "--out", out)
+	for _, root := range exclude {
+		args = append(args, "--exclude", root)
+	}
+	cmd := exec.Command(interpreter, args...)
+	cmd.Dir = dir
+	cmd.Stdin = bytes.NewReader(mustRead("code_archive.py"))
+	cmd.Stderr = os.Stderr
+	archive, err := cmd.Output()
+	if err != nil {
+		return nil, fmt.Errorf("run %s: %w", interpreter, err)
+	}
+	return archive, nil
+}
@@ -0,0 +1,110 @@
+"""Builds the code archive that code_archive_import.CodeArchiveImport imports modules from.
+
+please_pex runs this at build time, from the root of the pex's build directory, with the same
+interpreter that the pex will be run with (code objects are specific to an interpreter version).
+It compiles every pure-Python module in the build directory and in the zipped dependencies in it
+(except those under the roots given with --exclude) and writes the archive to stdout.
+
+The archive consists of:
+  - MAGIC, followed by importlib's 4-byte bytecode magic number;
+  - the length of the index, as a 4-byte little-endian integer;
+  - the index, which is a marshalled dict mapping each module's path (e.g. "foo/bar" for either
+    foo/bar.py or foo/bar/__init__.py) to an (offset, length, is_package, filename) tuple;
+  - the marshalled code objects, at the given offsets from the end of the index.
+"""
+
+import argparse
+import functools
+import importlib.util
+import marshal
+import os
+import struct
+import sys
+import zipfile
+
+
+MAGIC = b'PLZCODE1'
+DEPENDENCY_SUFFIXES = ('.pex.zip', '.whl')
+
+
+def sources(out):
+    """Yields the filename and a function returning the contents of every .py and .pyc file that
+    will end up in the pex."""
+    for dirpath, dirnames, filenames in os.walk('.'):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(dirpath, filename)
+            if os.path.abspath(path) == out:
+                continue
+            elif filename.endswith(DEPENDENCY_SUFFIXES):
+                with zipfile.ZipFile(path) as zf:
+                    for info in zf.infolist():
+                        if info.filename.endswith(('.py', '.pyc')):
+                            yield info.filename, lambda zf=zf, info=info: zf.read(info)
+            elif filename.endswith('.py'):
+                rel = os.path.relpath(path).replace(os.sep, '/')
+                yield rel, functools.partial(_read_file, path)
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def module_path(filename):
+    """Returns the module path for the given file, or None if it isn't an importable module."""
+    name = filename.rpartition('.')[0]
+    parts = name.split('/')
+    if not all(part.isidentifier() for part in parts):
+        return None
+    return name[:-len('/__init__')] if parts[-1] == '__init__' else name
+
+
+def excluded(path, excludes):
+    return any(path == root or path.startswith(root + '/') for root in excludes)
+
+
+def build(out, excludes):
+    """Returns the code archive."""
+    modules = {}
+    for filename, read in sources(out):
+        path = module_path(filename)
+        if path is None or excluded(path, excludes):
+            continue
+        is_source = filename.endswith('.py')
+        existing = modules.get(path)
+        if existing and (existing[0].endswith('.py') or not is_source):
+            continue  # Prefer sources over bytecode, and the first of any duplicates.
+        contents = read()
+        if is_source:
+            try:
+                code = marshal.dumps(compile(contents, filename, 'exec', dont_inherit=True))
+            except (SyntaxError, ValueError):
+                continue  # Leave it to be imported (and fail) as normal.
+        elif contents[:4] == importlib.util.MAGIC_NUMBER:
+            code = contents[16:]  # Skip the header; the rest is the marshalled code object.
+        else:
+            continue  # Bytecode for another interpreter version is no use to us.
+        modules[path] = (filename, code)
+    index = {}
+    offset = 0
+    for path, (filename, code) in sorted(modules.items()):
+        is_package = filename.rpartition('/')[2].startswith('__init__.')
+        index[path] = (offset, len(code), is_package, filename)
+        offset += len(code)
+    index = marshal.dumps(index)
+    header = MAGIC + importlib.util.MAGIC_NUMBER + struct.pack('<I', len(index))
+    return b''.join([header, index] + [code for _, (_, code) in sorted(modules.items())])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--out', required=True, help='The pex being written, which is ignored')
+    parser.add_argument('--exclude', action='append', default=[],
+                        help='Module paths to exclude, along with everything under them')
+    args = parser.parse_args()
+    sys.stdout.buffer.write(build(os.path.abspath(args.out), args.exclude))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Imports pure-Python modules from the pex's code archive, if please_pex wrote one.
+
+This is imported on demand, by plz.install_code_archive, for pexes that have a code archive.
+"""
+
+from importlib import machinery
+from importlib.util import decode_source, MAGIC_NUMBER
+import _imp
+import marshal
+import os
+import struct
+import sys
+
+from plz import CODE_ARCHIVE_PATH
+import pex_resources
+
+
+# Like the import hooks in plz, this doesn't subclass importlib.abc.MetaPathFinder, so that
+# importlib.abc needn't be imported.
+class CodeArchiveImport:
+    """Imports pure-Python modules from the pex's code archive.
+
+    The code archive is a single uncompressed member of the pex containing the marshalled code
+    objects of its pure-Python modules, which please_pex writes if it's asked to (see
+    code_archive.py for its format). Importing from it needs a single dict lookup and a
+    marshal.loads of a slice of the mmapped pex, instead of zipimport's lookup, read and
+    decompression (and unmarshalling) of each module. Modules are still imported under the same
+    names and with the same __file__ and __path__ as they would have by zipimport, so anything not
+    in the archive is found by the usual import machinery instead.
+    """
+
+    MAGIC = b'PLZCODE1'
+    _HEADER = struct.Struct('<8s4sI')
+
+    def __init__(self, pex_file, archive):
+        self.pex_file = pex_file
+        self._prefix = pex_file + os.sep
+        _, _, index_size = self._HEADER.unpack_from(archive)
+        start = self._HEADER.size + index_size
+        self._index = marshal.loads(archive[self._HEADER.size:start])
+        self._code = archive[start:]
+        # Maps the names of modules we've found to their index entry and location.
+        self._found = {}
+
+    @classmethod
+    def load(cls, pex_file):
+        """Returns a CodeArchiveImport for the given pex, or None if it doesn't have a code archive
+        that this interpreter can use."""
+        try:
+            # We keep hold of it ourselves, so there's no need for it to be cached as well.
+            archive = pex_resources.get_resources(pex_file).get(CODE_ARCHIVE_PATH, cache=False)
+        except FileNotFoundError:
+            return None
+        if len(archive) < cls._HEADER.size:
+            return None
+        magic, bytecode_magic, _ = cls._HEADER.unpack_from(archive)
+        if magic != cls.MAGIC or bytecode_magic != MAGIC_NUMBER:
+            return None  # Built by a different version of Python.
+        return cls(pex_file, archive)
+
+    def find_spec(self, name, path, target=None):
+        """Implements abc.MetaPathFinder."""
+        basename = name.rpartition('.')[2]
+        for entry in sys.path if path is None else path:
+            if entry == self.pex_file:
+                key = basename
+            elif entry.startswith(self._prefix):
+                key = entry[len(self._prefix):].replace(os.sep, '/') + '/' + basename
+            else:
+                continue
+            found = self._index.get(key)
+            if found is not None:
+                filename = os.path.join(self.pex_file, found[3].replace('/', os.sep))
+                self._found[name] = found, filename
+                spec = machinery.ModuleSpec(name, self, origin=filename, is_package=found[2])
+                spec.has_location = True
+                if found[2]:
+                    spec.submodule_search_locations = [os.path.dirname(filename)]
+                return spec
+
+    def create_module(self, spec):
+        """Uses the default module creation semantics."""
+
+    def exec_module(self, module):
+        """Implements abc.Loader."""
+        exec(self.get_code(module.__spec__.name), module.__dict__)
+
+    def _lookup(self, fullname):
+        found = self._found.get(fullname)
+        if found is None:
+            parent = fullname.rpartition('.')[0]
+            if not self.find_spec(fullname, sys.modules[parent].__path__ if parent else None):
+                raise ImportError('%s is not in the code archive' % fullname, name=fullname)
+            found = self._found[fullname]
+        return found
+
+    def get_code(self, fullname):
+        (offset, length, _, _), filename = self._lookup(fullname)
+        code = marshal.loads(self._code[offset:offset + length])
+        _imp._fix_co_filename(code, filename)
+        return code
+
+    def get_source(self, fullname):
+        (_, _, _, member), _ = self._lookup(fullname)
+        if not member.endswith('.py'):
+            return None
+        try:
+            contents = pex_resources.get_resources(self.pex_file).get(member, cache=False)
+            return decode_source(bytes(contents))
+        except FileNotFoundError:
+            return None  # The source has been stripped from the pex.
+
+    def get_filename(self, fullname):
+        return self._lookup(fullname)[1]
+
+    def is_package(self, fullname):
+        return self._lookup(fullname)[0][2]
+
+    def get_data(self, path):
+        if not path.startswith(self._prefix):
+            raise OSError('%s is not in %s' % (path, self.pex_file))
+        name = path[len(self._prefix):].replace(os.sep, '/')
+        return bytes(pex_resources.get_resources(self.pex_file).get(name, cache=False))
+
+    def get_resource_reader(self, fullname):
+        found, filename = self._lookup(fullname)
+        if not found[2]:
+            return None
+        package_dir = os.path.dirname(filename)[len(self._prefix):].replace(os.sep, '/')
+        return pex_resources.resource_reader(
+            pex_resources.get_resources(self.pex_file).files(package_dir))
+
+
+def install(pex_file):
+    """Imports modules from the given pex's code archive, if it has one that we can use."""
+    finder = CodeArchiveImport.load(pex_file)
+    if finder is not None:
+        sys.meta_path.insert(sys.meta_path.index(machinery.PathFinder), finder)
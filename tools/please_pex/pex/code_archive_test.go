@@ -0,0 +1,55 @@
+package pex
+
+import (
+	"bytes"
+	"encoding/json"
+	"os"
+	"os/exec"
+	"path/filepath"
+	"testing"
+
+	"github.com/stretchr/testify/assert"
+	"github.com/stretchr/testify/require"
+)
+
+// listArchive prints the index of a code archive (read from stdin) as JSON.
+const listArchive = `
+import json, marshal, struct, sys
+archive = sys.stdin.buffer.read()
+_, _, size = struct.unpack_from('<8s4sI', archive)
+index = marshal.loads(archive[16:16 + size])
+code = archive[16 + size:]
+for path, (offset, length, _, _) in index.items():
+    marshal.loads(code[offset:offset + length])
+json.dump({path: [is_package, filename] for path, (_, _, is_package, filename) in index.items()}, sys.stdout)
+`
+
+func TestBuildCodeArchive(t *testing.T) {
+	python, err := exec.LookPath("python3")
+	if err != nil {
+		t.Skip("python3 is not available")
+	}
+	dir := t.TempDir()
+	writeZip(t, filepath.Join(dir, "third_party/python/.six.pex.zip"), "third_party/python/six.py", "third_party/python/six-1.16.0.dist-info/METADATA")
+	writeZip(t, filepath.Join(dir, "third_party/python/numpy.whl"), "third_party/python/numpy/__init__.py", "third_party/python/numpy/core/multiarray.so")
+	require.NoError(t, os.MkdirAll(filepath.Join(dir, "app"), 0755))
+	require.NoError(t, os.WriteFile(filepath.Join(dir, "app/__init__.py"), nil, 0644))
+	require.NoError(t, os.WriteFile(filepath.Join(dir, "app/main.py"), []byte("import six\n"), 0644))
+	require.NoError(t, os.WriteFile(filepath.Join(dir, "app/broken.py"), []byte("def ("), 0644))
+	out := filepath.Join(dir, ".main.pex.zip")
+	writeZip(t, out, "__main__.py")
+
+	archive, err := buildCodeArchive(python, 0, dir, out, []string{".bootstrap", "third_party/python/numpy"})
+	require.NoError(t, err)
+	cmd := exec.Command(python, "-c", listArchive)
+	cmd.Stdin = bytes.NewReader(archive)
+	b, err := cmd.Output()
+	require.NoError(t, err)
+	var index map[string][]interface{}
+	require.NoError(t, json.Unmarshal(b, &index))
+	assert.Equal(t, map[string][]interface{}{
+		"app":                    {true, "app/__init__.py"},
+		"app/main":               {false, "app/main.py"},
+		"third_party/python/six": {false, "third_party/python/six.py"},
+	}, index)
+}
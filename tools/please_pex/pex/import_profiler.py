@@ -0,0 +1,177 @@
+"""Measures how long each module takes to import, and how much memory importing it allocates.
+
+This is enabled by setting PEX_IMPORT_PROFILE to a filename. A report sorted by cost is written to
+that file, and a collapsed stack file (which flamegraph.pl, speedscope etc. understand) is written
+alongside it with a .collapsed suffix.
+
+Imports are timed by wrapping importlib's _find_and_load, which is the same point that
+`python -X importtime` measures at. Modules imported under the module directory are reported
+under their top-level names, so `third_party.python.six` and `six` are counted as the one module
+they really are (see plz.ModuleDirImport).
+"""
+
+from importlib import _bootstrap
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+@contextlib.contextmanager
+def profile(filename, module_dir, roots):
+    """Profiles the imports made while the context is active, reporting on them in filename."""
+    profiler = ImportProfiler(module_dir, roots)
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        sys.stderr.write('Writing import profile to %s\n' % filename)
+        profiler.write(filename)
+
+
+class _Import:
+    """An import that is in progress."""
+
+    __slots__ = ('name', 'start', 'memory', 'child_time', 'child_memory')
+
+    def __init__(self, name):
+        self.name = name
+        self.child_time = 0.0
+        self.child_memory = 0
+
+
+class _Stats:
+    """The costs of importing a single module."""
+
+    __slots__ = ('self_time', 'total_time', 'self_memory', 'total_memory', 'origin')
+
+    def __init__(self, origin):
+        self.self_time = 0.0
+        self.total_time = 0.0
+        self.self_memory = 0
+        self.total_memory = 0
+        self.origin = origin
+
+
+class ImportProfiler:
+    """Records the time taken and memory allocated by every import while it's running.
+
+    Each import's own (self) cost excludes the cost of the imports it triggers itself, which are
+    included in its cumulative cost. Modules are attributed to a package (their top-level name)
+    and an origin, which is one of "third-party" (under the module directory), "first-party"
+    (elsewhere in the pex), "external" (the standard library or the interpreter's site-packages)
+    or "builtin".
+    """
+
+    def __init__(self, module_dir, roots):
+        self.prefix = module_dir.replace('/', '.') + '.'
+        self.module_dir = os.sep + module_dir.replace('/', os.sep) + os.sep
+        self.roots = tuple(root + os.sep for root in roots)
+        self.stats = {}
+        self.stacks = collections.Counter()
+        self._local = threading.local()
+        self._find_and_load = None
+        self._trace_memory = False
+
+    def start(self):
+        """Starts profiling imports."""
+        self._trace_memory = not tracemalloc.is_tracing()
+        if self._trace_memory:
+            tracemalloc.start()
+        self._find_and_load = _bootstrap._find_and_load
+        _bootstrap._find_and_load = self._profile_find_and_load
+
+    def stop(self):
+        """Stops profiling imports."""
+        _bootstrap._find_and_load = self._find_and_load
+        if self._trace_memory:
+            tracemalloc.stop()
+
+    def _profile_find_and_load(self, name, import_):
+        if name in sys.modules:
+            return self._find_and_load(name, import_)  # Nothing to measure.
+        canonical = name[len(self.prefix):] if name.startswith(self.prefix) else name
+        stack = self._stack()
+        if stack and stack[-1].name == canonical:
+            # ModuleDirImport is importing the module under its other name on behalf of the
+            # import we're already measuring.
+            return self._find_and_load(name, import_)
+        current = _Import(canonical)
+        stack.append(current)
+        current.memory = tracemalloc.get_traced_memory()[0]
+        current.start = time.perf_counter()
+        try:
+            return self._find_and_load(name, import_)
+        finally:
+            elapsed = time.perf_counter() - current.start
+            allocated = tracemalloc.get_traced_memory()[0] - current.memory
+            stack.pop()
+            self._record(stack, current, elapsed, allocated, sys.modules.get(name))
+            if stack:
+                stack[-1].child_time += elapsed
+                stack[-1].child_memory += allocated
+
+    def _stack(self):
+        """Returns the stack of imports in progress on the current thread."""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, stack, current, elapsed, allocated, module):
+        stats = self.stats.get(current.name)
+        if stats is None:
+            stats = self.stats[current.name] = _Stats(self._origin(module))
+        self_time = elapsed - current.child_time
+        stats.self_time += self_time
+        stats.total_time += elapsed
+        stats.self_memory += allocated - current.child_memory
+        stats.total_memory += allocated
+        names = [frame.name for frame in stack] + [current.name]
+        self.stacks[';'.join(names)] += max(0, round(self_time * 1e6))
+
+    def _origin(self, module):
+        filename = getattr(module, '__file__', None)
+        if not filename:
+            return 'builtin'
+        elif self.module_dir in os.sep + filename:
+            return 'third-party'
+        elif filename.startswith(self.roots):
+            return 'first-party'
+        return 'external'
+
+    def write(self, filename):
+        """Writes the report to the given file, and the collapsed stacks alongside it."""
+        packages = {}
+        for name, stats in self.stats.items():
+            key = (name.partition('.')[0], stats.origin)
+            package = packages.setdefault(key, [0.0, 0, 0])
+            package[0] += stats.self_time
+            package[1] += stats.self_memory
+            package[2] += 1
+        total_time = sum(stats.self_time for stats in self.stats.values())
+        total_memory = sum(stats.self_memory for stats in self.stats.values())
+        with open(filename, 'w') as f:
+            f.write('%d modules imported in %.1f ms, allocating %.1f KiB\n\n' % (
+                len(self.stats), total_time * 1000, total_memory / 1024))
+            f.write('By package:\n')
+            f.write('%10s %10s %8s  %-12s %s\n' % (
+                'self ms', 'self KiB', 'modules', 'origin', 'package'))
+            for (package, origin), (t, memory, count) in sorted(packages.items(),
+                                                                key=lambda x: -x[1][0]):
+                f.write('%10.2f %10.1f %8d  %-12s %s\n' % (
+                    t * 1000, memory / 1024, count, origin, package))
+            f.write('\nBy module:\n')
+            f.write('%10s %10s %10s %10s  %-12s %s\n' % (
+                'self ms', 'cumul ms', 'self KiB', 'cumul KiB', 'origin', 'module'))
+            for name, stats in sorted(self.stats.items(), key=lambda x: -x[1].self_time):
+                f.write('%10.2f %10.2f %10.1f %10.1f  %-12s %s\n' % (
+                    stats.self_time * 1000, stats.total_time * 1000, stats.self_memory / 1024,
+                    stats.total_memory / 1024, stats.origin, name))
+        with open(filename + '.collapsed', 'w') as f:
+            for stack, microseconds in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, microseconds))
@@ -0,0 +1,167 @@
+package pex
+
+import (
+	"archive/zip"
+	"encoding/json"
+	"hash/crc32"
+	"io/fs"
+	"os"
+	"path"
+	"path/filepath"
+	"regexp"
+	"sort"
+	"strings"
+
+	pexzip "github.com/please-build/python-rules/tools/please_pex/zip"
+)
+
+// indexPath is the zip file member within the .pex archive containing the index of its contents.
+// plz.py reads this at run time instead of scanning the archive's central directory.
+const indexPath = ".bootstrap/PLZ_PEX_INDEX"
+
+// distributionsPath is the zip file member within the .pex archive containing the index's
+// distributions. These are kept separately because they're only needed by programs that look up
+// distribution metadata, whereas the rest of the index is read every time the .pex starts.
+const distributionsPath = ".bootstrap/PLZ_PEX_DISTRIBUTIONS"
+
+// extensionSuffixes are the suffixes of files that might be Python extension modules. The import
+// hooks filter these further against the run-time interpreter's extension suffixes.
+var extensionSuffixes = []string{".so", ".pyd"}
+
+// nativeSuffixes are the suffixes of files containing native code. Versioned shared libraries
+// (e.g. libfoo.so.1) are also detected separately.
+var nativeSuffixes = []string{".so", ".pyd", ".dylib"}
+
+// dependencySuffixes are the suffixes of the pre-zipped dependencies that are combined into the
+// final .pex; these match the suffixes passed to arcat by the python_binary and python_test rules.
+var dependencySuffixes = []string{".pex.zip", ".whl"}
+
+// An index describes the contents of a .pex that its import hooks are interested in.
+type index struct {
+	// Extensions maps members that might be extension modules to their CRC-32 checksum and
+	// uncompressed size, which identify their contents in the run-time extension module cache.
+	Extensions map[string][2]uint64 `json:"extensions"`
+	// Native is a sorted list of the top-level packages and modules (or, inside the module
+	// directory, the top-level packages and modules within it) that contain native code. These are
+	// the parts of the .pex that are extracted when it is partially exploded.
+	Native []string `json:"native"`
+	// Distributions maps a distribution's name to a mapping of paths within its dist-info or
+	// egg-info directory to the corresponding members. This is written to distributionsPath.
+	Distributions map[string]map[string]string `json:"-"`
+}
+
+// newIndex constructs an index from the given set of members.
+func newIndex(files map[string]pexzip.FileInfo, moduleDir string) *index {
+	idx := &index{
+		Extensions:    map[string][2]uint64{},
+		Native:        []string{},
+		Distributions: map[string]map[string]string{},
+	}
+	native := map[string]struct{}{}
+	distInfo := regexp.MustCompile("^" + regexp.QuoteMeta(moduleDir) + `/([^/]+)-[^/-]+?\.(?:dist|egg)-info/(.*)`)
+	for name, info := range files {
+		if hasAnySuffix(name, extensionSuffixes) {
+			idx.Extensions[name] = [2]uint64{uint64(info.CRC32), info.UncompressedSize64}
+		}
+		if isNative(name) && !strings.HasPrefix(name, ".bootstrap/") {
+			native[nativeRoot(name, moduleDir)] = struct{}{}
+		}
+		if match := distInfo.FindStringSubmatch(name); match != nil {
+			files, present := idx.Distributions[match[1]]
+			if !present {
+				files = map[string]string{}
+				idx.Distributions[match[1]] = files
+			}
+			files[match[2]] = name
+		}
+	}
+	for root := range native {
+		idx.Native = append(idx.Native, root)
+	}
+	sort.Strings(idx.Native)
+	return idx
+}
+
+// isNative returns true if the given file contains native code.
+func isNative(name string) bool {
+	return hasAnySuffix(name, nativeSuffixes) || strings.Contains(path.Base(name), ".so.")
+}
+
+// nativeRoot returns the top-level package or module containing the given file, treating the
+// module directory as if it were at the top level.
+func nativeRoot(name, moduleDir string) string {
+	prefix := ""
+	if strings.HasPrefix(name, moduleDir+"/") {
+		prefix = moduleDir + "/"
+	}
+	root, _, _ := strings.Cut(strings.TrimPrefix(name, prefix), "/")
+	return prefix + root
+}
+
+// Marshal returns the JSON encoding of the index, excluding its distributions.
+func (idx *index) Marshal() ([]byte, error) {
+	return json.Marshal(idx)
+}
+
+// MarshalDistributions returns the JSON encoding of the index's distributions.
+func (idx *index) MarshalDistributions() ([]byte, error) {
+	return json.Marshal(idx.Distributions)
+}
+
+// dependencyFiles returns a description of the members that will end up in the final .pex, given
+// the pre-zipped dependencies and other files in the build directory rooted at dir. The file at
+// path out is ignored, since it is the .pex that is currently being written. Checksums are only
+// calculated for other files if they might be extension modules.
+func dependencyFiles(dir, out string) (map[string]pexzip.FileInfo, error) {
+	files := map[string]pexzip.FileInfo{}
+	err := filepath.WalkDir(dir, func(p string, d fs.DirEntry, err error) error {
+		if err != nil || d.IsDir() || samePaths(p, out) {
+			return err
+		}
+		if !hasAnySuffix(p, dependencySuffixes) {
+			rel, err := filepath.Rel(dir, p)
+			if err != nil {
+				return err
+			}
+			var info pexzip.FileInfo
+			if hasAnySuffix(p, extensionSuffixes) {
+				b, err := os.ReadFile(p)
+				if err != nil {
+					return err
+				}
+				info = pexzip.FileInfo{CRC32: crc32.ChecksumIEEE(b), UncompressedSize64: uint64(len(b))}
+			}
+			files[filepath.ToSlash(rel)] = info
+			return nil
+		}
+		r, err := zip.OpenReader(p)
+		if err != nil {
+			return err
+		}
+		defer r.Close()
+		for _, f := range r.File {
+			if !strings.HasSuffix(f.Name, "/") {
+				files[f.Name] = pexzip.FileInfo{CRC32: f.CRC32, UncompressedSize64: f.UncompressedSize64}
+			}
+		}
+		return nil
+	})
+	return files, err
+}
+
+// hasAnySuffix returns true if s ends with any of the given suffixes.
+func hasAnySuffix(s string, suffixes []string) bool {
+	for _, suffix := range suffixes {
+		if strings.HasSuffix(s, suffix) {
+			return true
+		}
+	}
+	return false
+}
+
+// samePaths returns true if two paths refer to the same file.
+func samePaths(a, b string) bool {
+	a, errA := filepath.Abs(a)
+	b, errB := filepath.Abs(b)
+	return errA == nil && errB == nil && a == b
+}
@@ -0,0 +1,106 @@
+package pex
+
+import (
+	"archive/zip"
+	"hash/crc32"
+	"os"
+	"path/filepath"
+	"testing"
+
+	"github.com/stretchr/testify/assert"
+	"github.com/stretchr/testify/require"
+
+	pexzip "github.com/please-build/python-rules/tools/please_pex/zip"
+)
+
+func TestNewIndex(t *testing.T) {
+	idx := newIndex(map[string]pexzip.FileInfo{
+		"third_party/python/six.py":                                                       {},
+		"third_party/python/six-1.16.0.dist-info/METADATA":                                {},
+		"third_party/python/six-1.16.0.dist-info/RECORD":                                  {},
+		"third_party/python/numpy/core/_multiarray_umath.cpython-311-x86_64-linux-gnu.so": {CRC32: 1234, UncompressedSize64: 5678},
+		"third_party/python/numpy-1.26.0.dist-info/METADATA":                              {},
+		".bootstrap/coverage/tracer.cpython-311-x86_64-linux-gnu.so":                      {CRC32: 42, UncompressedSize64: 99},
+		"other/six-1.16.0.dist-info/METADATA":                                             {},
+	}, "third_party/python")
+	assert.Equal(t, map[string][2]uint64{
+		".bootstrap/coverage/tracer.cpython-311-x86_64-linux-gnu.so":                      {42, 99},
+		"third_party/python/numpy/core/_multiarray_umath.cpython-311-x86_64-linux-gnu.so": {1234, 5678},
+	}, idx.Extensions)
+	assert.Equal(t, []string{"third_party/python/numpy"}, idx.Native)
+	assert.Equal(t, map[string]map[string]string{
+		"six": {
+			"METADATA": "third_party/python/six-1.16.0.dist-info/METADATA",
+			"RECORD":   "third_party/python/six-1.16.0.dist-info/RECORD",
+		},
+		"numpy": {
+			"METADATA": "third_party/python/numpy-1.26.0.dist-info/METADATA",
+		},
+	}, idx.Distributions)
+}
+
+func TestMarshalIndex(t *testing.T) {
+	idx := newIndex(map[string]pexzip.FileInfo{
+		"third_party/python/six.py":                        {},
+		"third_party/python/six-1.16.0.dist-info/METADATA": {},
+		"third_party/python/_yaml.so":                      {CRC32: 1, UncompressedSize64: 2},
+	}, "third_party/python")
+	b, err := idx.Marshal()
+	require.NoError(t, err)
+	assert.Equal(t, `{"extensions":{"third_party/python/_yaml.so":[1,2]},"native":["third_party/python/_yaml.so"]}`, string(b))
+	b, err = idx.MarshalDistributions()
+	require.NoError(t, err)
+	assert.Equal(t, `{"six":{"METADATA":"third_party/python/six-1.16.0.dist-info/METADATA"}}`, string(b))
+}
+
+func TestNativeRoots(t *testing.T) {
+	idx := newIndex(map[string]pexzip.FileInfo{
+		"third_party/python/_cffi_backend.cpython-311-x86_64-linux-gnu.so":       {},
+		"third_party/python/numpy.libs/libopenblas64_p-r0-5007b62f.3.23.dev.so":  {},
+		"third_party/python/grpc/_cython/cygrpc.cpython-311-x86_64-linux-gnu.so": {},
+		"third_party/python/grpc/__init__.py":                                    {},
+		"third_party/python/six.py":                                              {},
+		"mycompany/native/libfoo.so.1":                                           {},
+		"mycompany/app.py":                                                       {},
+	}, "third_party/python")
+	assert.Equal(t, []string{
+		"mycompany",
+		"third_party/python/_cffi_backend.cpython-311-x86_64-linux-gnu.so",
+		"third_party/python/grpc",
+		"third_party/python/numpy.libs",
+	}, idx.Native)
+}
+
+func TestDependencyFiles(t *testing.T) {
+	dir := t.TempDir()
+	writeZip(t, filepath.Join(dir, "third_party/python/.six.pex.zip"), "third_party/python/", "third_party/python/six.py")
+	writeZip(t, filepath.Join(dir, "third_party/python/numpy.whl"), "numpy/core/_multiarray_umath.so")
+	require.NoError(t, os.WriteFile(filepath.Join(dir, "lib.so"), []byte("lib"), 0644))
+	require.NoError(t, os.WriteFile(filepath.Join(dir, "lib.py"), []byte("lib"), 0644))
+	out := filepath.Join(dir, ".main.pex.zip")
+	writeZip(t, out, "__main__.py")
+
+	files, err := dependencyFiles(dir, out)
+	require.NoError(t, err)
+	assert.Equal(t, map[string]pexzip.FileInfo{
+		"lib.py":                          {},
+		"lib.so":                          {CRC32: crc32.ChecksumIEEE([]byte("lib")), UncompressedSize64: 3},
+		"numpy/core/_multiarray_umath.so": {},
+		"third_party/python/six.py":       {},
+	}, files)
+}
+
+// writeZip writes a zip file at the given path containing empty members with the given names.
+func writeZip(t *testing.T, filename string, names ...string) {
+	t.Helper()
+	require.NoError(t, os.MkdirAll(filepath.Dir(filename), 0755))
+	f, err := os.Create(filename)
+	require.NoError(t, err)
+	defer f.Close()
+	w := zip.NewWriter(f)
+	for _, name := range names {
+		_, err := w.Create(name)
+		require.NoError(t, err)
+	}
+	require.NoError(t, w.Close())
+}
@@ -0,0 +1,242 @@
+"""Records where a program allocates its memory, using tracemalloc.
+
+This is enabled by setting PEX_MEMPROFILE to a filename. Allocations are traced from before the
+entry point is run (so the cost of importing modules is included), and a report is written to that
+file every PEX_MEMPROFILE_INTERVAL seconds (60 by default; 0 disables this) and when the program
+exits. It includes the process's peak RSS, the memory currently allocated by each package and its
+largest allocation sites, and a history of the earlier reports' totals.
+
+Each allocation is attributed to the innermost frame of its traceback that's within the pex, so
+memory allocated by the standard library on behalf of a package is counted against that package.
+Packages under the module directory are reported under their top-level names (as "third-party"),
+and other packages in the pex under theirs (as "first-party"); memory allocated by the pex's own
+startup code and import hooks is reported separately. Up to PEX_MEMPROFILE_FRAMES frames
+(10 by default) are recorded for each allocation; more frames attribute allocations more
+accurately, but make the program slower and use more memory.
+"""
+
+import collections
+import contextlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+
+# The number of allocation sites to report.
+TOP_SITES = 25
+
+
+@contextlib.contextmanager
+def profile(filename, module_dir, roots):
+    """Traces the program's memory allocations while the context is active, reporting on them in
+    filename."""
+    profiler = MemoryProfiler(
+        filename, module_dir, roots,
+        interval=float(os.environ.get('PEX_MEMPROFILE_INTERVAL', '60')),
+        frames=int(os.environ.get('PEX_MEMPROFILE_FRAMES', '10')),
+    )
+    profiler.start()
+    try:
+        yield
+    finally:
+        sys.stderr.write('Writing memory profile to %s\n' % filename)
+        profiler.stop()
+
+
+class MemoryProfiler:
+    """Takes snapshots of the memory allocated by the program while it's running."""
+
+    def __init__(self, filename, module_dir, roots, interval=60, frames=10):
+        self.filename = filename
+        self.module_dir = os.sep + module_dir.replace('/', os.sep) + os.sep
+        self.roots = tuple(root + os.sep for root in roots)
+        self.interval = interval
+        self.frames = frames
+        self.history = []
+        self._origins = {}
+        # Allocations made by tracemalloc itself and by us aren't interesting.
+        self._ignored = {tracemalloc.__file__, __file__}
+        self._start = time.monotonic()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Starts tracing allocations."""
+        tracemalloc.start(self.frames)
+        if self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name='pex-memprofile', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops tracing allocations, and writes the final report."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.snapshot()
+        tracemalloc.stop()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.snapshot()
+
+    def snapshot(self):
+        """Takes a snapshot of the memory allocated at the moment, and writes the report."""
+        with self._lock:
+            tracebacks = _tracebacks()
+            current, peak = tracemalloc.get_traced_memory()
+            packages = collections.defaultdict(lambda: [0, 0])
+            sites = collections.defaultdict(lambda: [0, 0])
+            for frames, size, count in tracebacks:
+                if not frames or frames[0][0] in self._ignored:
+                    continue
+                (filename, lineno), origin, package = self._attribute(frames)
+                totals = packages[origin, package]
+                totals[0] += size
+                totals[1] += count
+                totals = sites['%s:%d' % (filename, lineno), package]
+                totals[0] += size
+                totals[1] += count
+            rss = _rss()
+            largest = sorted(packages.items(), key=lambda x: -x[1][0])
+            self.history.append((time.monotonic() - self._start, current, rss, [
+                package for (_, package), _ in largest[:3]
+            ]))
+            self._write(current, peak, rss, largest, sorted(sites.items(), key=lambda x: -x[1][0]))
+
+    def _attribute(self, frames):
+        """Returns the frame, origin and package that an allocation is attributed to."""
+        for frame in frames:
+            origin, package = self._origin(frame[0])
+            if origin != 'external':
+                return frame, origin, package
+        return frames[0], 'external', '<external>'
+
+    def _origin(self, filename):
+        """Returns the origin and package of the given file."""
+        result = self._origins.get(filename)
+        if result is None:
+            path = os.sep + filename
+            index = path.find(self.module_dir)
+            if index != -1:
+                rel = path[index + len(self.module_dir):]
+                result = ('third-party', _top_level(rel))
+            elif filename.startswith(self.roots):
+                root = next(root for root in self.roots if filename.startswith(root))
+                rel = filename[len(root):]
+                if rel == '__main__.py' or rel.startswith('.bootstrap' + os.sep):
+                    result = ('pex', '<pex>')  # Our own startup code and import hooks.
+                else:
+                    result = ('first-party', _top_level(rel))
+            else:
+                result = ('external', '<external>')
+            self._origins[filename] = result
+        return result
+
+    def _write(self, current, peak, rss, packages, sites):
+        with open(self.filename, 'w') as f:
+            f.write('Peak RSS %s, current RSS %s; traced memory %s (peak %s)\n\n' % (
+                _mib(_peak_rss()), _mib(rss), _mib(current), _mib(peak),
+            ))
+            f.write('By package:\n')
+            f.write('%12s %10s  %-12s %s\n' % ('KiB', 'blocks', 'origin', 'package'))
+            for (origin, package), (size, count) in packages:
+                f.write('%12.1f %10d  %-12s %s\n' % (size / 1024, count, origin, package))
+            f.write('\nTop %d allocation sites:\n' % TOP_SITES)
+            f.write('%12s %10s  %s\n' % ('KiB', 'blocks', 'site'))
+            for (site, package), (size, count) in sites[:TOP_SITES]:
+                f.write('%12.1f %10d  %s (%s)\n' % (size / 1024, count, site, package))
+            f.write('\nHistory:\n')
+            f.write('%10s %12s %12s  %s\n' % ('seconds', 'traced MiB', 'RSS MiB', 'largest packages'))
+            for elapsed, traced, rss, largest in self.history:
+                f.write('%10.1f %12.1f %12s  %s\n' % (
+                    elapsed, traced / 1048576, '-' if rss is None else '%.1f' % (rss / 1048576),
+                    ', '.join(largest),
+                ))
+
+
+def _tracebacks():
+    """Returns a [frames, size, count] list for each distinct traceback of the allocations traced
+    at the moment. frames is a tuple of (filename, line number) pairs with the most recent first.
+    """
+    # tracemalloc.take_snapshot() wraps every frame of every trace in an object, which is too slow
+    # to do periodically in a large program, so we use its raw traces instead where we can. On the
+    # versions we know, each is a (domain, size, frames, total frames) tuple, where frames is in
+    # the order we want. Identical tracebacks share the same tuple, so they're grouped by identity,
+    # which is much cheaper than hashing.
+    traces = _raw_traces()
+    if traces is None:
+        return _snapshot_tracebacks()
+    tracebacks = {}
+    for _, size, frames, _ in traces:
+        totals = tracebacks.get(id(frames))
+        if totals is None:
+            tracebacks[id(frames)] = [frames, size, 1]
+        else:
+            totals[1] += size
+            totals[2] += 1
+    return tracebacks.values()
+
+
+def _raw_traces():
+    """Returns tracemalloc's raw traces, or None if they aren't in the form we expect."""
+    get_traces = getattr(tracemalloc, '_get_traces', None)
+    if get_traces is None:
+        return None
+    traces = get_traces()
+    if traces and not _is_raw_trace(traces[0]):
+        return None
+    return traces
+
+
+def _is_raw_trace(trace):
+    if not (isinstance(trace, tuple) and len(trace) == 4 and isinstance(trace[2], tuple)):
+        return False
+    frames = trace[2]
+    return not frames or (isinstance(frames[0], tuple) and len(frames[0]) == 2)
+
+
+def _snapshot_tracebacks():
+    """Like _tracebacks, but using tracemalloc's public API (which is slower)."""
+    tracebacks = {}
+    for trace in tracemalloc.take_snapshot().traces:
+        # Tracebacks are sorted from the oldest frame to the most recent.
+        frames = tuple((frame.filename, frame.lineno) for frame in reversed(trace.traceback))
+        totals = tracebacks.get(frames)
+        if totals is None:
+            tracebacks[frames] = [frames, trace.size, 1]
+        else:
+            totals[1] += trace.size
+            totals[2] += 1
+    return tracebacks.values()
+
+
+def _top_level(rel):
+    """Returns the top-level package or module for the given path relative to a root."""
+    top = rel.partition(os.sep)[0]
+    return top[:-3] if top.endswith('.py') else top
+
+
+def _mib(size):
+    return 'unknown' if size is None else '%.1f MiB' % (size / 1048576)
+
+
+def _rss():
+    """Returns the current RSS of this process in bytes, or None if it's unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _peak_rss():
+    """Returns the peak RSS of this process in bytes, or None if it's unknown."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # It's in KiB on Linux.
@@ -14,6 +14,7 @@ import (
 	"os"
 	"path"
 	"path/filepath"
+	"strconv"
 	"strings"
 
 	"github.com/please-build/python-rules/tools/please_pex/preamble"
@@ -47,6 +48,10 @@ type Writer struct {
 	testRunner       string
 	customTestRunner string
 	debugger         string
+
+	bytecodeOptimisationLevel    int
+	codeArchiveInterpreter       string
+	codeArchiveOptimisationLevel int
 }
 
 // NewWriter constructs a new Writer.
@@ -135,6 +140,21 @@ func (pw *Writer) SetTest(srcs []string, testRunner string, addTestRunnerDeps bo
 	}
 }
 
+// SetBytecodeOptimisationLevel sets the optimisation level (as for python -O) at which the pex's
+// bytecode was compiled at build time. An exploded pex only uses that bytecode when it's run at the
+// same level.
+func (pw *Writer) SetBytecodeOptimisationLevel(level int) {
+	pw.bytecodeOptimisationLevel = level
+}
+
+// SetCodeArchive sets this Writer to compile the pex's pure-Python modules into a code archive,
+// using the given interpreter at the given optimisation level. The archive is only used at run time
+// by interpreters with the same bytecode version as the given one.
+func (pw *Writer) SetCodeArchive(interpreter string, optimisationLevel int) {
+	pw.codeArchiveInterpreter = interpreter
+	pw.codeArchiveOptimisationLevel = optimisationLevel
+}
+
 func (pw *Writer) SetDebugger(debugger Debugger) {
 	pw.pexStamp = "debug"
 
@@ -170,11 +190,6 @@ func (pw *Writer) Write(out, moduleDir string) error {
 		return fmt.Errorf("write preamble configuration: %w", err)
 	}
 
-	// Non-zip-safe pexes need portalocker
-	if !pw.zipSafe {
-		pw.includeLibs = append(pw.includeLibs, ".bootstrap/portalocker")
-	}
-
 	// Write required extra libraries. Note that this executable is also a zipfile and we can
 	// jarcat it directly in (nifty, huh?).
 	//
@@ -190,10 +205,55 @@ func (pw *Writer) Write(out, moduleDir string) error {
 		}
 	}
 
-	// Write plz.py which contains much of our import hooks etc
-	b := mustRead("plz.py")
-	if err := f.WriteFile(".bootstrap/plz.py", b, 0644); err != nil {
-		return err
+	// Write an index of the .pex's eventual contents, so the import hooks in plz.py don't need to
+	// scan the whole archive at run time.
+	deps, err := dependencyFiles(".", out)
+	if err != nil {
+		return fmt.Errorf("index dependencies: %w", err)
+	}
+	for name, info := range f.Files() {
+		deps[name] = info
+	}
+	idx := newIndex(deps, strings.ReplaceAll(moduleDir, ".", "/"))
+	b, err := idx.Marshal()
+	if err != nil {
+		return fmt.Errorf("marshal index: %w", err)
+	}
+	if err := f.WriteFile(indexPath, b, 0644); err != nil {
+		return fmt.Errorf("write index: %w", err)
+	}
+	b, err = idx.MarshalDistributions()
+	if err != nil {
+		return fmt.Errorf("marshal index distributions: %w", err)
+	}
+	if err := f.WriteFile(distributionsPath, b, 0644); err != nil {
+		return fmt.Errorf("write index distributions: %w", err)
+	}
+
+	// Write the code archive, if requested. Packages containing native code are left out, since
+	// they may be imported from the partially exploded pex instead. It's stored uncompressed so
+	// that plz.py can read it straight out of the mmapped pex.
+	if pw.codeArchiveInterpreter != "" {
+		archive, err := buildCodeArchive(pw.codeArchiveInterpreter, pw.codeArchiveOptimisationLevel, ".", out, append([]string{".bootstrap"}, idx.Native...))
+		if err != nil {
+			return fmt.Errorf("build code archive: %w", err)
+		}
+		f.StoreSuffix = append(f.StoreSuffix, codeArchivePath)
+		if err := f.WriteFile(codeArchivePath, archive, 0644); err != nil {
+			return fmt.Errorf("write code archive: %w", err)
+		}
+	}
+
+	// Write plz.py which contains much of our import hooks etc, and the other modules that
+	// pex_main.py imports on demand.
+	for _, module := range []string{
+		"plz.py", "pex_resources.py", "pex_metadata.py", "pex_extensions.py",
+		"code_archive_import.py", "pex_cache.py", "pex_explode.py", "startup_trace.py",
+		"import_profiler.py", "pex_server.py", "sample_profiler.py", "memory_profiler.py",
+	} {
+		if err := f.WriteFile(".bootstrap/"+module, mustRead(module), 0644); err != nil {
+			return err
+		}
 	}
 
 	// Always write pex_main.py, with some templating.
@@ -202,6 +262,7 @@ func (pw *Writer) Write(out, moduleDir string) error {
 	b = bytes.Replace(b, []byte("__ENTRY_POINT__"), []byte(pw.realEntryPoint), 1)
 	b = bytes.Replace(b, []byte("__ZIP_SAFE__"), []byte(pythonBool(pw.zipSafe)), 1)
 	b = bytes.Replace(b, []byte("__PEX_STAMP__"), []byte(pw.pexStamp), 1)
+	b = bytes.Replace(b, []byte("__BYTECODE_OPTIMISATION_LEVEL__"), []byte(strconv.Itoa(pw.bytecodeOptimisationLevel)), 1)
 
 	if len(pw.testSrcs) != 0 {
 		// If we're writing a test, we append pex_test_main.py to it.
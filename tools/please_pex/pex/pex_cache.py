@@ -0,0 +1,186 @@
+"""Maintains the pex cache, which exploded pexes and cached extension modules are kept in.
+
+This is imported on demand, by pexes that explode themselves into the cache or are asked to keep
+it within PEX_CACHE_MAX_BYTES, and by PEX_CACHE_COMMAND (see main below).
+"""
+
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class PexCache:
+    """The directory that pexes are exploded into and extension modules are cached in.
+
+    Each exploded pex (pex-<stamp>) and each cached extension module (extensions/<crc>-<size>) is
+    an entry in the cache. An entry's modification time records when it was last used. Running
+    pexes hold a shared lock on their exploded directory's lockfile, and entries are only evicted
+    while an exclusive lock is held, so a pex that's in use is never removed from under it.
+    Extension modules are only needed on disk until they've been loaded, so their entries aren't
+    locked; SoImport puts an entry back if it's evicted before it can load it. Eviction renames an
+    entry away before deleting it, so nothing ever sees it half-deleted.
+    """
+
+    LOCKFILE = '.pex-lock'
+    EXTENSIONS = 'extensions'
+    # Staging directories older than this are assumed to have been abandoned by a process that
+    # died while exploding a pex (or evicting an entry).
+    STALE_SECONDS = 24 * 60 * 60
+
+    def __init__(self, path):
+        self.path = path
+        self._locks = []
+
+    def acquire(self, entry):
+        """Marks an exploded pex as in use by this process for as long as this object is alive.
+
+        Returns False if the entry doesn't exist (e.g. because it was just evicted).
+        """
+        lockfile = os.path.join(entry, self.LOCKFILE)
+        try:
+            f = open(lockfile, 'a')
+        except (FileNotFoundError, NotADirectoryError):
+            return False
+        except OSError:
+            # Probably a read-only cache, in which case we couldn't evict anything from it either.
+            return os.path.isdir(entry)
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_SH)
+        # It might have been evicted while we were waiting for the lock.
+        try:
+            present = os.path.samestat(os.fstat(f.fileno()), os.stat(lockfile))
+        except FileNotFoundError:
+            present = False
+        if not present:
+            f.close()
+            return False
+        self._locks.append(f)
+        with contextlib.suppress(OSError):
+            os.utime(entry)
+        return True
+
+    def entries(self):
+        """Returns a list of (path, size in bytes, last use time) for every entry in the cache,
+        least recently used first."""
+        entries = []
+        for path in self._entry_paths():
+            try:
+                entries.append((path, self._size(path), os.stat(path).st_mtime))
+            except FileNotFoundError:
+                pass  # Evicted concurrently.
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def _entry_paths(self):
+        try:
+            with os.scandir(self.path) as it:
+                names = [e.name for e in it if e.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name == self.EXTENSIONS:
+                try:
+                    with os.scandir(os.path.join(self.path, name)) as it:
+                        yield from (e.path for e in it if e.is_dir(follow_symlinks=False))
+                except FileNotFoundError:
+                    pass
+            elif name.startswith('pex-'):
+                yield os.path.join(self.path, name)
+
+    def _size(self, path):
+        """Returns the disk space used by the given directory."""
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(path):
+            for name in dirnames + filenames:
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                size += st.st_blocks * 512 if hasattr(st, 'st_blocks') else st.st_size
+        return size
+
+    def evict(self, entry):
+        """Removes an entry from the cache unless it's in use. Returns True if it was removed."""
+        lock = None
+        if os.path.dirname(entry) == self.path and fcntl:
+            try:
+                lock = open(os.path.join(entry, self.LOCKFILE), 'a')
+            except (FileNotFoundError, NotADirectoryError):
+                return False
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock.close()
+                return False
+        try:
+            evicted = tempfile.mkdtemp(dir=self.path, prefix='.evicted-')
+            try:
+                os.rename(entry, os.path.join(evicted, 'entry'))
+            except FileNotFoundError:
+                os.rmdir(evicted)
+                return False
+        finally:
+            if lock:
+                lock.close()
+        shutil.rmtree(evicted, ignore_errors=True)
+        return True
+
+    def prune(self, max_bytes):
+        """Evicts the least recently used entries that aren't in use until the cache takes up no
+        more than max_bytes. Returns a list of the paths of the entries that were evicted."""
+        self._remove_abandoned()
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        evicted = []
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            if self.evict(path):
+                evicted.append(path)
+                total -= size
+        return evicted
+
+    def _remove_abandoned(self):
+        """Removes the remains of failed explosions and evictions."""
+        try:
+            with os.scandir(self.path) as it:
+                for e in it:
+                    if e.name.startswith(('.evicted-', '.staging-')) and \
+                            e.stat().st_mtime < time.time() - self.STALE_SECONDS:
+                        shutil.rmtree(e.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def main(command, path, max_bytes):
+    """Inspects or maintains the cache at the given path, instead of running the pex.
+
+    This is triggered by setting the PEX_CACHE_COMMAND env var to one of:
+      list:  prints each entry's last use time, size and path, least recently used first.
+      size:  prints the total size of the cache in bytes.
+      prune: evicts entries that aren't in use until the cache is within PEX_CACHE_MAX_BYTES (or
+             every entry that isn't in use, if that isn't set), printing the paths of the entries
+             it evicted.
+    Returns an exit code.
+    """
+    cache = PexCache(path)
+    if command == 'list':
+        for entry, size, last_use in cache.entries():
+            last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_use))
+            print('%s %12d %s' % (last_used, size, entry))
+    elif command == 'size':
+        print(sum(size for _, size, _ in cache.entries()))
+    elif command == 'prune':
+        for entry in cache.prune(max_bytes or 0):
+            print(entry)
+    else:
+        sys.stderr.write('Unknown PEX_CACHE_COMMAND %s; must be list, size or prune\n' % command)
+        return 1
+    return 0
@@ -0,0 +1,188 @@
+"""Extracts a pex to a directory where everything in it can be imported from.
+
+This is used for pexes that aren't zip-safe, or when PEX_EXPLODE or PEX_PARTIAL_EXPLODE is set. It's
+imported on demand by pex_main.py, so pexes that run from the zip don't pay for it at startup.
+"""
+
+import functools
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+import pex_cache
+
+
+# Workaround for https://bugs.python.org/issue15795
+class ZipFileWithPermissions(zipfile.ZipFile):
+    """ Custom ZipFile class handling file permissions. """
+
+    def _extract_member(self, member, targetpath, pwd):
+        if not isinstance(member, zipfile.ZipInfo):
+            member = self.getinfo(member)
+
+        targetpath = super(ZipFileWithPermissions, self)._extract_member(
+            member, targetpath, pwd
+        )
+
+        attr = member.external_attr >> 16
+        if attr != 0:
+            os.chmod(targetpath, attr)
+        return targetpath
+
+
+def explode(pex, path, trace, include=None, workers=1, cache=True, max_bytes=None,
+            optimisation_level=0):
+    """Extracts the pex to path, and returns the PexCache that holds on to it if it's cached.
+
+    If include is given, only the members whose names it returns true for are extracted. If cache
+    is true, path is an entry in the pex cache: it's published there (with its bytecode prepared)
+    unless another pex already has, and the returned PexCache stops it from being evicted for as
+    long as it's alive. Otherwise path is private to us, and None is returned. optimisation_level
+    is the level that the pex's bytecode was compiled at.
+    """
+    if not cache:
+        # Don't bother preparing bytecode; this is deleted when we're done.
+        with trace('extract'):
+            extract(pex, path, include, workers)
+        return None
+    basepath = os.path.dirname(path)
+    cache = pex_cache.PexCache(basepath)
+    published = False
+    while True:
+        with trace('acquire cache entry'):
+            if cache.acquire(path):
+                break
+        os.makedirs(basepath, exist_ok=True)
+        with trace('publish cache entry'):
+            _publish(pex, path, trace, include, workers, optimisation_level)
+        published = True
+    if published and max_bytes is not None:
+        with trace('prune cache'):
+            cache.prune(max_bytes)
+    return cache
+
+
+def _publish(pex, path, trace, include, workers, optimisation_level):
+    """Publishes the pex to the given cache entry.
+
+    It's extracted into a private staging directory which is atomically renamed into place once
+    it's complete, so that the cache entry only ever exists in its finished state. If another
+    process wins the race to publish it, the rename fails and we use theirs instead.
+    """
+    staging = tempfile.mkdtemp(dir=os.path.dirname(path),
+                               prefix='.staging-%s-' % os.path.basename(path))
+    try:
+        with trace('extract'):
+            files = extract(pex, staging, include, workers)
+        with trace('compile'):
+            sources = [f for f in files if f.endswith('.py')]
+            compile_sources(sources, staging, path, workers, optimisation_level)
+        # mkdtemp makes the directory private to us, but other users sharing the cache need to be
+        # able to read it, so give it the mode that os.makedirs would have.
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(staging, 0o777 & ~umask)
+        os.rename(staging, path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def extract(zip_file, dest, include=None, workers=1):
+    """Extracts the contents of a zip file into dest and returns the paths of the extracted files.
+
+    If include is given, only the members whose names it returns true for are extracted. Members
+    are decompressed across the given number of threads, each with its own handle on the zip file
+    (zlib releases the GIL while it works, so this scales reasonably well).
+    """
+    with ZipFileWithPermissions(zip_file, 'r') as zf:
+        members = [info for info in zf.infolist() if include is None or include(info.filename)]
+        if workers <= 1 or len(members) <= 1:
+            return [zf.extract(info, dest) for info in members]
+
+    # Create all the directories up front; zipfile doesn't expect anything else to be creating
+    # them at the same time as it is.
+    dirs = {os.path.dirname(info.filename) for info in members}
+    dirs.update(info.filename for info in members if info.is_dir())
+    for d in dirs:
+        os.makedirs(os.path.join(dest, d), exist_ok=True)
+
+    # Imported here rather than at the top because concurrent.futures is slow to import, and small
+    # pexes are extracted on a single thread.
+    import concurrent.futures
+    import threading
+
+    local = threading.local()
+    handles = []
+
+    def extract_member(info):
+        zf = getattr(local, 'zf', None)
+        if zf is None:
+            zf = local.zf = ZipFileWithPermissions(zip_file, 'r')
+            handles.append(zf)
+        return zf.extract(info, dest)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(extract_member, members))
+    finally:
+        for zf in handles:
+            zf.close()
+
+
+def compile_sources(sources, stripdir, prependdir, workers=1, optimisation_level=0):
+    """Prepares bytecode for the given extracted source files, across the given number of
+    processes."""
+    prepare = functools.partial(prepare_bytecode, stripdir=stripdir, prependdir=prependdir,
+                                optimisation_level=optimisation_level)
+    # Starting worker processes isn't free, so make sure each one has a decent amount to do.
+    workers = min(workers, len(sources) // 50)
+    if workers > 1 and hasattr(os, 'fork'):
+        import concurrent.futures
+        import multiprocessing
+
+        # Fork explicitly: other start methods would re-run this pex's __main__ in the workers.
+        context = multiprocessing.get_context('fork')
+        with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context) as executor:
+            chunksize = len(sources) // (workers * 4) + 1
+            for _ in executor.map(prepare, sources, chunksize=chunksize):
+                pass
+    else:
+        for source in sources:
+            prepare(source)
+
+
+def prepare_bytecode(source, stripdir, prependdir, optimisation_level=0):
+    """Makes sure there's bytecode that can be used for a source file extracted from the pex.
+
+    Bytecode compiled at build time (at the given optimisation_level) sits alongside its source,
+    which is the only place zipimport looks for it, but the import system only looks in __pycache__
+    when importing from a directory. If it's hash-based (see the BytecodeInvalidationMode config
+    option) it's moved there so it can be used as-is, provided that we're running at the same
+    optimisation level, since __pycache__ has a separate slot for each level. Otherwise the source
+    is compiled now, because timestamp-based bytecode is stale once the source has been extracted
+    with a new modification time.
+    """
+    import importlib.util
+
+    if optimisation_level == sys.flags.optimize:
+        legacy = source + 'c'
+        try:
+            with open(legacy, 'rb') as f:
+                header = f.read(8)
+            # The second word of the header is a set of flags; bit 0 is set for hash-based bytecode.
+            if header[:4] == importlib.util.MAGIC_NUMBER and \
+                    int.from_bytes(header[4:8], 'little') & 1:
+                cached = importlib.util.cache_from_source(source)
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                os.replace(legacy, cached)
+                return True
+        except FileNotFoundError:
+            pass
+    import compileall
+    return compileall.compile_file(source, stripdir=stripdir, prependdir=prependdir,
+                                   optimize=sys.flags.optimize, quiet=1)
@@ -0,0 +1,103 @@
+"""Writes extension modules out of the pex so that they can be loaded.
+
+This is imported on demand by plz.SoImport, the first time a pex imports an extension module.
+"""
+
+from importlib import machinery
+import contextlib
+import os
+import tempfile
+
+
+class ExtensionFiles:
+    """Provides files on disk with the same contents as the extension modules in the pex.
+
+    If cache_dir is given, they are written there once, keyed by their checksum and size, and
+    loaded directly from there by later processes. If memfd is True (or the cache can't be written
+    to), they are written to an anonymous in-memory file instead where possible.
+    """
+
+    # How many times to try loading an extension module whose cache entry is evicted from under us.
+    CACHE_ATTEMPTS = 3
+
+    def __init__(self, index, cache_dir=None, memfd=False):
+        self.index = index
+        self.cache_dir = cache_dir and os.path.join(cache_dir, 'extensions')
+        self.memfd = memfd and hasattr(os, 'memfd_create')
+        # Set once a new entry has been written to the cache.
+        self.cache_written = False
+
+    def create_module(self, spec, filename, suffix):
+        """Creates the extension module for the given spec from the given member of the pex."""
+        for attempt in range(self.CACHE_ATTEMPTS):
+            with self._extension_file(filename, suffix) as path:
+                spec.origin = path
+                loader = machinery.ExtensionFileLoader(spec.name, path)
+                spec.loader = loader
+                try:
+                    return loader.create_module(spec)
+                except ImportError:
+                    # Extension cache entries aren't locked while they're in use, so a concurrent
+                    # prune can evict one between our finding it and loading it. Once it's loaded
+                    # it doesn't matter, so we just need to put it back and try again.
+                    if os.path.exists(path) or attempt == self.CACHE_ATTEMPTS - 1:
+                        raise
+
+    @contextlib.contextmanager
+    def _extension_file(self, filename, suffix):
+        """Yields the path to a file on disk with the same contents as the given member."""
+        memfd = self.memfd
+        if self.cache_dir and not memfd:
+            path = self._cache_entry(filename)
+            if path:
+                yield path
+                return
+            memfd = hasattr(os, 'memfd_create')
+        if memfd:
+            fd = os.memfd_create(os.path.basename(filename))
+            try:
+                with open(fd, 'wb', closefd=False) as f:
+                    f.write(self.index.read(filename))
+                yield '/proc/self/fd/%d' % fd
+            finally:
+                os.close(fd)
+            return
+        prefix = os.path.basename(filename[:-len(suffix)])
+        with tempfile.NamedTemporaryFile(suffix=suffix, prefix=prefix) as f:
+            f.write(self.index.read(filename))
+            f.flush()
+            yield f.name
+
+    def _cache_entry(self, filename):
+        """Returns the path to the given member in the extension module cache, populating it if
+        needed, or None if the cache can't be written to."""
+        crc, size = self.index.extensions[filename]
+        path = os.path.join(self.cache_dir, '%08x-%d' % (crc, size), os.path.basename(filename))
+        try:
+            if os.stat(path).st_size == size:
+                with contextlib.suppress(OSError):
+                    os.utime(os.path.dirname(path))  # Record the use, for the cache's LRU eviction.
+                return path
+        except FileNotFoundError:
+            pass
+        try:
+            self._write_cache_entry(path, self.index.read(filename))
+        except OSError:
+            return None  # Most likely a read-only filesystem.
+        self.cache_written = True
+        return path
+
+    def _write_cache_entry(self, path, contents):
+        """Atomically writes a new entry into the extension module cache."""
+        dirname = os.path.dirname(path)
+        os.makedirs(dirname, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=dirname, prefix='.tmp-', delete=False) as f:
+            try:
+                f.write(contents)
+                f.close()
+                os.chmod(f.name, 0o755)
+                # If another process got here first, this harmlessly replaces its identical file.
+                os.replace(f.name, path)
+            except BaseException:
+                os.unlink(f.name)
+                raise
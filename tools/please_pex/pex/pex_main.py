@@ -15,16 +15,86 @@ MODULE_DIR = '__MODULE_DIR__'
 ENTRY_POINT = '__ENTRY_POINT__'
 ZIP_SAFE = __ZIP_SAFE__
 PEX_STAMP = '__PEX_STAMP__'
+# The optimisation level that the pex's bytecode was compiled at (see BytecodeOptimisationLevel).
+BYTECODE_OPTIMISATION_LEVEL = __BYTECODE_OPTIMISATION_LEVEL__
+
+
+def import_bootstrap(name):
+    """Imports one of the modules in the pex's .bootstrap directory.
+
+    Everything other than plz is imported on demand, so that pexes which don't need it don't pay to
+    compile it at startup.
+    """
+    bootstrap = os.path.join(PEX, '.bootstrap')
+    sys.path.insert(1, bootstrap)
+    try:
+        return __import__(name)
+    finally:
+        sys.path.remove(bootstrap)
+
+
+class _NoStartupTrace:
+    """Stands in for startup_trace.StartupTrace when startup isn't being traced."""
+
+    def __call__(self, name):
+        return self
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def write(self):
+        pass
+
+
+# If PEX_STARTUP_TRACE is set, then it records how long each phase of startup takes into the
+# filename; see startup_trace.py.
+if os.environ.get('PEX_STARTUP_TRACE'):
+    STARTUP_TRACE = import_bootstrap('startup_trace').StartupTrace(os.environ['PEX_STARTUP_TRACE'])
+else:
+    STARTUP_TRACE = _NoStartupTrace()
 
 
 def add_module_dir_to_sys_path(dirname, zip_safe=True):
     """Adds the given dirname to sys.path if it's nonempty."""
-    import plz  # this needs to be imported after paths are set up
+    with STARTUP_TRACE('import plz'):
+        import plz  # this needs to be imported after paths are set up
     if dirname:
-        sys.path.insert(1, os.path.join(sys.path[0], dirname))
-        sys.meta_path.insert(0, plz.ModuleDirImport(dirname))
+        # If the pex is partially exploded, modules can come from either the exploded directory or
+        # the pex itself (in that order).
+        roots = [PEX_PATH, PEX] if PEX_PATH != PEX and PEX in sys.path else [sys.path[0]]
+        for i, root in enumerate(roots, 1):
+            sys.path.insert(i, os.path.join(root, dirname))
+        with STARTUP_TRACE('ModuleDirImport'):
+            sys.meta_path.insert(0, plz.ModuleDirImport(dirname))
+    if PEX in sys.path:
+        # Serve importlib.resources from the pex through a shared mmap, rather than copying them.
+        plz.install_resource_reader(PEX)
+        # Import pure-Python modules from the code archive if please_pex wrote one; setting
+        # PEX_CODE_ARCHIVE=0 imports them from the pex as normal instead.
+        if os.environ.get('PEX_CODE_ARCHIVE', '1') != '0':
+            with STARTUP_TRACE('CodeArchiveImport'):
+                plz.install_code_archive(PEX)
     if zip_safe:
-        sys.meta_path.append(plz.SoImport(MODULE_DIR))
+        # PEX_EXTENSION_CACHE selects where extension modules are written so they can be loaded:
+        # "disk" (the default) caches them persistently alongside exploded pexes, "memfd" writes
+        # them to anonymous in-memory files, and "none" writes them to temporary files.
+        mode = os.environ.get('PEX_EXTENSION_CACHE', 'disk')
+        cache_dir = None if mode != 'disk' or pex_nocache() else pex_basepath()
+        with STARTUP_TRACE('SoImport'):
+            importer = plz.SoImport(MODULE_DIR, cache_dir=cache_dir, memfd=mode == 'memfd')
+        sys.meta_path.append(importer)
+        max_bytes = pex_cache_max_bytes()
+        if cache_dir and max_bytes is not None:
+            import atexit
+
+            def prune():
+                if importer.cache_written:
+                    import_bootstrap('pex_cache').PexCache(cache_dir).prune(max_bytes)
+
+            atexit.register(prune)
 
 
 def pex_basepath(temp=False):
@@ -35,39 +105,59 @@ def pex_basepath(temp=False):
         return os.environ.get('PEX_CACHE_DIR',os.path.expanduser('~/.cache/pex'))
 
 
-def pex_uniquedir():
-    return 'pex-%s' % PEX_STAMP
+def pex_uniquedir(partial=False):
+    return 'pex-%s-partial' % PEX_STAMP if partial else 'pex-%s' % PEX_STAMP
+
+
+def pex_nocache():
+    return os.environ.get('PEX_NOCACHE', '').lower() == 'true'
 
 
-def pex_paths():
-    no_cache = os.environ.get('PEX_NOCACHE')
-    no_cache = no_cache and no_cache.lower() == 'true'
-    basepath, uniquedir = pex_basepath(no_cache), pex_uniquedir()
+def pex_cache_max_bytes():
+    """Returns the maximum size in bytes of the pex cache set by PEX_CACHE_MAX_BYTES, or None.
+
+    Whenever a pex adds to the cache, it evicts the least recently used entries that aren't in use
+    until the cache is within this size.
+    """
+    max_bytes = os.environ.get('PEX_CACHE_MAX_BYTES')
+    return int(max_bytes) if max_bytes else None
+
+
+def pex_explode_workers():
+    """Returns the number of workers to use when exploding the pex.
+
+    This can be set with PEX_EXPLODE_WORKERS; it defaults to the number of CPUs available to us.
+    """
+    workers = os.environ.get('PEX_EXPLODE_WORKERS')
+    if workers:
+        return max(1, int(workers))
+    return available_cpus()
+
+
+def available_cpus():
+    """Returns the number of CPUs available to us."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def pex_paths(partial=False):
+    no_cache = pex_nocache()
+    basepath, uniquedir = pex_basepath(no_cache), pex_uniquedir(partial)
     pex_path = os.path.join(basepath, uniquedir)
     return pex_path, basepath, uniquedir, no_cache
 
 
-def explode_zip():
+def explode_zip(partial=False):
     """Extracts the current pex to a temp directory where we can import everything from.
 
     This is primarily used for binary extensions which can't be imported directly from
-    inside a zipfile.
+    inside a zipfile. If partial is True, only the packages containing native code are
+    extracted, and everything else continues to be imported from the pex.
     """
-    # Temporarily add bootstrap to sys path
-    sys.path = [os.path.join(sys.path[0], '.bootstrap')] + sys.path[1:]
-    import contextlib, portalocker, plz
-    sys.path = sys.path[1:]
-
-    @contextlib.contextmanager
-    def pex_lockfile(basepath, uniquedir):
-        # Acquire the lockfile.
-        lockfile_path = os.path.join(basepath, '.lock-%s' % uniquedir)
-        with open(lockfile_path, "a+") as lockfile:
-            # Block until we can acquire the lockfile.
-            portalocker.lock(lockfile, portalocker.LOCK_EX)
-            lockfile.seek(0)
-            yield lockfile
-            portalocker.lock(lockfile, portalocker.LOCK_UN)
+    import contextlib
+    with STARTUP_TRACE('import plz'):
+        plz = import_bootstrap('plz')
 
     @contextlib.contextmanager
     def _explode_zip():
@@ -75,27 +165,20 @@ def explode_zip():
         # these variables to find out what's going on (e.g. are we zip-safe or not).
         global PEX_PATH
 
-        PEX_PATH, basepath, uniquedir, no_cache = pex_paths()
-        os.makedirs(basepath, exist_ok=True)
-        with pex_lockfile(basepath, uniquedir) as lockfile:
-            if len(lockfile.read()) == 0:
-                import compileall, zipfile
-
-                os.makedirs(PEX_PATH, exist_ok=True)
-                with plz.ZipFileWithPermissions(PEX, "r") as zf:
-                    zf.extractall(PEX_PATH)
-
-                if not no_cache:  # Don't bother optimizing; we're deleting this when we're done.
-                    compileall.compile_dir(PEX_PATH, optimize=2, quiet=1)
-
-                # Writing nonempty content to the lockfile will signal to subsequent invocations
-                # that the cache has already been prepared.
-                lockfile.write("pex unzip completed")
-        sys.path = [PEX_PATH] + [x for x in sys.path if x != PEX]
+        with STARTUP_TRACE('explode'):
+            pex_explode = import_bootstrap('pex_explode')
+            PEX_PATH, basepath, uniquedir, no_cache = pex_paths(partial)
+            include = plz.get_index(MODULE_DIR).is_native if partial else None
+            # If it's cached, this holds on to our entry so it can't be evicted while we're running.
+            cache = pex_explode.explode(
+                PEX, PEX_PATH, STARTUP_TRACE, include, pex_explode_workers(), cache=not no_cache,
+                max_bytes=pex_cache_max_bytes(), optimisation_level=BYTECODE_OPTIMISATION_LEVEL,
+            )
+        sys.path = [PEX_PATH] + ([PEX] if partial else []) + [x for x in sys.path if x != PEX]
         try:
             yield
         finally:
-            if no_cache:
+            if cache is None:
                 import shutil
                 shutil.rmtree(basepath)
 
@@ -134,6 +217,7 @@ def main():
 
     N.B. This gets redefined by pex_test_main to run tests instead.
     """
+    STARTUP_TRACE.write()
     # Starts a debugging session, if defined, before running the entry point.
     if os.getenv("PLZ_DEBUG") is not None:
         start_debugger()
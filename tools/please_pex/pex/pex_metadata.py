@@ -0,0 +1,33 @@
+"""Distribution metadata for the packages in a pex.
+
+This is imported on demand by plz.ModuleDirImport when a program looks up a distribution, so that
+other programs don't pay to import importlib.metadata at startup.
+"""
+
+from importlib.metadata import Distribution
+
+
+class PexDistribution(Distribution):
+    """Represents a distribution package that exists within a pex file (which is, ultimately, a zip
+    file). Distribution packages are identified by the presence of a suitable dist-info or egg-info
+    directory member inside the pex file, which need not necessarily exist at the top level if a
+    directory prefix is specified in the constructor.
+    """
+    def __init__(self, name, pex_file, index, files, prefix):
+        self._name = name
+        self._index = index
+        self._pex_file = pex_file
+        self._prefix = prefix
+        # Mapping of <path within distribution> -> <full path in zipfile>
+        self._files = files
+
+    def read_text(self, filename):
+        full_name = self._files.get(filename)
+        if full_name:
+            return str(self._index.read(full_name), encoding="utf-8")
+
+    def locate_file(self, path):
+        import pex_resources
+        return pex_resources.get_resources(self._pex_file).files(self._prefix).joinpath(path)
+
+    read_text.__doc__ = Distribution.read_text.__doc__
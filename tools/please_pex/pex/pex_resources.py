@@ -0,0 +1,275 @@
+"""Serves the members of a pex from a shared mmap of it, without copying them where possible.
+
+This is used for the resources of the pex's packages, and for reading its extension modules,
+distribution metadata and code archive. It's imported on demand: plz installs a path hook whose
+importers get their packages' resource readers from here, so importlib.resources.files() goes
+through it, and resource() reads one directly.
+"""
+
+from importlib import import_module
+import io
+import itertools
+import os
+import struct
+import sys
+import zipfile
+import zipimport
+
+
+class PexResources:
+    """Read-only access to the members of a pex, without copying them where possible.
+
+    Members that are stored uncompressed are returned as memoryviews over a single read-only mmap of
+    the pex, so they're shared with every other process using the same pex through the page cache.
+    Compressed members are decompressed when they're read; the result is kept for later reads
+    unless the caller says it won't read them again.
+    """
+
+    def __init__(self, pex_file):
+        self.pex_file = pex_file
+        # zipimport has almost certainly read the central directory already, so use its copy.
+        if pex_file not in zipimport._zip_directory_cache:
+            zipimport.zipimporter(pex_file)
+        self._toc = zipimport._zip_directory_cache[pex_file]
+        self._mmap = None
+        self._decompressed = {}
+        self._names = None
+        self._dirs = None
+
+    def get(self, name, cache=True):
+        """Returns a memoryview of the contents of the given member.
+
+        If cache is False and the member is compressed, it's decompressed afresh (unless it's
+        already cached), and isn't kept once the caller has finished with it.
+        """
+        try:
+            _, compress, data_size, _, offset, _, _, _ = self._toc[name.replace('/', os.sep)]
+        except KeyError:
+            raise FileNotFoundError('%s not found in %s' % (name, self.pex_file)) from None
+        if compress == 0 and data_size == 0:
+            return memoryview(b'')  # Probably a directory.
+        if self._mmap is None:
+            import mmap
+            with open(self.pex_file, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # The lengths of the name and extra fields in the local header can differ from the ones in
+        # the central directory, so we have to look at it to find out where the data starts.
+        if self._mmap[offset:offset + 4] != b'PK\x03\x04':
+            raise OSError('Bad local file header for %s in %s' % (name, self.pex_file))
+        name_size, extra_size = struct.unpack_from('<HH', self._mmap, offset + 26)
+        start = offset + 30 + name_size + extra_size
+        data = memoryview(self._mmap)[start:start + data_size]
+        if compress == 0:
+            return data
+        elif compress != zipfile.ZIP_DEFLATED:
+            raise OSError('Unsupported compression method %d for %s in %s' % (
+                compress, name, self.pex_file))
+        decompressed = self._decompressed.get(name)
+        if decompressed is None:
+            import zlib
+            decompressed = zlib.decompress(data, -15)
+            if cache:
+                decompressed = self._decompressed.setdefault(name, decompressed)
+        return memoryview(decompressed)
+
+    def open(self, name):
+        """Returns a binary file object reading the given member."""
+        return io.BufferedReader(_MemoryViewReader(self.get(name)))
+
+    def files(self, at=''):
+        """Returns an importlib.resources Traversable for the given directory in the pex."""
+        return PexPath(self, at)
+
+    def is_file(self, name):
+        self._list()
+        return name in self._names
+
+    def is_dir(self, name):
+        self._list()
+        return name == '' or name in self._dirs
+
+    def children(self, name):
+        """Returns the names of the immediate children of the given directory."""
+        self._list()
+        prefix = name + '/' if name else ''
+        return sorted({
+            child[len(prefix):].partition('/')[0]
+            for child in itertools.chain(self._names, self._dirs) if child.startswith(prefix)
+        })
+
+    def _list(self):
+        if self._names is None:
+            names = {name.replace(os.sep, '/') for name in self._toc}
+            dirs = {name.rstrip('/') for name in names if name.endswith('/')}
+            names = {name for name in names if not name.endswith('/')}
+            for name in names:
+                while '/' in name:
+                    name = name.rpartition('/')[0]
+                    dirs.add(name)
+            self._names, self._dirs = names, dirs
+
+
+class _MemoryViewReader(io.RawIOBase):
+    """A raw binary file reading from a memoryview."""
+
+    def __init__(self, view):
+        self._view = view
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        if n <= 0:
+            return 0
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError('negative seek position %d' % offset)
+        self._pos = offset
+        return offset
+
+    def tell(self):
+        return self._pos
+
+
+class PexPath:
+    """A file or directory within a pex, which implements importlib.resources' Traversable."""
+
+    def __init__(self, resources, at=''):
+        self._resources = resources
+        self.at = at.strip('/')
+
+    @property
+    def name(self):
+        return self.at.rpartition('/')[2]
+
+    @property
+    def parent(self):
+        return PexPath(self._resources, self.at.rpartition('/')[0])
+
+    def joinpath(self, *descendants):
+        parts = [self.at] if self.at else []
+        for descendant in descendants:
+            for part in str(descendant).split('/'):
+                if part == '..':
+                    if parts:
+                        parts.pop()
+                elif part and part != '.':
+                    parts.append(part)
+        return PexPath(self._resources, '/'.join(parts))
+
+    __truediv__ = joinpath
+
+    def is_file(self):
+        return self._resources.is_file(self.at)
+
+    def is_dir(self):
+        return self._resources.is_dir(self.at)
+
+    def exists(self):
+        return self.is_file() or self.is_dir()
+
+    def iterdir(self):
+        return (self.joinpath(child) for child in self._resources.children(self.at))
+
+    def read_bytes(self):
+        return bytes(self._resources.get(self.at, cache=False))
+
+    def read_text(self, encoding=None, errors=None):
+        contents = self._resources.get(self.at, cache=False)
+        return str(contents, encoding or 'utf-8', errors or 'strict')
+
+    def open(self, mode='r', *args, **kwargs):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('%s is read-only' % self)
+        f = self._resources.open(self.at)
+        return f if 'b' in mode else io.TextIOWrapper(f, *args, **kwargs)
+
+    def __str__(self):
+        return os.path.join(self._resources.pex_file, self.at)
+
+    def __repr__(self):
+        return 'PexPath(%r, %r)' % (self._resources.pex_file, self.at)
+
+    def __eq__(self, other):
+        return (isinstance(other, PexPath) and self._resources is other._resources and
+                self.at == other.at)
+
+    def __hash__(self):
+        return hash((self._resources.pex_file, self.at))
+
+
+_resources = {}
+
+
+def get_resources(pex_file=None):
+    """Returns the PexResources for the given pex, which defaults to the currently running one."""
+    pex_file = pex_file or os.path.abspath(sys.argv[0])
+    resources = _resources.get(pex_file)
+    if resources is None:
+        resources = _resources.setdefault(pex_file, PexResources(pex_file))
+    return resources
+
+
+def resource(package, name):
+    """Returns a memoryview of the contents of a resource within a package in the pex.
+
+    Uncompressed resources are shared with every other process running the same pex, so this is
+    the most efficient way to read large resources (such as models or lookup tables) at run time.
+    """
+    spec = import_module(package).__spec__
+    # Packages in the pex, whether they were imported by zipimport or from the code archive, have
+    # a resource reader that gives us their directory in it.
+    get_reader = getattr(spec.loader, 'get_resource_reader', None)
+    reader = get_reader(spec.name) if get_reader else None
+    files = reader.files() if reader else None
+    if not isinstance(files, PexPath):
+        # It's not in a pex (most likely because the pex has been exploded).
+        with open(os.path.join(spec.submodule_search_locations[0], name), 'rb') as f:
+            return memoryview(f.read())
+    return files._resources.get(files.joinpath(name).at)
+
+
+def get_resource_reader(importer, fullname):
+    """Returns the resource reader for the given package, imported by a zipimporter from the pex."""
+    try:
+        if not importer.is_package(fullname):
+            return None
+    except zipimport.ZipImportError:
+        return None
+    package_dir = importer.prefix + fullname.rpartition('.')[2]
+    return resource_reader(get_resources(importer.archive).files(package_dir))
+
+
+def resource_reader(files):
+    """Returns an importlib.resources reader for the package in the given PexPath directory."""
+    global _PexResourceReader
+    if _PexResourceReader is None:
+        try:
+            from importlib.resources.abc import TraversableResources
+        except ImportError:  # Python < 3.11
+            from importlib.abc import TraversableResources
+
+        class _PexResourceReader(TraversableResources):
+            def __init__(self, files):
+                self._files = files
+
+            def files(self):
+                return self._files
+
+    return _PexResourceReader(files)
+
+
+_PexResourceReader = None
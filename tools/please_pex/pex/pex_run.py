@@ -1,28 +1,94 @@
-def run(explode=False):
+def run(explode=False, partial=False, target=None):
     # Add .bootstrap dir to path, after the initial pex entry
     sys.path.insert(1, os.path.join(sys.path[0], '.bootstrap'))
+    target = target or run_main
     if explode or not ZIP_SAFE:
-        with explode_zip()():
-            add_module_dir_to_sys_path(MODULE_DIR, zip_safe=False)
-            return main()
+        partial = partial and not explode
+        with explode_zip(partial)():
+            # The unexploded part of a partially exploded pex might still contain extension modules.
+            with STARTUP_TRACE('sys.path setup'):
+                add_module_dir_to_sys_path(MODULE_DIR, zip_safe=partial)
+            return target()
     else:
-        add_module_dir_to_sys_path(MODULE_DIR)
+        with STARTUP_TRACE('sys.path setup'):
+            add_module_dir_to_sys_path(MODULE_DIR)
+        return target()
+
+
+def run_main():
+    import contextlib
+    with contextlib.ExitStack() as stack:
+        # If PEX_SAMPLE_PROFILE is set, then it samples the program's stacks into the filename; see
+        # sample_profiler.py.
+        if os.environ.get('PEX_SAMPLE_PROFILE'):
+            sample_profiler = import_bootstrap('sample_profiler')
+            stack.enter_context(sample_profiler.profile(os.environ['PEX_SAMPLE_PROFILE']))
+        # If PEX_IMPORT_PROFILE is set, then it profiles the imports made by the program into the
+        # filename; see import_profiler.py. This has to start here so that its hook is the first
+        # one consulted.
+        if os.environ.get('PEX_IMPORT_PROFILE'):
+            import_profiler = import_bootstrap('import_profiler')
+            stack.enter_context(import_profiler.profile(os.environ['PEX_IMPORT_PROFILE'],
+                                                        MODULE_DIR, [PEX, PEX_PATH]))
         return main()
 
 
+def run_server(explode=False, partial=False):
+    """Runs the pex on a warm server process, starting one if there isn't one yet.
+
+    This is triggered by setting PEX_SERVER; see pex_server.py for details.
+    """
+    pex_server = import_bootstrap('pex_server')
+    if not pex_server.supported() or pex_nocache():
+        return run(explode, partial)
+    path = pex_server.socket_path(pex_basepath(), PEX_STAMP)
+    if os.environ['PEX_SERVER'] == 'serve':
+        idle_timeout = float(os.environ.get('PEX_SERVER_IDLE_TIMEOUT', '600'))
+
+        def serve():
+            pex_server.preload(ENTRY_POINT)
+            return pex_server.serve(path, PEX_STAMP, run_main, idle_timeout)
+
+        return run(explode, partial, target=serve)
+    result = pex_server.connect(path, PEX_STAMP)
+    if result is None:
+        pex_server.spawn(path)
+        result = run(explode, partial)
+    return result
+
+
 if __name__ == '__main__':
     # If PEX_EXPLODE is set, then it should always be exploded.
     explode = os.environ.get('PEX_EXPLODE', '0') != '0'
+    # If PEX_PARTIAL_EXPLODE is set, then only the packages containing native code are extracted
+    # from a pex that isn't zip-safe. PEX_EXPLODE takes precedence over it.
+    partial = os.environ.get('PEX_PARTIAL_EXPLODE', '0') != '0'
 
+    # If PEX_CACHE_COMMAND is set, then it inspects or prunes the pex cache instead of running; see
+    # pex_cache.py.
+    if os.environ.get('PEX_CACHE_COMMAND'):
+        pex_cache = import_bootstrap('pex_cache')
+        result = pex_cache.main(os.environ['PEX_CACHE_COMMAND'], pex_basepath(),
+                                pex_cache_max_bytes())
     # If PEX_INTERPRETER is set, then it starts an interactive console.
-    if os.environ.get('PEX_INTERPRETER', '0') != '0':
+    elif os.environ.get('PEX_INTERPRETER', '0') != '0':
         import code
         result = code.interact()
     # If PEX_PROFILE_FILENAME is set, then it collects profile information into the filename.
     elif os.environ.get('PEX_PROFILE_FILENAME'):
         with profile(os.environ['PEX_PROFILE_FILENAME'])():
-            result = run(explode)
+            result = run(explode, partial)
+    # If PEX_MEMPROFILE is set, then it traces memory allocations and reports on them in the
+    # filename; see memory_profiler.py.
+    elif os.environ.get('PEX_MEMPROFILE'):
+        memory_profiler = import_bootstrap('memory_profiler')
+        with memory_profiler.profile(os.environ['PEX_MEMPROFILE'], MODULE_DIR, [PEX, PEX_PATH]):
+            result = run(explode, partial)
+    # If PEX_SERVER is set, then it runs on a warm server process where possible. Tests always run
+    # normally.
+    elif os.environ.get('PEX_SERVER', '0') != '0' and ENTRY_POINT != 'pex_test_main':
+        result = run_server(explode, partial)
     else:
-        result = run(explode)
+        result = run(explode, partial)
 
     sys.exit(result)
@@ -0,0 +1,336 @@
+"""Serves invocations of a pex from a warm process that has already imported its dependencies.
+
+This is enabled by setting PEX_SERVER=1. The first invocation starts a server in the background
+(and runs normally itself); the server sets up the pex as usual, imports the modules that the
+entry point imports at its top level, and listens on a Unix socket in the pex cache directory
+that's named after the pex's stamp, so a rebuilt pex gets a new server.
+
+Later invocations connect to the server and send it their arguments, environment and working
+directory along with their stdin, stdout and stderr. The server forks a child to run the entry
+point with those, relays its exit status back, and the client exits with it. Signals that the
+client receives are forwarded to the child. The server exits after it's been idle for
+PEX_SERVER_IDLE_TIMEOUT seconds (10 minutes by default).
+
+Since modules are imported by the server before any invocation's environment is known, this is
+only suitable for programs whose imports don't depend on their environment.
+"""
+
+import marshal
+import os
+import signal
+import socket
+import struct
+import sys
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+# A request starts with its length, and is answered with the pid of the child serving it followed
+# by the child's wait status once it's exited.
+_HEADER = struct.Struct('!I')
+_PID = struct.Struct('!q')
+_STATUS = struct.Struct('!i')
+# The signals that the client passes on to the child running on its behalf.
+_FORWARDED_SIGNALS = ('SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT', 'SIGUSR1', 'SIGUSR2', 'SIGWINCH')
+# The server's standard streams, which a child replaces with its client's.
+_SERVER_STREAMS = []
+
+
+def supported():
+    """Returns True if pex servers can be used on this platform."""
+    return fcntl is not None and hasattr(os, 'fork') and hasattr(socket, 'AF_UNIX')
+
+
+def socket_path(basepath, stamp):
+    """Returns the path of the socket of the server for the pex with the given stamp."""
+    return os.path.join(basepath, 'pex-%s.sock' % stamp)
+
+
+def _request(stamp):
+    """Returns the request that identifies this invocation to the server."""
+    return marshal.dumps((stamp, sys.executable, sys.argv, dict(os.environ), os.getcwd()))
+
+
+def connect(path, stamp):
+    """Runs this invocation on the server listening at the given path.
+
+    Returns the invocation's exit code, or None if there's no usable server.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    signums = [getattr(signal, name) for name in _FORWARDED_SIGNALS if hasattr(signal, name)]
+    with sock:
+        # Hold on to any signals until we know which process to forward them to.
+        mask = signal.pthread_sigmask(signal.SIG_BLOCK, signums)
+        try:
+            request = _request(stamp)
+            socket.send_fds(sock, [_HEADER.pack(len(request))], [0, 1, 2])
+            sock.sendall(request)
+            pid = _recv_exactly(sock, _PID.size)
+            if not pid:
+                return None  # The server rejected us; it's for a different interpreter.
+            pid, = _PID.unpack(pid)
+
+            def forward(signum, frame):
+                os.kill(pid, signum)
+
+            for signum in signums:
+                signal.signal(signum, forward)
+        finally:
+            signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+        status = _recv_exactly(sock, _STATUS.size)
+    if not status:
+        sys.stderr.write('Lost connection to pex server\n')
+        return 1
+    code = os.waitstatus_to_exitcode(_STATUS.unpack(status)[0])
+    if code < 0:
+        # Die the same way that the child did.
+        signal.signal(-code, signal.SIG_DFL)
+        os.kill(os.getpid(), -code)
+        return 128 - code
+    return code
+
+
+def _recv_exactly(sock, n):
+    """Receives exactly n bytes from the socket, or returns None if it's closed first."""
+    buf = b''
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return buf
+
+
+def spawn(path):
+    """Starts a server in the background, unless one is already running."""
+    lock = _try_lock(path)
+    if lock is None:
+        return  # There's already a server (which may still be starting up), or there can't be.
+    lock.close()
+    import subprocess
+    # Run the interpreter the same way as it was run for us, minus our own arguments.
+    argv = sys.orig_argv[:len(sys.orig_argv) - len(sys.argv) + 1]
+    argv[-1] = os.path.abspath(argv[-1])
+    try:
+        subprocess.Popen(argv, env=dict(os.environ, PEX_SERVER='serve'), cwd='/',
+                         start_new_session=True, stdin=subprocess.DEVNULL,
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except OSError:
+        pass  # We'll carry on running without a server.
+
+
+def _try_lock(path):
+    """Returns an open file holding the server's lock, or None if another process holds it or
+    it can't be created (e.g. because the cache directory isn't writable)."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock = open(path + '.lock', 'a')
+    except OSError:
+        return None
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def preload(module_name):
+    """Imports the modules that the given module imports at its top level, without running it."""
+    import ast, importlib, importlib.util
+    try:
+        spec = importlib.util.find_spec(module_name)
+        source = spec.loader.get_source(module_name)
+    except (ImportError, AttributeError):
+        return
+    if source is None:
+        return  # It's been stripped, so we can't tell what it imports.
+    for name in _imports(ast.parse(source).body):
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass  # It'll fail again when the entry point is run, where it can be reported properly.
+
+
+def _imports(statements):
+    """Yields the names of the modules imported by the given statements, excluding those inside
+    function definitions (which won't have run at import time)."""
+    import ast
+    for node in statements:
+        if isinstance(node, ast.Import):
+            yield from (alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0 and node.module:
+                yield node.module
+        elif not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            for field in ('body', 'orelse', 'finalbody', 'handlers'):
+                yield from _imports(getattr(node, field, []))
+
+
+def serve(path, stamp, main, idle_timeout):
+    """Serves invocations of main() on the socket at the given path until it's been idle for
+    idle_timeout seconds."""
+    lock = _try_lock(path)
+    if lock is None:
+        return 0  # Another server beat us to it.
+    try:
+        os.unlink(path)  # Left behind by a previous server.
+    except FileNotFoundError:
+        pass
+    import selectors
+    umask = os.umask(0o077)  # Only the user who started the server is allowed to connect.
+    try:
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    listener.listen(128)
+    listener.setblocking(False)
+    # Children exiting wake up the selector through this pipe.
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+    selector = selectors.DefaultSelector()
+    selector.register(listener, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    children = {}
+    try:
+        while True:
+            if not selector.select(None if children else idle_timeout):
+                return 0  # Idle for too long.
+            while True:
+                try:
+                    os.read(wakeup_r, 4096)
+                except BlockingIOError:
+                    break
+            _reap(children)
+            try:
+                conn, _ = listener.accept()
+            except OSError:
+                continue  # Most likely nothing to accept; we were woken up by a child exiting.
+            with conn:
+                conn.settimeout(10)
+                # The child mustn't keep any of these open, particularly the lock.
+                server_fds = [listener.fileno(), wakeup_r, wakeup_w, lock.fileno(),
+                              selector.fileno(), conn.fileno()] + list(children.values())
+                pid = _handle(conn, stamp, main, server_fds)
+                if pid:
+                    children[pid] = conn.detach()
+    finally:
+        os.unlink(path)
+        listener.close()
+
+
+def _handle(conn, stamp, main, server_fds):
+    """Starts a child to serve the request on the given connection, returning its pid."""
+    fds = []
+    try:
+        msg, fds, _, _ = socket.recv_fds(conn, _HEADER.size, 3)
+        if len(msg) != _HEADER.size or len(fds) != 3:
+            return None
+        request = _recv_exactly(conn, _HEADER.unpack(msg)[0])
+        if request is None:
+            return None
+        request_stamp, executable, argv, env, cwd = marshal.loads(request)
+        if request_stamp != stamp or executable != sys.executable:
+            return None
+        # Anything we've left buffered belongs on our own output, not the client's.
+        _flush_std_streams()
+        pid = os.fork()
+        if pid == 0:
+            for fd in server_fds:
+                os.close(fd)
+            _run_child(fds, argv, env, cwd, main)
+        conn.sendall(_PID.pack(pid))
+        return pid
+    except (OSError, ValueError, EOFError, TypeError):
+        return None
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _run_child(fds, argv, env, cwd, main):
+    """Runs main() on behalf of a client, in a newly forked child. Never returns."""
+    code = 1
+    try:
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        for i, fd in enumerate(fds):
+            os.dup2(fd, i)
+        for fd in fds:
+            if fd > 2:
+                os.close(fd)
+        _reopen_std_streams(env)
+        os.chdir(cwd)
+        os.environ.clear()
+        os.environ.update(env)
+        sys.argv = argv
+        try:
+            code = main()
+        except SystemExit as e:
+            code = e.code
+        if code is None:
+            code = 0
+        elif not isinstance(code, int):
+            sys.stderr.write('%s\n' % code)
+            code = 1
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        import atexit
+        atexit._run_exitfuncs()
+        _flush_std_streams()
+        os._exit(code)
+
+
+def _flush_std_streams():
+    for f in (sys.stdout, sys.stderr):
+        try:
+            f.flush()
+        except Exception:
+            pass
+
+
+def _reopen_std_streams(env):
+    """Replaces sys.stdin, sys.stdout and sys.stderr with files on the client's descriptors,
+    buffered the way that the interpreter would have buffered them for it."""
+    for fd, name, mode in ((0, 'stdin', 'r'), (1, 'stdout', 'w'), (2, 'stderr', 'w')):
+        old = getattr(sys, name)
+        # The interpreter's -u flag makes its streams write through.
+        unbuffered = getattr(old, 'write_through', False) or bool(env.get('PYTHONUNBUFFERED'))
+        # The old files own these descriptors now, so they mustn't be closed (or garbage collected,
+        # which closes them); we exit without finalising them anyway.
+        _SERVER_STREAMS.append(old)
+        line_buffered = mode == 'w' and (fd == 2 or unbuffered or os.isatty(fd))
+        stream = open(fd, mode, buffering=1 if line_buffered else -1,
+                      encoding=getattr(old, 'encoding', None), errors=getattr(old, 'errors', None),
+                      closefd=False)
+        setattr(sys, name, stream)
+        setattr(sys, '__%s__' % name, stream)
+
+
+def _reap(children):
+    """Sends the exit statuses of any children that have exited to their clients."""
+    for pid in list(children):
+        try:
+            waited, status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            waited, status = pid, 1 << 8
+        if waited:
+            with socket.socket(fileno=children.pop(pid)) as conn:
+                try:
+                    conn.sendall(_STATUS.pack(status))
+                except OSError:
+                    pass  # The client has gone away.
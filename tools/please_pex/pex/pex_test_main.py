@@ -6,9 +6,34 @@ import sys
 # This will get templated in by the build rules.
 TEST_NAMES = '__TEST_NAMES__'.split(',')
 
+# The coverage collector, if we're collecting coverage.
+COVERAGE = None
+
+# The file that the duration of each test is written to, next to the results.
+TIMINGS_FILE = 'test.timings'
+
+# The file that the source files each test executes are written to, next to the results.
+IMPACT_FILE = 'test.impact'
+
+# The coverage context that code run between tests (e.g. setUpClass, or fixtures shared between
+# tests) is recorded in when recording impact. Code run while the tests are being collected is
+# recorded in the default context, ''.
+SHARED_CONTEXT = '(shared)'
+
+_DURATIONS = None
+_IMPACT_MAP = None
+# The impact maps recorded by test workers, which are merged with ours.
+_WORKER_IMPACT = []
+
 
 def initialise_coverage():
     """Imports & initialises the coverage module."""
+    if sys.version_info >= (3, 12) and not recording_impact():
+        # Collect coverage with sys.monitoring, which stops reporting each line once it's been
+        # seen, rather than with a tracer that's called for every line executed; it's much faster.
+        # Versions of coverage that don't support it fall back to their usual tracer, as does
+        # recording the impact of each test, which it doesn't support contexts for yet.
+        os.environ.setdefault('COVERAGE_CORE', 'sysmon')
     import coverage
     from coverage import control as coverage_control
     _original_xml_file = coverage_control.XmlReporter.xml_file
@@ -16,8 +41,11 @@ def initialise_coverage():
     # the repository root. Also skip empty __init__.py files.
 
     def _xml_file(self, fr, analysis, *args, **kvargs):
-        if PEX_PATH in fr.filename:
-            fr.filename = fr.filename[len(PEX_PATH) + 1:]  # +1 to remove the remaining /
+        # Files can come from either place if the pex has been partially exploded.
+        for path in (PEX_PATH, PEX):
+            if path in fr.filename:
+                fr.filename = fr.filename[len(path) + 1:]  # +1 to remove the remaining /
+                break
         if fr.filename == '__main__.py':
             return  # Don't calculate coverage for the synthetic entrypoint.
         if not (fr.filename.endswith('__init__.py') and len(analysis.statements) < 1):
@@ -28,18 +56,447 @@ def initialise_coverage():
     return coverage
 
 
+def test_workers():
+    """Returns the number of worker processes to run the tests in, from PEX_TEST_WORKERS.
+
+    Tests are run serially in this process by default; 0 or "auto" means one worker per CPU.
+    They're always run serially when debugging, or when os.fork isn't available.
+    """
+    workers = os.environ.get('PEX_TEST_WORKERS', '1')
+    if not hasattr(os, 'fork') or os.getenv('PLZ_DEBUG') is not None or os.getenv('DEBUG_TEST_FAILURE'):
+        return 1
+    elif workers in ('0', 'auto'):
+        return available_cpus()
+    return max(1, int(workers))
+
+
+def partition(items, weights, n):
+    """Partitions the given items into at most n groups with roughly equal total weights.
+
+    Each group keeps its items in their original order; empty groups are omitted.
+    """
+    return [[items[i] for i in group] for group in _assign(weights, n) if group]
+
+
+def _assign(weights, n):
+    """Assigns the indices of the given weights to n groups, heaviest first to the lightest group.
+
+    This is deterministic; ties go to the earliest item and group. Returns the indices in each
+    group in ascending order.
+    """
+    groups = [[] for _ in range(n)]
+    totals = [0] * n
+    for i in sorted(range(len(weights)), key=lambda i: -weights[i]):
+        lightest = totals.index(min(totals))
+        groups[lightest].append(i)
+        totals[lightest] += weights[i]
+    return [sorted(group) for group in groups]
+
+
+def run_in_workers(groups, run_group):
+    """Runs run_group(group, index) for each of the given groups in parallel, in forked processes.
+
+    run_group returns the number of failures in its group (or a non-zero exit code), which are
+    totalled and returned. Each should write its results into the results directory under a name
+    that won't clash with the others'. Coverage collected by the workers is merged into ours.
+    """
+    import marshal
+    workers = []
+    for i, group in enumerate(groups):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            _run_worker(w, group, i, run_group)
+        os.close(w)
+        workers.append((pid, r))
+    failures = 0
+    for i, (pid, r) in enumerate(workers):
+        with os.fdopen(r, 'rb') as f:
+            msg = f.read()
+        _, status = os.waitpid(pid, 0)
+        try:
+            result, coverage_data, impact = marshal.loads(msg)
+        except (EOFError, ValueError, TypeError):
+            _write_crash_report(i, status)
+            failures += 1
+            continue
+        failures += result
+        if coverage_data and COVERAGE:
+            _merge_coverage(coverage_data)
+        if impact:
+            _WORKER_IMPACT.append(impact)
+    return failures
+
+
+def _merge_coverage(coverage_data):
+    """Merges the serialised coverage data from a worker into ours."""
+    from coverage import CoverageData
+    data = CoverageData(no_disk=True)
+    data.loads(coverage_data)
+    # CoverageData.update attaches the other database, which fails for more than one in-memory
+    # database in some versions of coverage, so we copy the data across ourselves.
+    ours = COVERAGE.get_data()
+    if data.has_arcs():
+        ours.add_arcs({filename: data.arcs(filename) for filename in data.measured_files()})
+    else:
+        ours.add_lines({filename: data.lines(filename) for filename in data.measured_files()})
+
+
+def _run_worker(fd, group, index, run_group):
+    """Runs one group of tests in a worker process, sends its results to the parent and exits."""
+    import marshal
+    code = 1
+    try:
+        try:
+            result = run_group(group, index)
+        except SystemExit as err:
+            result = err.code if isinstance(err.code, int) else 1
+        coverage_data = None
+        impact = None
+        if COVERAGE:
+            COVERAGE.stop()
+            coverage_data = COVERAGE.get_data().dumps()
+            if recording_impact():
+                impact = _impact(COVERAGE.get_data())
+        with os.fdopen(fd, 'wb') as f:
+            f.write(marshal.dumps((int(result or 0), coverage_data, impact)))
+        code = 0
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _write_crash_report(index, status):
+    """Records a worker that died without reporting its results as a failed test."""
+    from xml.sax.saxutils import quoteattr
+    msg = 'Test worker %d exited abnormally (wait status %d)' % (index, status)
+    sys.stderr.write(msg + '\n')
+    _write_results('worker-%d-crash.xml' % index, 'test_worker_%d' % index, [
+        '  <testcase classname="test_worker_%d" name="crash">' % index,
+        '    <error message=%s/>' % quoteattr(msg),
+        '  </testcase>',
+    ], errors=1)
+
+
+def _write_results(filename, name, testcases, errors=0):
+    """Writes a JUnit XML file with a single test suite into the results directory."""
+    results_dir = os.getenv('RESULTS_FILE', 'test.results')
+    os.makedirs(results_dir, exist_ok=True)
+    with open(os.path.join(results_dir, filename), 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<testsuite name="%s" tests="%d" errors="%d" failures="0">\n' % (
+            name, errors, errors,
+        ))
+        for line in testcases:
+            f.write(line + '\n')
+        f.write('</testsuite>\n')
+
+
+def test_shard():
+    """Returns the index of the shard of the tests to run, and the total number of shards.
+
+    These come from TEST_SHARD_INDEX and TEST_TOTAL_SHARDS, so one test target can be split
+    across several machines; by default there's just the one shard.
+    """
+    total = int(os.environ.get('TEST_TOTAL_SHARDS') or 1)
+    index = int(os.environ.get('TEST_SHARD_INDEX') or 0)
+    if total < 1 or not 0 <= index < total:
+        raise ValueError('Invalid test shard %d of %d' % (index, total))
+    return index, total
+
+
+def shard(items, durations):
+    """Returns the items in this shard of the tests.
+
+    The items are split between the shards by their durations (which are None if unknown), in the
+    same way on every machine, so that each shard takes about as long as the others and each item
+    is in exactly one of them.
+    """
+    index, total = test_shard()
+    if total == 1:
+        return items
+    known = [duration for duration in durations if duration is not None]
+    default = sum(known) / len(known) if known else 1.0
+    weights = [default if duration is None else duration for duration in durations]
+    selected = _assign(weights, total)[index]
+    if not selected:
+        record_no_tests('shard-%d' % index)
+    return [items[i] for i in selected]
+
+
+def shard_files(filenames, prefix=None):
+    """Returns the given test files in this shard of the tests.
+
+    Each file's duration is the total of the recorded durations of the tests whose names start
+    with the given prefix for it; by default that's its module name.
+    """
+    if test_shard()[1] == 1:
+        return filenames
+    prefix = prefix or _module_prefix
+    return shard(filenames, prefixed_durations([prefix(filename) for filename in filenames]))
+
+
+def _module_prefix(filename):
+    """Returns the prefix of the names of the tests in the given test file."""
+    return os.path.splitext(filename)[0].replace('/', '.') + '.'
+
+
+def test_durations():
+    """Returns the recorded durations of each test, loaded from the timings file that
+    PEX_TEST_TIMINGS names (as written by a previous run of the tests to TIMINGS_FILE)."""
+    global _DURATIONS
+    if _DURATIONS is None:
+        _DURATIONS = {}
+        filename = os.environ.get('PEX_TEST_TIMINGS')
+        if filename:
+            import json
+            with open(filename) as f:
+                _DURATIONS = json.load(f)
+    return _DURATIONS
+
+
+def prefixed_durations(prefixes):
+    """Returns the total recorded duration of the tests starting with each of the given prefixes,
+    or None for those that have none."""
+    import bisect
+    durations = test_durations()
+    names = sorted(durations)
+    totals = []
+    for prefix in prefixes:
+        total = None
+        for name in names[bisect.bisect_left(names, prefix):]:
+            if not name.startswith(prefix):
+                break
+            total = (total or 0.0) + durations[name]
+        totals.append(total)
+    return totals
+
+
+def write_timings():
+    """Records the duration of each test from the JUnit XML results in TIMINGS_FILE, next to them."""
+    import json
+    from xml.etree import ElementTree
+    results = os.getenv('RESULTS_FILE', 'test.results')
+    if os.path.isdir(results):
+        filenames = [os.path.join(results, filename) for filename in sorted(os.listdir(results))
+                     if filename.endswith('.xml')]
+    elif os.path.isfile(results):
+        filenames = [results]
+    else:
+        return
+    durations = {}
+    for filename in filenames:
+        try:
+            tree = ElementTree.parse(filename)
+        except ElementTree.ParseError:
+            continue
+        for testcase in tree.iter('testcase'):
+            name = testcase.get('name')
+            classname = testcase.get('classname')
+            if name:
+                key = classname + '.' + name if classname else name
+                durations[key] = durations.get(key, 0.0) + float(testcase.get('time') or 0)
+    if durations:
+        with open(os.path.join(os.path.dirname(results), TIMINGS_FILE), 'w') as f:
+            json.dump(durations, f, indent=0, sort_keys=True)
+
+
+def recording_impact():
+    """Returns True if we're recording the source files that each test executes, which is
+    enabled by setting PEX_RECORD_TEST_IMPACT."""
+    return bool(os.getenv('PEX_RECORD_TEST_IMPACT'))
+
+
+def switch_test_context(test_name):
+    """Attributes the code executed from now on to the given test when recording impact, or if
+    it's None, to the tests in general (e.g. for code that sets up several tests at once).
+
+    Test runners call this as each test starts and finishes, once they've collected the tests.
+    """
+    if COVERAGE is not None and recording_impact():
+        COVERAGE.switch_context(test_name or SHARED_CONTEXT)
+
+
+def _impact(data):
+    """Returns the source files in the pex that each test executed, all those that were executed
+    at all, and those that were executed between tests, from the given coverage data (which has a
+    context for each test)."""
+    tests = {}
+    files = []
+    shared = set()
+    for filename in data.measured_files():
+        rel = _source_path(filename)
+        if rel is None:
+            continue
+        files.append(rel)
+        for contexts in data.contexts_by_lineno(filename).values():
+            for context in contexts:
+                if context == SHARED_CONTEXT:
+                    shared.add(rel)
+                elif context:
+                    tests.setdefault(context, set()).add(rel)
+    tests = {test: sorted(test_files) for test, test_files in tests.items()}
+    return tests, sorted(files), sorted(shared)
+
+
+def _source_path(filename):
+    """Returns the path of the given source file relative to the repo root, or None if it isn't
+    one of ours (i.e. it's part of a third-party package, the pex itself or outside the pex)."""
+    for path in (PEX_PATH, PEX, os.getcwd()):
+        if filename.startswith(path + os.sep):
+            rel = filename[len(path) + 1:]
+            break
+    else:
+        return None
+    if rel == '__main__.py' or rel.startswith(('.bootstrap' + os.sep, MODULE_DIR + os.sep)):
+        return None
+    return rel
+
+
+def write_impact_map():
+    """Writes the source files that each test executed to IMPACT_FILE, next to the results.
+
+    To keep it compact, the files are listed once, and each test refers to them by index. Files
+    that were only executed outside any test (e.g. when the tests were imported), or that were
+    executed between tests (e.g. by setUpClass or a shared fixture, which we can't attribute to
+    the tests that depend on it), are listed as global; a change to one of them may affect any test.
+    """
+    import json
+    tests, files, shared = _impact(COVERAGE.get_data())
+    shared = set(shared)
+    for worker_tests, worker_files, worker_shared in _WORKER_IMPACT:
+        for test, test_files in worker_tests.items():
+            tests[test] = sorted(set(tests.get(test, [])).union(test_files))
+        files.extend(worker_files)
+        shared.update(worker_shared)
+    files = sorted(set(files))
+    indices = {filename: i for i, filename in enumerate(files)}
+    executed_by_tests = {filename for test_files in tests.values() for filename in test_files}
+    executed_by_tests -= shared
+    results = os.getenv('RESULTS_FILE', 'test.results')
+    with open(os.path.join(os.path.dirname(results), IMPACT_FILE), 'w') as f:
+        json.dump({
+            'files': files,
+            'global': [indices[filename] for filename in files if filename not in executed_by_tests],
+            'tests': {test: [indices[filename] for filename in test_files]
+                      for test, test_files in sorted(tests.items())},
+        }, f, separators=(',', ':'))
+
+
+def changed_files():
+    """Returns the set of changed files to run the affected tests of, or None to run them all.
+
+    The files are listed one per line, relative to the repo root, in the file that
+    PEX_TEST_CHANGED_FILES names. Which tests they affect comes from the impact map (as written
+    to IMPACT_FILE by a previous run) that PEX_TEST_IMPACT_MAP names. The map only knows about
+    the source files that the tests executed, so any other changed file (e.g. a data file, an
+    extension module or the source of generated code) runs all the tests; the list should only
+    contain the files that the tests depend on.
+    """
+    filename = os.getenv('PEX_TEST_CHANGED_FILES')
+    if not filename:
+        return None
+    elif not os.getenv('PEX_TEST_IMPACT_MAP'):
+        sys.stderr.write('PEX_TEST_CHANGED_FILES is set without PEX_TEST_IMPACT_MAP; '
+                         'running all tests\n')
+        return None
+    with open(filename) as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def _impact_map():
+    """Returns the impact map that PEX_TEST_IMPACT_MAP names, as a dict of test name to the set of
+    files it executed, the set of files that any test executed, and the set of files that may
+    affect any test."""
+    global _IMPACT_MAP
+    if _IMPACT_MAP is None:
+        import json
+        with open(os.environ['PEX_TEST_IMPACT_MAP']) as f:
+            impact = json.load(f)
+        files = impact['files']
+        _IMPACT_MAP = (
+            {test: {files[i] for i in indices} for test, indices in impact['tests'].items()},
+            set(files),
+            {files[i] for i in impact['global']},
+        )
+    return _IMPACT_MAP
+
+
+def affected_tests(test_names):
+    """Returns which of the given tests are affected by the changed files, as a list of bools.
+
+    Tests that aren't in the impact map (e.g. because they're new) are always affected, as are all
+    the tests if any of the changed files isn't in it.
+    """
+    changed = changed_files()
+    if changed is None:
+        return [True] * len(test_names)
+    return _affected(test_names, changed)
+
+
+def _affected(test_names, changed):
+    tests, files, global_files = _impact_map()
+    if not changed <= files or not changed.isdisjoint(global_files):
+        return [True] * len(test_names)
+    return [name not in tests or not changed.isdisjoint(tests[name]) for name in test_names]
+
+
+def affected_files(filenames, prefix=None):
+    """Returns those of the given test files that contain tests affected by the changed files.
+
+    If prefix is given, it returns the prefix of the names of the tests in a file. Otherwise the
+    tests in each file are taken to be those that executed it, which may include a few tests from
+    elsewhere that use it. Files with no tests in the impact map are always affected.
+    """
+    changed = changed_files()
+    if changed is None:
+        return filenames
+    tests_by_file = {}
+    if prefix:
+        for filename in filenames:
+            file_prefix = prefix(filename)
+            tests_by_file[filename] = [test for test in _impact_map()[0]
+                                       if test.startswith(file_prefix)]
+    else:
+        for test, test_files in _impact_map()[0].items():
+            for filename in test_files:
+                tests_by_file.setdefault(filename, []).append(test)
+    selected = [filename for filename in filenames if not tests_by_file.get(filename)
+                or any(_affected(tests_by_file[filename], changed))]
+    if not selected:
+        record_no_tests('unaffected')
+    return selected
+
+
+def record_no_tests(reason):
+    """Leaves a record that the tests ran, albeit with none selected for the given reason."""
+    _write_results('%s-empty.xml' % reason, 'test_%s' % reason, [])
+
+
 def main():
     """Runs the tests. Returns an appropriate exit code."""
+    global COVERAGE
+    STARTUP_TRACE.write()
     args = [arg for arg in sys.argv[1:]]
-    if os.getenv('COVERAGE'):
+    if os.getenv('COVERAGE') or recording_impact():
         # It's important that we run coverage while we load the tests otherwise
         # we get no coverage for import statements etc.
-        cov = initialise_coverage().coverage(data_file=None)
+        cov = COVERAGE = initialise_coverage().coverage(data_file=None)
         cov.exclude(r'^import\b')
         cov.exclude(r'^from\b')
         cov.start()
         result = run_tests(args)
         cov.stop()
+        write_timings()
+        if recording_impact():
+            write_impact_map()
+        if not os.getenv('COVERAGE'):
+            return result
         omissions = ['*/third_party/*', '*/.bootstrap/*']
         # Exclude test code from coverage itself.
         omissions.extend('*/%s.py' % module.replace('.', '/') for module in args)
@@ -56,4 +513,6 @@ def main():
         if os.getenv("PLZ_DEBUG") is not None:
             start_debugger()
 
-        return run_tests(args)
+        result = run_tests(args)
+        write_timings()
+        return result
@@ -1,47 +1,146 @@
 """Internal module for Please builtins."""
 
-from collections import defaultdict
 from importlib import import_module, machinery
-from importlib.abc import MetaPathFinder
-from importlib.metadata import Distribution
 from importlib.util import spec_from_loader
 import itertools
+import json
 import os
-import re
 import sys
-import tempfile
-import zipfile
+import zipimport
 
 
-# Workaround for https://bugs.python.org/issue15795
-class ZipFileWithPermissions(zipfile.ZipFile):
-    """ Custom ZipFile class handling file permissions. """
+# The member of the pex containing the index written by please_pex at build time.
+INDEX_PATH = '.bootstrap/PLZ_PEX_INDEX'
+# The member of the pex containing the distributions in the index, which are only read on demand.
+DISTRIBUTIONS_PATH = '.bootstrap/PLZ_PEX_DISTRIBUTIONS'
+# The member of the pex containing its precompiled code, if please_pex was asked to write one.
+CODE_ARCHIVE_PATH = '.bootstrap/PLZ_CODE_ARCHIVE'
 
-    def _extract_member(self, member, targetpath, pwd):
-        if not isinstance(member, zipfile.ZipInfo):
-            member = self.getinfo(member)
 
-        targetpath = super(ZipFileWithPermissions, self)._extract_member(
-            member, targetpath, pwd
-        )
+class PexIndex:
+    """An index of the parts of the pex that our import hooks are interested in.
 
-        attr = member.external_attr >> 16
-        if attr != 0:
-            os.chmod(targetpath, attr)
-        return targetpath
+    please_pex writes this into the pex at build time, so we never need to scan the (potentially
+    very large) central directory at startup. Members are read through pex_resources, which uses the
+    directory that zipimport has already cached for the pex's entry on sys.path.
+    """
 
+    def __init__(self, pex_file, module_dir):
+        self.pex_file = pex_file
+        self.importer = zipimport.zipimporter(pex_file)
+        try:
+            index = json.loads(self.importer.get_data(INDEX_PATH))
+        except OSError:
+            index = self._scan(module_dir)  # Built without an index; fall back to the slow way.
+        self.extensions = index['extensions']
+        self.native = frozenset(index['native'])
+        self._native_prefixes = tuple(root + '/' for root in self.native)
+        self._distributions = index.get('distributions')
+
+    @property
+    def distributions(self):
+        """A mapping of each distribution's name to the members of its dist-info directory, keyed
+        by their paths within it. This is read on demand, since most programs never need it."""
+        if self._distributions is None:
+            self._distributions = json.loads(self.importer.get_data(DISTRIBUTIONS_PATH))
+        return self._distributions
+
+    def _scan(self, module_dir):
+        """Builds the index by scanning the whole pex, as please_pex would have done."""
+        from collections import defaultdict
+        import re
+        import zipfile
+
+        r = re.compile(r"{module_dir}/([^/]+)-[^/-]+?\.(?:dist|egg)-info/(.*)".format(
+            module_dir=re.escape(module_dir),
+        ))
+        extensions = {}
+        native = set()
+        distributions = defaultdict(dict)
+        with zipfile.ZipFile(self.pex_file) as zf:
+            for info in zf.infolist():
+                name = info.filename
+                if name.endswith(('.so', '.pyd')):
+                    extensions[name] = (info.CRC, info.file_size)
+                if (name.endswith(('.so', '.pyd', '.dylib')) or '.so.' in os.path.basename(name)) \
+                        and not name.startswith('.bootstrap/'):
+                    prefix = module_dir + '/' if name.startswith(module_dir + '/') else ''
+                    native.add(prefix + name[len(prefix):].partition('/')[0])
+                match = r.match(name)
+                if match:
+                    distributions[match.group(1)][match.group(2)] = name
+        return {'extensions': extensions, 'native': sorted(native), 'distributions': distributions}
 
-class SoImport(MetaPathFinder):
-    """So import. Much binary. Such dynamic. Wow."""
+    def read(self, name):
+        """Returns a memoryview of the contents of the given member of the pex.
 
-    def __init__(self, module_dir):
+        Our import hooks only read each member once, so compressed members aren't kept around.
+        """
+        import pex_resources
+        return pex_resources.get_resources(self.pex_file).get(name, cache=False)
+
+    def is_native(self, name):
+        """Returns True if the given member is in a package or module containing native code."""
+        return name in self.native or name.startswith(self._native_prefixes)
+
+
+_index = None
+
+
+def get_index(module_dir):
+    """Returns the index of the currently running pex, or None if it isn't running from a zip."""
+    global _index
+    if _index is None:
+        try:
+            _index = PexIndex(os.path.abspath(sys.argv[0]), module_dir)
+        except zipimport.ZipImportError:
+            return None
+    return _index
+
+
+class PexZipImporter(zipimport.zipimporter):
+    """A zipimporter whose packages' resources are read through pex_resources.PexResources."""
+
+    def get_resource_reader(self, fullname):
+        import pex_resources
+        return pex_resources.get_resource_reader(self, fullname)
+
+
+def install_resource_reader(pex_file):
+    """Makes importlib.resources read packages in the given pex through PexResources."""
+    def path_hook(path):
+        if path == pex_file or path.startswith(pex_file + os.sep):
+            return PexZipImporter(path)
+        raise ImportError('%s is not in %s' % (path, pex_file))
+
+    sys.path_hooks.insert(0, path_hook)
+    for path in list(sys.path_importer_cache):
+        if path == pex_file or path.startswith(pex_file + os.sep):
+            del sys.path_importer_cache[path]
+
+
+# The import hooks here don't subclass importlib.abc.MetaPathFinder, which only provides no-op
+# defaults, because importing importlib.abc costs more at startup than everything else in this file.
+class SoImport:
+    """So import. Much binary. Such dynamic. Wow.
+
+    Extension modules can't be loaded directly from inside a zip file, so they are written out to
+    disk first; see pex_extensions.py for where they're written.
+    """
+
+    def __init__(self, module_dir, cache_dir=None, memfd=False):
         self.suffixes = machinery.EXTENSION_SUFFIXES  # list, as importlib will not be using the file description
         self.suffixes_by_length = sorted(self.suffixes, key=lambda x: -len(x))
+        self.cache_dir = cache_dir
+        self.memfd = memfd
+        # The pex_extensions.ExtensionFiles that extension modules are written out by, once one is
+        # imported.
+        self.files = None
         # Identify all the possible modules we could handle.
         self.modules = {}
-        if zipfile.is_zipfile(sys.argv[0]):
-            zf = ZipFileWithPermissions(sys.argv[0])
-            for name in zf.namelist():
+        self.index = get_index(module_dir)
+        if self.index:
+            for name in self.index.extensions:
                 path, _ = self.splitext(name)
                 if path:
                     if path.startswith('.bootstrap/'):
@@ -50,8 +149,6 @@ class SoImport(MetaPathFinder):
                     self.modules.setdefault(importpath, name)
                     if path.startswith(module_dir):
                         self.modules.setdefault(importpath[len(module_dir) + 1:], name)
-            if self.modules:
-                self.zf = zf
 
     def find_spec(self, name, path, target=None):
         """Implements abc.MetaPathFinder."""
@@ -60,19 +157,20 @@ class SoImport(MetaPathFinder):
 
     def create_module(self, spec):
         """Create a module object that we're going to load."""
+        if self.files is None:
+            import pex_extensions
+            self.files = pex_extensions.ExtensionFiles(self.index, self.cache_dir, self.memfd)
         filename = self.modules[spec.name]
-        prefix, ext = self.splitext(filename)
-        with tempfile.NamedTemporaryFile(suffix=ext, prefix=os.path.basename(prefix)) as f:
-            f.write(self.zf.read(filename))
-            f.flush()
-            spec.origin = f.name
-            loader = machinery.ExtensionFileLoader(spec.name, f.name)
-            spec.loader = loader
-            mod = loader.create_module(spec)
+        mod = self.files.create_module(spec, filename, self.splitext(filename)[1])
         # Make it look like module came from the original location for nicer tracebacks.
         mod.__file__ = filename
         return mod
 
+    @property
+    def cache_written(self):
+        """True once a new entry has been written to the extension module cache."""
+        return self.files is not None and self.files.cache_written
+
     def exec_module(self, mod):
         """Because we set spec.loader above, the ExtensionFileLoader's exec_module is called."""
         raise NotImplementedError("SoImport.exec_module isn't used")
@@ -85,35 +183,7 @@ class SoImport(MetaPathFinder):
         return None, None
 
 
-class PexDistribution(Distribution):
-    """Represents a distribution package that exists within a pex file (which is, ultimately, a zip
-    file). Distribution packages are identified by the presence of a suitable dist-info or egg-info
-    directory member inside the pex file, which need not necessarily exist at the top level if a
-    directory prefix is specified in the constructor.
-    """
-    def __init__(self, name, pex_file, zip_file, files, prefix):
-        self._name = name
-        self._zf = zip_file
-        self._pex_file = pex_file
-        self._prefix = prefix
-        # Mapping of <path within distribution> -> <full path in zipfile>
-        self._files = files
-
-    def read_text(self, filename):
-        full_name = self._files.get(filename)
-        if full_name:
-            return self._zf.read(full_name).decode(encoding="utf-8")
-
-    def locate_file(self, path):
-        return zipfile.Path(
-            self._pex_file,
-            at=os.path.join(self._prefix, path) if self._prefix else path,
-        )
-
-    read_text.__doc__ = Distribution.read_text.__doc__
-
-
-class ModuleDirImport(MetaPathFinder):
+class ModuleDirImport:
     """Handles imports to a directory equivalently to them being at the top level.
 
     This means that if one writes `import third_party.python.six`, it's imported like `import six`,
@@ -122,24 +192,22 @@ class ModuleDirImport(MetaPathFinder):
     """
     def __init__(self, module_dir):
         self.prefix = module_dir.replace("/", ".") + "."
-        self._distributions = self._find_all_distributions(module_dir)
-
-    def _find_all_distributions(self, module_dir):
-        pex_file = sys.argv[0]
-        if zipfile.is_zipfile(pex_file):
-            zf = ZipFileWithPermissions(pex_file)
-            r = re.compile(r"{module_dir}{sep}([^/]+)-[^/-]+?\.(?:dist|egg)-info/(.*)".format(
-                module_dir=module_dir,
-                sep=os.sep,
-            ))
-            filenames = defaultdict(dict)
-            for name in zf.namelist():
-                match = r.match(name)
-                if match:
-                    filenames[match.group(1)][match.group(2)] = name
-            return {mod: [PexDistribution(mod, pex_file, zf, files, prefix=module_dir)]
-                    for mod, files in filenames.items()}
-        return {}
+        self.module_dir = module_dir
+        # Distributions are looked up on demand, since most programs never ask for any.
+        self._distributions = {}
+
+    def _find_distributions(self, name):
+        """Returns a list of the distributions in the pex with the given name."""
+        distributions = self._distributions.get(name)
+        if distributions is None:
+            index = get_index(self.module_dir)
+            files = index.distributions.get(name) if index else None
+            distributions = self._distributions[name] = []
+            if files:
+                import pex_metadata
+                distributions.append(pex_metadata.PexDistribution(
+                    name, index.pex_file, index, files, prefix=self.module_dir))
+        return distributions
 
     def find_spec(self, name, path, target=None):
         """Implements abc.MetaPathFinder."""
@@ -162,10 +230,21 @@ class ModuleDirImport(MetaPathFinder):
         if context.name:
             # The installed directories have underscores in the place of what might be a hyphen
             # in the package name (e.g. the package opentelemetry-sdk installs opentelemetry_sdk).
-            return self._distributions.get(context.name.replace("-", "_"), [])
-        else:
-            return itertools.chain(*self._distributions.values())
+            return self._find_distributions(context.name.replace("-", "_"))
+        index = get_index(self.module_dir)
+        if not index:
+            return []
+        return itertools.chain.from_iterable(map(self._find_distributions, index.distributions))
 
     def get_code(self, fullname):
         module = import_module(fullname.removeprefix(self.prefix))
         return module.__loader__.get_code(fullname)
+
+
+def install_code_archive(pex_file):
+    """Imports modules from the given pex's code archive, if it has one that we can use."""
+    # Most pexes don't have one, which zipimport's copy of the pex's directory tells us for free.
+    toc = zipimport._zip_directory_cache.get(pex_file)
+    if toc is None or CODE_ARCHIVE_PATH.replace('/', os.sep) in toc:
+        import code_archive_import
+        code_archive_import.install(pex_file)
@@ -0,0 +1,124 @@
+"""A sampling profiler that's cheap enough to leave running under production load.
+
+This is enabled by setting PEX_SAMPLE_PROFILE to a filename. The stacks of every thread are
+sampled PEX_SAMPLE_PROFILE_HZ times per second of CPU time that the process uses (100 by default),
+and written to that file as collapsed stacks (which flamegraph.pl, speedscope etc. understand)
+when the program exits, including when it's killed by SIGTERM.
+
+Samples are taken by a SIGPROF handler, so the program runs at full speed in between them. Each
+stack is prefixed with the name of its thread. Processes forked from the program keep profiling
+and write their own samples to the same filename with their pid appended.
+"""
+
+import collections
+import contextlib
+import os
+import signal
+import sys
+import threading
+
+
+@contextlib.contextmanager
+def profile(filename):
+    """Samples the program's stacks while the context is active, writing them to filename."""
+    profiler = SampleProfiler(filename, float(os.environ.get('PEX_SAMPLE_PROFILE_HZ', '100')))
+    profiler.start()
+    try:
+        yield
+    finally:
+        profiler.stop()
+        profiler.write()
+
+
+class SampleProfiler:
+    """Samples the stacks of all threads on a timer signal."""
+
+    def __init__(self, filename, hz=100):
+        self.filename = filename
+        self.interval = 1.0 / hz
+        self.stacks = collections.Counter()
+        self._pid = os.getpid()
+        self._labels = {}
+        self._previous_sigterm = None
+        self._running = False
+
+    def start(self):
+        """Starts sampling."""
+        self._running = True
+        signal.signal(signal.SIGPROF, self._sample)
+        self._previous_sigterm = signal.signal(signal.SIGTERM, self._sigterm)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def stop(self):
+        """Stops sampling."""
+        if self._running:
+            self._running = False
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+    def _sample(self, signum, frame):
+        """Records the stack of every thread. This runs on the main thread."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        main = threading.main_thread().ident
+        for ident, thread_frame in sys._current_frames().items():
+            stack = []
+            # The main thread's current frame is this one; the frame it interrupted is passed to us.
+            f = frame if ident == main else thread_frame
+            while f is not None:
+                stack.append(self._label(f.f_code))
+                f = f.f_back
+            stack.append(names.get(ident, 'thread-%d' % ident))
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+
+    def _label(self, code):
+        """Returns the label for a function in the collapsed stacks."""
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = '%s (%s:%d)' % (name, code.co_filename, code.co_firstlineno)
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def _sigterm(self, signum, frame):
+        """Writes the profile, then handles SIGTERM the way it would have been otherwise."""
+        if self._previous_sigterm == signal.SIG_DFL:
+            self._finish()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        self.write()
+        if callable(self._previous_sigterm):
+            self._previous_sigterm(signum, frame)
+
+    def _after_fork(self):
+        """Carries on profiling in a newly forked child, separately from its parent."""
+        if not self._running:
+            return
+        self.stacks.clear()
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)  # It isn't inherited.
+        # multiprocessing's children exit with os._exit, skipping the usual ways we'd write the
+        # profile. Its finalizers are run just before that though, so register one once it's
+        # cleared out the ones it inherited.
+        if 'multiprocessing' in sys.modules:
+            import multiprocessing.util
+            multiprocessing.util.register_after_fork(self, SampleProfiler._register_finalizer)
+
+    def _register_finalizer(self):
+        import multiprocessing.util
+        multiprocessing.util.Finalize(None, self._finish, exitpriority=-100)
+
+    def _finish(self):
+        self.stop()
+        self.write()
+
+    def write(self):
+        """Writes the samples collected so far (by this process) to the profile."""
+        filename = self.filename
+        if os.getpid() != self._pid:
+            filename = '%s.%d' % (filename, os.getpid())
+        sys.stderr.write('Writing sample profile to %s\n' % filename)
+        with open(filename, 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write('%s %d\n' % (stack, count))
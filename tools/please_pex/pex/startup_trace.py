@@ -0,0 +1,68 @@
+"""Records how long each phase of a pex's startup takes.
+
+This is enabled by setting PEX_STARTUP_TRACE to a filename. The phases are written to it in
+Chrome's trace event format (which chrome://tracing and Perfetto can display) just before the
+entry point is run.
+
+This is imported on demand by pex_main.py, so pexes that aren't being traced don't pay for it.
+"""
+
+import json
+import os
+import time
+
+
+class StartupTrace:
+    """Records the phases of the pex's startup."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.events = []
+        # The preamble execs the interpreter, so the process started when the preamble did.
+        start = self._process_start()
+        if start is not None:
+            self.record('preamble and interpreter startup', start, time.perf_counter())
+
+    def __call__(self, name):
+        """Returns a context manager that records the phase with the given name."""
+        return _TracePhase(self, name)
+
+    def record(self, name, start, end):
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': start * 1e6,
+            'dur': (end - start) * 1e6,
+            'pid': os.getpid(),
+            'tid': 0,
+        })
+
+    def write(self):
+        """Writes out the trace."""
+        with open(self.filename, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+    @staticmethod
+    def _process_start():
+        """Returns the time this process started according to time.perf_counter, or None if it
+        can't be determined (which is the case on anything other than Linux)."""
+        try:
+            with open('/proc/self/stat') as f:
+                # The start time is the 22nd field, but the 2nd may contain spaces.
+                ticks = int(f.read().rpartition(')')[2].split()[19])
+            age = time.clock_gettime(time.CLOCK_BOOTTIME) - ticks / os.sysconf('SC_CLK_TCK')
+        except (OSError, AttributeError, ValueError, IndexError):
+            return None
+        return time.perf_counter() - age
+
+
+class _TracePhase:
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.trace.record(self.name, self.start, time.perf_counter())
@@ -26,5 +26,84 @@ def run_tests(args=None):
         logging.info('Getting a single feature dir')
         features = get_features_dir()
 
-    args += features + [ '--junit', '--junit-directory', os.getenv("RESULTS_FILE", 'test.results')]
-    main(args)
+    args += ['--junit', '--junit-directory', os.getenv("RESULTS_FILE", 'test.results')]
+
+    if recording_impact():
+        _record_scenario_impact()
+    if test_shard()[1] > 1 or changed_files() is not None:
+        # Select by feature file; their tests are named after the files.
+        feature_files = [str(f) for feature in features for f in _feature_files(feature)]
+        feature_files = affected_files(feature_files, prefix=_impact_prefix)
+        features = shard_files(feature_files, prefix=_feature_prefix(features))
+        if not features:
+            return 0
+
+    workers = test_workers()
+    if workers > 1:
+        feature_files = [str(f) for feature in features for f in _feature_files(feature)]
+        if len(feature_files) > 1:
+            # Each worker runs a share of the feature files, balanced by their sizes.
+            groups = partition(feature_files, [os.path.getsize(f) for f in feature_files], workers)
+            return run_in_workers(groups, lambda files, i: main(args + files))
+
+    main(args + features)
+
+
+def _feature_files(feature):
+    """Returns the feature files at the given path, which is either a feature file or a directory."""
+    path = Path(feature)
+    return sorted(path.glob('**/*.feature')) if path.is_dir() else [path]
+
+
+def _feature_prefix(paths):
+    """Returns a function that returns the prefix of the names of the tests in a feature file, as
+    behave's JUnit reports give them when it's run on the given paths.
+
+    Like behave's JUnitReporter.make_feature_filename, that's the file's path relative to the path
+    it was found under (or if it was given directly, to the directory behave looks for steps in),
+    without its extension and with dots for separators.
+    """
+    paths = [os.path.normpath(path) for path in paths]
+    base_dir = _base_dir(paths[0]) if paths else None
+
+    def prefix(filename):
+        name = next((filename[len(path) + 1:] for path in paths if filename.startswith(path)), '')
+        if not name:
+            name = os.path.relpath(os.path.abspath(filename), base_dir)
+        return name.rsplit('.', 1)[0].replace('\\', '/').replace('/', '.') + '.'
+
+    return prefix
+
+
+def _base_dir(path):
+    """Returns the directory that behave looks for steps in, given the first path it's run on."""
+    base_dir = os.path.abspath(path)
+    if os.path.isfile(base_dir):
+        base_dir = os.path.dirname(base_dir)
+    while not os.path.isdir(os.path.join(base_dir, 'steps')) and \
+            not os.path.isfile(os.path.join(base_dir, 'environment.py')):
+        parent = os.path.dirname(base_dir)
+        if parent == base_dir:
+            break
+        base_dir = parent
+    return base_dir
+
+
+def _record_scenario_impact():
+    """Attributes the code that each scenario executes to it in the impact map."""
+    from behave.model import Scenario
+    run = Scenario.run
+
+    def run_scenario(scenario, runner):
+        switch_test_context(_impact_prefix(scenario.filename) + scenario.name)
+        try:
+            return run(scenario, runner)
+        finally:
+            switch_test_context(None)
+
+    Scenario.run = run_scenario
+
+
+def _impact_prefix(feature_file):
+    """Returns the prefix of the names of the given feature file's scenarios in the impact map."""
+    return os.path.normpath(feature_file) + '::'
@@ -26,9 +26,56 @@ def run_tests(args):
     # It's easier if all python_test rules output into a directory.
     results_file = os.getenv('RESULTS_FILE', 'test.results')
     os.mkdir(results_file)
-    args += ['--junitxml', os.path.join(results_file, 'results.xml')] + TEST_NAMES
+
+    test_names = shard_files(affected_files(TEST_NAMES))
+    if not test_names:
+        return 0  # Nothing in this shard, or nothing affected by the changed files.
+
+    plugins = [impact_plugin()] if recording_impact() else []
+
+    workers = test_workers()
+    if workers > 1 and len(test_names) > 1:
+        # Each worker runs a share of the test files, balanced by their sizes.
+        groups = partition(test_names, [_size(name) for name in test_names], workers)
+        return run_in_workers(groups, lambda names, i: main(
+            args + ['--junitxml', os.path.join(results_file, 'results-%d.xml' % i)] + names,
+            plugins=plugins,
+        ))
+
+    args += ['--junitxml', os.path.join(results_file, 'results.xml')] + test_names
 
     if os.environ.get('DEBUG_TEST_FAILURE'):
         args.append('--pdb')
 
-    return main(args)
+    return main(args, plugins=plugins)
+
+
+def impact_plugin():
+    """Returns a pytest plugin that attributes the code each test runs to it, for recording impact.
+
+    Only the test itself is attributed to it; its fixtures may be shared with other tests (and are
+    only run for the first of them if so), so they're attributed to the tests in general.
+    """
+    import pytest
+
+    class ImpactPlugin:
+
+        def pytest_collection_finish(self, session):
+            switch_test_context(None)
+
+        @pytest.hookimpl(hookwrapper=True)
+        def pytest_runtest_call(self, item):
+            switch_test_context(item.nodeid)
+            try:
+                yield
+            finally:
+                switch_test_context(None)
+
+    return ImpactPlugin()
+
+
+def _size(filename):
+    try:
+        return os.path.getsize(filename)
+    except OSError:
+        return 1
@@ -1,3 +1,5 @@
+import bisect
+import itertools
 import os
 import sys
 import unittest
@@ -22,52 +24,216 @@ def get_suite(test_names, raise_on_empty=False):
 
     :return: unittest.suite.TestSuite
     """
-    suite = unittest.TestSuite(unittest.defaultTestLoader.loadTestsFromModule(module)
-                               for module in import_tests())
     # Filter to test name only, this ensures the extra flags does not get swallowed
     test_names = list(filter(lambda x: not x.startswith('-'), test_names))
 
     # filter results if test_names is not empty
     if test_names:
-        new_suite = unittest.suite.TestSuite()
-        for name in test_names:
-            new_suite.addTests(cls for cls, class_name in list_classes(suite)
-                               if name in class_name)
+        suite = unittest.suite.TestSuite(select_tests(test_names))
         if raise_on_empty and suite.countTestCases() == 0:
             raise Exception('No matching tests found')
 
-        return new_suite
+        return suite
 
-    return suite
+    return unittest.TestSuite(unittest.defaultTestLoader.loadTestsFromModule(module)
+                              for module in import_tests())
+
+
+def select_tests(test_names):
+    """Returns the tests whose names (as list_classes gives them) contain any of the given names.
+
+    Only the test modules that could contain a matching test are imported, and only the matching
+    tests are constructed. Test classes are named after the module they're defined in, which needn't
+    be the test module they're found in, so a module is only skipped if no filter could match its
+    name and every filter could match some test module's name. (A filter that matches none of them
+    may be after a class that they import from elsewhere.) That means a class imported from a
+    module that isn't a test module is only found by filters that could match the name of a test
+    module it's imported into, or none at all. Modules that define load_tests decide their own
+    tests, so all of those are loaded and then filtered. Otherwise the same test classes are found
+    in each module as unittest's loadTestsFromModule finds, except that one imported into several
+    test modules is only selected once.
+    """
+    loader = unittest.defaultTestLoader
+    # The name of every candidate test, each on its own line, so that each filter can be matched
+    # against all of them with a single pass over the string. Tests that have already been
+    # selected are represented by an empty line (and None in place of their class).
+    names = []
+    candidates = []
+    seen = set()
+    module_names = [os.path.splitext(filename.replace('/', '.'))[0] for filename in TEST_NAMES]
+    prune = all(any(_could_match(name, module_name) for module_name in module_names)
+                for name in test_names)
+    for filename, module_name in zip(TEST_NAMES, module_names):
+        if prune and not any(_could_match(name, module_name) for name in test_names):
+            continue
+        module = import_test_module(filename)
+        if hasattr(module, 'load_tests'):
+            for test, class_name in list_classes(loader.loadTestsFromModule(module)):
+                if any(name in class_name for name in test_names):
+                    candidates.append((None, test))
+                    names.append('')
+            continue
+        for attr in dir(module):
+            cls = getattr(module, attr)
+            if not _is_test_case(cls) or cls in seen:
+                continue
+            seen.add(cls)
+            if issubclass(cls, unittest.TestSuite):
+                loader.loadTestsFromTestCase(cls)  # Raises the same error as unittest would.
+            methods = loader.getTestCaseNames(cls)
+            if not methods and hasattr(cls, 'runTest'):
+                methods = ['runTest']
+            for method in methods:
+                candidates.append((cls, method))
+                names.append('%s.%s.%s.%s' % (
+                    cls.__module__, cls.__module__, cls.__qualname__, method,
+                ))
+    index = '\n'.join(names)
+    starts = list(itertools.accumulate((len(name) + 1 for name in names[:-1]), initial=0))
+    matches = set()
+    for name in test_names:
+        pos = index.find(name)
+        while pos != -1:
+            i = bisect.bisect_right(starts, pos) - 1
+            matches.add(i)
+            # Carry on from the next test's name.
+            pos = index.find(name, starts[i + 1]) if i + 1 < len(starts) else -1
+    return [test if cls is None else cls(test) for i, (cls, test) in enumerate(candidates)
+            if cls is None or i in matches]
+
+
+def _is_test_case(obj):
+    """Returns True if loadTestsFromModule would load tests from the given module attribute."""
+    return (isinstance(obj, type) and issubclass(obj, unittest.TestCase)
+            and obj not in (unittest.TestCase, unittest.FunctionTestCase))
+
+
+def _could_match(test_name, module_name):
+    """Returns True if the given filter could match the name of a test class defined in the given
+    module.
+
+    The names are of the form module.module.Class.method, so a filter that spans enough of its
+    components to overlap the module name must agree with it.
+    """
+    parts = test_name.split('.')
+    if len(parts) == 1:
+        return True
+    components = module_name.split('.') * 2
+    for start in range(len(components) + 2 - len(parts) + 1):
+        if all(_component_matches(part, components[start + i] if start + i < len(components) else None,
+                                  i == 0, i == len(parts) - 1)
+               for i, part in enumerate(parts)):
+            return True
+    return False
+
+
+def _component_matches(part, component, first, last):
+    """Returns True if part of a filter could match the given component of a test's name (which is
+    None if it's the class or method, which we don't know yet)."""
+    if component is None:
+        return True
+    elif first:
+        return component.endswith(part)
+    elif last:
+        return component.startswith(part)
+    return component == part
 
 
 def import_tests():
     """Yields the set of test modules, from file if necessary."""
+    for filename in TEST_NAMES:
+        yield import_test_module(filename)
+
+
+def import_test_module(filename):
+    """Imports the test module for the given file, from the file if necessary."""
     # We have files available locally, but there may (likely) also be python files in the same
     # Python package within the pex. We can't just import them because the parent package exists
     # in only one of those places (this is similar to importing generated code from plz-out/gen).
-    for filename in TEST_NAMES:
-        pkg_name, _ = os.path.splitext(filename.replace('/', '.'))
-        try:
-            yield import_module(pkg_name)
-        except ImportError:
-            with open(filename, 'r') as f:
-                mod = machinery.SourceFileLoader(pkg_name, filename).load_module()
+    pkg_name, _ = os.path.splitext(filename.replace('/', '.'))
+    try:
+        return import_module(pkg_name)
+    except ImportError:
+        with open(filename, 'r') as f:
+            mod = machinery.SourceFileLoader(pkg_name, filename).load_module()
 
-                # Have to set the attribute on the parent module too otherwise some things
-                # can't find it.
-                parent, _, mod_name = pkg_name.rpartition('.')
-                if parent and parent in sys.modules:
-                    setattr(sys.modules[parent], mod_name, mod)
-                yield mod
+            # Have to set the attribute on the parent module too otherwise some things
+            # can't find it.
+            parent, _, mod_name = pkg_name.rpartition('.')
+            if parent and parent in sys.modules:
+                setattr(sys.modules[parent], mod_name, mod)
+            return mod
 
 
 def run_tests(test_names):
     """Runs tests using unittest, returns the number of failures."""
-    # N.B. import must be deferred until we have set up import paths.
-    import xmlrunner
     suite = get_suite(test_names, raise_on_empty=True)
 
-    runner = xmlrunner.XMLTestRunner(output='test.results', outsuffix='')
+    if changed_files() is not None:
+        tests = [test for test, _ in list_classes(suite)]
+        selected = affected_tests([test.id() for test in tests])
+        suite = unittest.TestSuite(test for test, affected in zip(tests, selected) if affected)
+        if suite.countTestCases() == 0:
+            record_no_tests('unaffected')
+
+    if test_shard()[1] > 1:
+        tests = [test for test, _ in list_classes(suite)]
+        durations = test_durations()
+        suite = unittest.TestSuite(shard(tests, [durations.get(test.id()) for test in tests]))
+
+    workers = test_workers()
+    if workers > 1:
+        classes = group_by_class(suite)
+        if len(classes) > 1:
+            groups = partition(classes, [cls.countTestCases() for cls in classes], workers)
+            return run_in_workers(groups, run_suites)
+
+    runner = xml_test_runner()
     results = runner.run(suite)
     return len(results.errors) + len(results.failures)
+
+
+def xml_test_runner(**kwargs):
+    """Returns the XMLTestRunner to run the tests with.
+
+    When recording impact, the code that each test runs (including its setUp and tearDown) is
+    attributed to it, and the code that runs between tests (e.g. setUpClass) to the tests in general.
+    """
+    # N.B. import must be deferred until we have set up import paths.
+    import xmlrunner
+    if not recording_impact():
+        return xmlrunner.XMLTestRunner(output='test.results', outsuffix='', **kwargs)
+    from xmlrunner.result import _XMLTestResult
+
+    class ImpactTestResult(_XMLTestResult):
+
+        def startTest(self, test):
+            switch_test_context(test.id())
+            super().startTest(test)
+
+        def stopTest(self, test):
+            super().stopTest(test)
+            switch_test_context(None)
+
+    switch_test_context(None)
+    return xmlrunner.XMLTestRunner(output='test.results', outsuffix='',
+                                   resultclass=ImpactTestResult, **kwargs)
+
+
+def group_by_class(suite):
+    """Returns a test suite for each test class in the given suite, so they can be run separately."""
+    classes = {}
+    for test, _ in list_classes(suite):
+        classes.setdefault(test.__class__, unittest.TestSuite()).addTest(test)
+    return list(classes.values())
+
+
+def run_suites(suites, index):
+    """Runs the given suites in a test worker, returns the number of failures."""
+    import io
+    # Buffer the output so it isn't interleaved with the other workers'.
+    stream = io.StringIO()
+    runner = xml_test_runner(stream=stream)
+    results = runner.run(unittest.TestSuite(suites))
+    sys.stderr.write(stream.getvalue())
+    return len(results.errors) + len(results.failures)
@@ -29,6 +29,9 @@ var opts = struct {
 	Site              bool               `short:"S" long:"site" description:"Allow the pex to import site at startup"`
 	ZipSafe           bool               `long:"zip_safe" description:"Marks this pex as zip-safe"`
 	AddTestRunnerDeps bool               `long:"add_test_runner_deps" description:"True if test-runner dependencies should be baked into test binaries"`
+	BytecodeOptLvl    int                `long:"bytecode_optimisation_level" default:"0" description:"The optimisation level (as for python -O) at which the pex's bytecode was compiled"`
+	CodeArchive       string             `long:"code_archive" description:"Compile pure-Python modules into a code archive using this interpreter, which must be the same version as the one the pex is run with"`
+	CodeArchiveOptLvl int                `long:"code_archive_optimisation_level" default:"0" description:"The optimisation level (as for python -O) at which to compile the code archive"`
 }{
 	Usage: `
 please_pex is a tool to create .pex files for Python.
@@ -56,6 +59,10 @@ func main() {
 	if opts.Test {
 		w.SetTest(opts.TestSrcs, opts.TestRunner, opts.AddTestRunnerDeps)
 	}
+	w.SetBytecodeOptimisationLevel(opts.BytecodeOptLvl)
+	if opts.CodeArchive != "" {
+		w.SetCodeArchive(opts.CodeArchive, opts.CodeArchiveOptLvl)
+	}
 	if len(opts.Debug) > 0 {
 		w.SetDebugger(opts.Debug)
 	}
@@ -333,6 +333,22 @@ func (f *File) HasExistingFile(name string) bool {
 	return present
 }
 
+// A FileInfo describes a file that has been written to a zip file.
+type FileInfo struct {
+	CRC32              uint32
+	UncompressedSize64 uint64
+}
+
+// Files returns a description of every file that the writer has written so far, keyed by name.
+// Files written with WriteFile rather than copied from another zip file have a zero FileInfo.
+func (f *File) Files() map[string]FileInfo {
+	files := make(map[string]FileInfo, len(f.files))
+	for name, record := range f.files {
+		files[name] = FileInfo{CRC32: record.CRC32, UncompressedSize64: record.UncompressedSize64}
+	}
+	return files
+}
+
 // addExistingFile adds a record for an existing file, although doesn't write any contents.
 func (f *File) addExistingFile(name, file string, compressedSize, uncompressedSize uint64, crc uint32) {
 	f.files[name] = fileRecord{file, compressedSize, uncompressedSize, crc}
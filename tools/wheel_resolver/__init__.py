@@ -2,15 +2,21 @@ import click
 import typing
 import logging
 import click_log
+import os
 import sys
 import tools.wheel_resolver.wheel as wheel
 import tools.wheel_resolver.output as output
+import tools.wheel_resolver.batch as batch
+import tools.wheel_resolver.cache as cache
 import packaging.tags as tags
 import distlib.locators
 import itertools
+import concurrent.futures
 
 _LOGGER = logging.getLogger(__name__)
 
+_INDEX_URL = "https://pypi.org/simple"
+
 click_log.basic_config(_LOGGER)
 
 
@@ -27,7 +33,6 @@ click_log.basic_config(_LOGGER)
     "--package-name",
     "--package",
     metavar="NAME",
-    required=True,
     help="Name of Python package in PyPI",
 )
 @click.option(
@@ -68,33 +73,235 @@ click_log.basic_config(_LOGGER)
     multiple=False,
     help="Whether prereleased wheels should also be downloaded",
 )
+@click.option(
+    "--batch",
+    "batch_file",
+    type=click.File("r"),
+    metavar="FILE",
+    help="Resolve the packages requested in FILE, one JSON object per line, instead of --package-name",
+)
+@click.option(
+    "--jobs",
+    default=8,
+    metavar="JOBS",
+    show_default=True,
+    type=click.IntRange(min=1),
+    help="The number of packages to resolve at once in batch mode",
+)
+@click.option(
+    "--cache-dir",
+    metavar="DIR",
+    envvar="WHEEL_RESOLVER_CACHE_DIR",
+    help="Directory to cache package index pages and wheels in, which may be shared by concurrent resolvers",
+)
+@click.option(
+    "--cache-ttl",
+    default=600,
+    metavar="SECONDS",
+    show_default=True,
+    type=click.FloatRange(min=0),
+    help="How long to use cached index pages for before revalidating them with the index",
+)
+@click.option(
+    "--cache-max-size",
+    default=10240,
+    metavar="MIB",
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="The size in MiB beyond which the least recently used wheels are evicted from the cache; 0 for no limit",
+)
+@click.option(
+    "--hash",
+    "hashes",
+    multiple=True,
+    metavar="HASH",
+    envvar="WHEEL_RESOLVER_HASHES",
+    help="A hash that the downloaded wheel must match, for example sha256:<hex>; it must match one of them if given more than once",
+)
+@click.option(
+    "--timeout",
+    default=60,
+    metavar="SECONDS",
+    show_default=True,
+    type=click.FloatRange(min=0, min_open=True),
+    help="How long to wait to connect to a server or to receive data from it",
+)
+@click.option(
+    "--retries",
+    default=3,
+    metavar="RETRIES",
+    show_default=True,
+    type=click.IntRange(min=0),
+    help="How many times to resume an interrupted download",
+)
 @click_log.simple_verbosity_option(_LOGGER)
 def main(
     url: typing.Tuple[str],
-    package_name: str,
+    package_name: typing.Optional[str],
     package_version: typing.Optional[str],
     interpreter: typing.Tuple[str, ...],
     platform: typing.Tuple[str, ...],
     abi: typing.Tuple[str, ...],
     prereleases: bool = False,
+    batch_file: typing.Optional[typing.TextIO] = None,
+    jobs: int = 8,
+    cache_dir: typing.Optional[str] = None,
+    cache_ttl: float = 600,
+    cache_max_size: int = 10240,
+    hashes: typing.Tuple[str, ...] = (),
+    timeout: float = 60,
+    retries: int = 3,
 ):
     """Resolve a wheel by name and version to a URL.
 
     If URLs are specified, they are checked literally before doing a lookup in
-    PyPI for PACKAGE with VERSION.
+    PyPI for PACKAGE with VERSION. The rest are probed at once while the first
+    is downloaded, and if that fails the package is downloaded from the next
+    one (in the order given) that has it.
+
+    In batch mode, each line of FILE is a JSON object describing a package to
+    resolve, with the keys "package", "out" (the file to download it to) and
+    optionally "version", "urls", "interpreter", "platform", "abi" and
+    "prereleases"; the command-line values are used for any of the last four
+    that are missing. Up to JOBS packages are resolved and downloaded at once.
+    Requests may also give the "hashes" that their wheel must match.
 
     """
+    locators = batch.LocatorPool(_INDEX_URL, _caching_opener(cache_dir, cache_ttl))
+    wheel_cache = None
+    if cache_dir:
+        wheel_cache = cache.WheelCache(
+            os.path.join(cache_dir, "wheels"), cache_max_size << 20
+        )
+    stats = output.MirrorStats()
+    click.get_current_context().call_on_close(stats.log)
+    options = output.DownloadOptions(wheel_cache, timeout, retries, stats)
+    if batch_file is not None:
+        _main_batch(
+            batch_file,
+            interpreter,
+            platform,
+            abi,
+            prereleases,
+            jobs,
+            locators,
+            options,
+        )
+        return
+    if package_name is None:
+        raise click.UsageError("one of --package-name or --batch is required")
+
     try:
         output_name = output.get()
     except output.OutputNotSetError:
         _LOGGER.error("could not get $OUTS")
         sys.exit(1)
 
-    if output.download(package_name, package_version, url, output_name):
-        return
+    if not _resolve(
+        package_name,
+        package_version,
+        url,
+        interpreter,
+        platform,
+        abi,
+        prereleases,
+        output_name,
+        lambda: locators.get(list(itertools.product(interpreter, abi, platform))),
+        options,
+        hashes,
+    ):
+        sys.exit(1)
+
+
+def _caching_opener(
+    cache_dir: typing.Optional[str], ttl: float
+) -> typing.Optional[typing.Callable[[typing.Any], typing.Any]]:
+    """Return a function that wraps a locator's opener with the cache, if there is one."""
+    if not cache_dir:
+        return None
+    return lambda opener: cache.CachingOpener(
+        opener, os.path.join(cache_dir, "index"), ttl
+    )
+
+
+def _main_batch(
+    requests_file: typing.TextIO,
+    interpreter: typing.Tuple[str, ...],
+    platform: typing.Tuple[str, ...],
+    abi: typing.Tuple[str, ...],
+    prereleases: bool,
+    jobs: int,
+    locators: batch.LocatorPool,
+    options: output.DownloadOptions,
+) -> None:
+    """Resolve and download each package requested in requests_file concurrently."""
+    try:
+        requests = batch.read(
+            requests_file,
+            interpreter=interpreter,
+            platform=platform,
+            abi=abi,
+            prereleases=prereleases,
+        )
+    except batch.InvalidRequestError as error:
+        _LOGGER.error(error)
+        sys.exit(1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [
+            executor.submit(
+                _resolve,
+                r.package_name,
+                r.package_version,
+                r.urls,
+                r.interpreter,
+                r.platform,
+                r.abi,
+                r.prereleases,
+                r.out,
+                lambda r=r: locators.get(
+                    list(itertools.product(r.interpreter, r.abi, r.platform))
+                ),
+                options,
+                r.hashes,
+            )
+            for r in requests
+        ]
+    failed = [r for r, f in zip(requests, futures) if not f.result()]
+    if failed:
+        _LOGGER.error(
+            "could not resolve %d of %d packages: %s",
+            len(failed),
+            len(requests),
+            ", ".join(f"{r.package_name}-{r.package_version}" for r in failed),
+        )
+        sys.exit(1)
+
+
+def _resolve(
+    package_name: str,
+    package_version: typing.Optional[str],
+    url: typing.Tuple[str, ...],
+    interpreter: typing.Tuple[str, ...],
+    platform: typing.Tuple[str, ...],
+    abi: typing.Tuple[str, ...],
+    prereleases: bool,
+    output_name: str,
+    get_locator: typing.Callable[[], distlib.locators.Locator],
+    options: output.DownloadOptions = output.DownloadOptions(),
+    hashes: typing.Sequence[str] = (),
+) -> bool:
+    """Download a package to output_name, from url or else from PyPI.
+
+    Returns whether it was downloaded; if not, the reason has been logged. If
+    any hashes are given, the package must match one of them.
+
+    """
+    if output.download(
+        package_name, package_version, url, output_name, options, hashes
+    ):
+        return True
 
-    locator = distlib.locators.SimpleScrapingLocator(url="https://pypi.org/simple")
-    locator.wheel_tags = list(itertools.product(interpreter, abi, platform))
     try:
         u = wheel.url(
             package_name=package_name,
@@ -108,15 +315,18 @@ def main(
                     platforms=set(platform).union({"any"}),
                 )
             ],
-            locator=locator,
+            locator=get_locator(),
             prereleases=prereleases,
         )
         pypi_url = (u,)
     except Exception as error:
         _LOGGER.error(error)
         _LOGGER.error(f"could not find PyPI URL for {package_name}-{package_version}")
-        sys.exit(1)
+        return False
 
-    if not output.download(package_name, package_version, pypi_url, output_name):
+    if not output.download(
+        package_name, package_version, pypi_url, output_name, options, hashes
+    ):
         _LOGGER.error("could not download %s-%s", package_name, package_version)
-        sys.exit(1)
+        return False
+    return True
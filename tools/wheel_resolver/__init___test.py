@@ -85,3 +85,74 @@ class TestMain(unittest.TestCase):
 
         # Check that the program exited with an error code
         assert result.exit_code == 1
+
+    def test_package_name_or_batch_required(self) -> None:
+        runner = click.testing.CliRunner()
+        result = runner.invoke(cli=sut.main, args=[])
+        assert result.exit_code == 2
+
+    @unittest.mock.patch.object(sut.output, "download")
+    @unittest.mock.patch.object(sut.wheel, "url")
+    def test_batch(
+        self,
+        mock_wheel_url: unittest.mock.MagicMock,
+        mock_output_download: unittest.mock.MagicMock,
+    ) -> None:
+        mock_wheel_url.side_effect = lambda package_name, **kwargs: (
+            f"https://example.com/{package_name}.whl"
+        )
+        mock_output_download.side_effect = lambda package_name, package_version, url, output_name, options, hashes: bool(
+            url
+        )
+
+        runner = click.testing.CliRunner()
+        result = runner.invoke(
+            cli=sut.main,
+            args=["--batch", "-", "--jobs", "2"],
+            input="\n".join(
+                f'{{"package": "p{i}", "version": "1.0", "out": "p{i}.whl"}}'
+                for i in range(4)
+            ),
+        )
+
+        assert result.exit_code == 0
+        downloads = {
+            (c.args[0], c.args[2], c.args[3])
+            for c in mock_output_download.call_args_list
+            if c.args[2]
+        }
+        assert downloads == {
+            (f"p{i}", (f"https://example.com/p{i}.whl",), f"p{i}.whl") for i in range(4)
+        }
+
+    @unittest.mock.patch.object(sut.output, "download")
+    @unittest.mock.patch.object(sut.wheel, "url")
+    @unittest.mock.patch.object(sut, "_LOGGER")
+    def test_batch_failure(
+        self,
+        mock_logger: unittest.mock.MagicMock,
+        mock_wheel_url: unittest.mock.MagicMock,
+        mock_output_download: unittest.mock.MagicMock,
+    ) -> None:
+        def url(package_name, **kwargs):
+            if package_name == "missing":
+                raise sut.wheel.DistributionNotFoundError(package_name)
+            return f"https://example.com/{package_name}.whl"
+
+        mock_wheel_url.side_effect = url
+        mock_output_download.side_effect = lambda package_name, package_version, url, output_name, options, hashes: bool(
+            url
+        )
+
+        runner = click.testing.CliRunner()
+        result = runner.invoke(
+            cli=sut.main,
+            args=["--batch", "-"],
+            input='{"package": "present", "out": "a.whl"}\n'
+            '{"package": "missing", "version": "1.0", "out": "b.whl"}\n',
+        )
+
+        mock_logger.error.assert_any_call(
+            "could not resolve %d of %d packages: %s", 1, 2, "missing-1.0"
+        )
+        assert result.exit_code == 1
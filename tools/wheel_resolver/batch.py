@@ -0,0 +1,198 @@
+import http.client
+import json
+import threading
+import typing
+import urllib.error
+import urllib.request
+import distlib.locators
+
+
+class InvalidRequestError(ValueError):
+    pass
+
+
+class Request(typing.NamedTuple):
+    """A request to resolve a package to a wheel and download it to out."""
+
+    package_name: str
+    package_version: typing.Optional[str]
+    out: str
+    urls: typing.Tuple[str, ...]
+    interpreter: typing.Tuple[str, ...]
+    platform: typing.Tuple[str, ...]
+    abi: typing.Tuple[str, ...]
+    prereleases: bool
+    hashes: typing.Tuple[str, ...] = ()
+
+
+def read(
+    lines: typing.Iterable[str],
+    *,
+    interpreter: typing.Tuple[str, ...],
+    platform: typing.Tuple[str, ...],
+    abi: typing.Tuple[str, ...],
+    prereleases: bool = False,
+) -> typing.List[Request]:
+    """Read batch requests, one JSON object per line.
+
+    Each object has the keys "package", "out" and optionally "version", "urls",
+    "hashes", "interpreter", "platform", "abi" and "prereleases"; the given
+    values are used for any of the last four that are missing. Blank lines are
+    ignored.
+
+    """
+    requests = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+            requests.append(
+                Request(
+                    package_name=obj["package"],
+                    package_version=obj.get("version"),
+                    out=obj["out"],
+                    urls=tuple(obj.get("urls", ())),
+                    interpreter=tuple(obj.get("interpreter", interpreter)),
+                    platform=tuple(obj.get("platform", platform)),
+                    abi=tuple(obj.get("abi", abi)),
+                    prereleases=_bool(obj.get("prereleases", prereleases)),
+                    hashes=tuple(obj.get("hashes", ())),
+                )
+            )
+        except (ValueError, KeyError, TypeError, AttributeError) as error:
+            raise InvalidRequestError(f"invalid request on line {number}: {error!r}")
+    return requests
+
+
+def _bool(value: typing.Any) -> bool:
+    # bool("false") is True, so only accept JSON's true and false.
+    if not isinstance(value, bool):
+        raise TypeError(f"expected true or false, got {value!r}")
+    return value
+
+
+class LocatorPool:
+    """Hands out a locator for each thread and set of wheel tags.
+
+    distlib's locators only locate one distribution at a time, so each thread
+    resolving packages needs its own. They all share one URL opener (which is
+    wrapped by wrap_opener, if given), and each keeps the projects it has
+    located for the next request that uses it. The opener keeps a connection
+    to the index alive for each thread, so the threads don't pay for a new
+    connection and TLS handshake on every request.
+
+    """
+
+    def __init__(
+        self,
+        url: str,
+        wrap_opener: typing.Optional[typing.Callable[[typing.Any], typing.Any]] = None,
+    ) -> None:
+        self._url = url
+        self._wrap_opener = wrap_opener
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opener = None
+
+    def get(
+        self, wheel_tags: typing.List[typing.Tuple[str, str, str]]
+    ) -> distlib.locators.SimpleScrapingLocator:
+        locators = self._local.__dict__.setdefault("locators", {})
+        key = tuple(wheel_tags)
+        locator = locators.get(key)
+        if locator is None:
+            # A simple index has one page per project, so there's nothing for
+            # more than one worker thread per locator to do.
+            locator = distlib.locators.SimpleScrapingLocator(
+                url=self._url, num_workers=1
+            )
+            locator.wheel_tags = list(wheel_tags)
+            with self._lock:
+                if self._opener is None:
+                    # The same as the locator's own opener, but with connections
+                    # that are kept alive.
+                    self._opener = urllib.request.build_opener(
+                        distlib.locators.RedirectHandler(), KeepAliveHandler()
+                    )
+                    if self._wrap_opener:
+                        self._opener = self._wrap_opener(self._opener)
+            locator.opener = self._opener
+            locators[key] = locator
+        return locator
+
+
+class KeepAliveHandler(urllib.request.HTTPHandler, urllib.request.HTTPSHandler):
+    """Opens HTTP and HTTPS requests on connections that are kept alive.
+
+    urllib's own handlers open a new connection for every request. This keeps
+    one open connection per host for each thread, and reuses it for the
+    thread's next request to that host once the last response has been read.
+
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._local = threading.local()
+
+    def do_open(self, http_class, req, **http_conn_args):
+        if not req.host:
+            raise urllib.error.URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers = {name.title(): value for name, value in headers.items()}
+        tunnel_headers = {}
+        if req._tunnel_host and "Proxy-Authorization" in headers:
+            # This is for the proxy, not the server at the other end.
+            tunnel_headers["Proxy-Authorization"] = headers.pop("Proxy-Authorization")
+
+        connections = self._local.__dict__.setdefault("connections", {})
+        key = (http_class, req.host, req._tunnel_host)
+        conn = connections.pop(key, None)
+        resp = None
+        if conn is not None:
+            try:
+                resp = self._request(conn, req, headers)
+            except http.client.ImproperConnectionState:
+                pass  # The last response on it hasn't been read, so leave it be.
+            except ConnectionError as error:
+                # The server may have closed it while it was idle, in which case
+                # an idempotent request can safely be made again on a new one.
+                if req.get_method() not in ("GET", "HEAD"):
+                    raise urllib.error.URLError(error)
+        if resp is None:
+            conn = http_class(req.host, timeout=req.timeout, **http_conn_args)
+            conn.set_debuglevel(self._debuglevel)
+            if req._tunnel_host:
+                conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+            try:
+                resp = self._request(conn, req, headers)
+            except OSError as error:
+                raise urllib.error.URLError(error)
+        if not resp.will_close:
+            connections[key] = conn
+        resp.url = req.get_full_url()
+        resp.msg = resp.reason
+        return resp
+
+    @staticmethod
+    def _request(
+        conn: http.client.HTTPConnection,
+        req: urllib.request.Request,
+        headers: typing.Dict[str, str],
+    ) -> http.client.HTTPResponse:
+        """Make the request on conn, closing it if that fails."""
+        try:
+            conn.request(
+                req.get_method(),
+                req.selector,
+                req.data,
+                headers,
+                encode_chunked=req.has_header("Transfer-encoding"),
+            )
+            return conn.getresponse()
+        except http.client.ImproperConnectionState:
+            raise
+        except BaseException:
+            conn.close()
+            raise
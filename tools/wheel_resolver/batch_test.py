@@ -0,0 +1,141 @@
+import http.server
+import io
+import threading
+import unittest
+import urllib.error
+import tools.wheel_resolver.batch as sut
+
+
+class TestRead(unittest.TestCase):
+    def _read(self, text: str):
+        return sut.read(
+            io.StringIO(text),
+            interpreter=("cp310",),
+            platform=("linux_x86_64",),
+            abi=("cp310",),
+        )
+
+    def test_defaults(self) -> None:
+        requests = self._read('{"package": "pyyaml", "out": "pyyaml.whl"}\n\n')
+        assert requests == [
+            sut.Request(
+                package_name="pyyaml",
+                package_version=None,
+                out="pyyaml.whl",
+                urls=(),
+                interpreter=("cp310",),
+                platform=("linux_x86_64",),
+                abi=("cp310",),
+                prereleases=False,
+            )
+        ]
+
+    def test_overrides(self) -> None:
+        (request,) = self._read(
+            '{"package": "six", "version": "1.16.0", "out": "six.whl", '
+            '"urls": ["https://example.com/six.whl"], "interpreter": ["py3"], '
+            '"abi": ["none"], "platform": ["any"], "prereleases": true, '
+            '"hashes": ["sha256:abc"]}'
+        )
+        assert request.package_version == "1.16.0"
+        assert request.urls == ("https://example.com/six.whl",)
+        assert request.interpreter == ("py3",)
+        assert request.abi == ("none",)
+        assert request.platform == ("any",)
+        assert request.prereleases
+        assert request.hashes == ("sha256:abc",)
+
+    def test_invalid(self) -> None:
+        for text in (
+            "not json",
+            '{"out": "x.whl"}',
+            '["pyyaml"]',
+            '{"package": "six", "out": "six.whl", "prereleases": "false"}',
+            '{"package": "six", "out": "six.whl", "prereleases": 0}',
+        ):
+            with self.assertRaises(sut.InvalidRequestError):
+                self._read(text)
+
+
+class TestLocatorPool(unittest.TestCase):
+    def test_locators(self) -> None:
+        pool = sut.LocatorPool("https://example.com/simple")
+        tags = [("cp310", "cp310", "linux_x86_64")]
+        locator = pool.get(tags)
+        assert locator.wheel_tags == tags
+        assert pool.get(tags) is locator
+        assert pool.get([("py3", "none", "any")]) is not locator
+
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.get(tags)))
+        thread.start()
+        thread.join()
+        assert other[0] is not locator
+        assert other[0].opener is locator.opener
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = 0
+
+    def setup(self) -> None:
+        super().setup()
+        Handler.connections += 1
+
+    def do_GET(self) -> None:
+        if self.path.startswith("/missing/"):
+            self.send_error(404)
+            return
+        body = f"<html>{self.path}</html>".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        # Close the connection without saying so, as a server does when a
+        # connection has been idle for too long.
+        self.close_connection = self.path.startswith("/close/")
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class TestKeepAlive(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        Handler.connections = 0
+        pool = sut.LocatorPool(self.url + "/simple")
+        self.opener = pool.get([("py3", "none", "any")]).opener
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _get(self, path: str) -> bytes:
+        with self.opener.open(self.url + path, timeout=10) as resp:
+            return resp.read()
+
+    def test_connections_are_reused(self) -> None:
+        for project in ("six", "pyyaml", "six"):
+            assert self._get(f"/simple/{project}/") == (
+                f"<html>/simple/{project}/</html>".encode()
+            )
+        assert Handler.connections == 1
+
+        # Each thread has a connection of its own.
+        thread = threading.Thread(target=lambda: self._get("/simple/six/"))
+        thread.start()
+        thread.join()
+        assert Handler.connections == 2
+
+    def test_closed_connections_are_replaced(self) -> None:
+        assert self._get("/close/six/") == b"<html>/close/six/</html>"
+        assert self._get("/simple/six/") == b"<html>/simple/six/</html>"
+        assert Handler.connections == 2
+
+    def test_errors_leave_connection_usable(self) -> None:
+        with self.assertRaises(urllib.error.HTTPError):
+            self._get("/missing/six/")
+        assert self._get("/simple/six/") == b"<html>/simple/six/</html>"
@@ -0,0 +1,227 @@
+import email.message
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+import typing
+import urllib.error
+import urllib.request
+import urllib.response
+import uuid
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class CachingOpener:
+    """Wraps a URL opener with an on-disk cache of the pages it fetches.
+
+    A page fetched less than ttl seconds ago is served from the cache without
+    any request; an older one is revalidated with a conditional request using
+    its ETag and Last-Modified headers, and served from the cache if it hasn't
+    changed. Entries are written atomically, so the cache can be shared by
+    concurrent processes.
+
+    """
+
+    def __init__(
+        self, opener: urllib.request.OpenerDirector, cache_dir: str, ttl: float
+    ) -> None:
+        self._opener = opener
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def open(self, req: urllib.request.Request, timeout: typing.Optional[float] = None):
+        url = req.full_url
+        path = os.path.join(self._cache_dir, hashlib.sha256(url.encode()).hexdigest())
+        entry = _read(path)
+        if entry is not None:
+            metadata, body = entry
+            if time.time() - metadata["fetched"] < self._ttl:
+                _LOGGER.debug("using cached %s", url)
+                return _response(metadata, body)
+            if metadata.get("etag"):
+                req.add_header("If-None-Match", metadata["etag"])
+            if metadata.get("last_modified"):
+                req.add_header("If-Modified-Since", metadata["last_modified"])
+        try:
+            resp = self._opener.open(req, timeout=timeout)
+        except urllib.error.HTTPError as error:
+            if error.code != 304 or entry is None:
+                raise
+            _LOGGER.debug("cached %s is still valid", url)
+            metadata["fetched"] = time.time()
+            _write(path, metadata, body)
+            return _response(metadata, body)
+
+        body = resp.read()
+        metadata = {
+            "url": resp.geturl(),
+            "headers": list(resp.info().items()),
+            "etag": resp.info().get("ETag"),
+            "last_modified": resp.info().get("Last-Modified"),
+            "fetched": time.time(),
+        }
+        _write(path, metadata, body)
+        return _response(metadata, body)
+
+
+def _read(path: str) -> typing.Optional[typing.Tuple[dict, bytes]]:
+    """Read a cache entry, which is its metadata as JSON on one line, then the body."""
+    try:
+        with open(path, "rb") as f:
+            return json.loads(f.readline()), f.read()
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path: str, metadata: dict, body: bytes) -> None:
+    """Write a cache entry atomically, so concurrent readers see all of it or none."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(json.dumps(metadata).encode() + b"\n")
+            f.write(body)
+        os.replace(tmp, path)
+    except OSError as error:
+        _LOGGER.warning("could not cache %s: %s", metadata["url"], error)
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def _response(metadata: dict, body: bytes) -> urllib.response.addinfourl:
+    headers = email.message.Message()
+    for name, value in metadata["headers"]:
+        headers[name] = value
+    return urllib.response.addinfourl(io.BytesIO(body), headers, metadata["url"], 200)
+
+
+class WheelCache:
+    """A content-addressed cache of downloaded wheels.
+
+    Each wheel is stored once, named after its sha256, and is found either by
+    that or by the URL it was downloaded from. Wheels are reflinked into and
+    out of the cache where the filesystem supports it, and copied otherwise,
+    so that changing a wheel it handed out can't change the cached one. The
+    least recently used wheels are evicted when the cache grows beyond
+    max_size bytes (if it's non-zero).
+
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 0) -> None:
+        self._blobs = os.path.join(cache_dir, "sha256")
+        self._urls = os.path.join(cache_dir, "urls")
+        self._max_size = max_size
+        os.makedirs(self._blobs, exist_ok=True)
+        os.makedirs(self._urls, exist_ok=True)
+
+    def get(
+        self, url: typing.Optional[str], out: str, sha256: typing.Optional[str] = None
+    ) -> bool:
+        """Put the cached wheel with the given sha256, or else the one downloaded
+        from url, at out. Returns whether there was one."""
+        digest = sha256 or self._digest(url)
+        if digest is None:
+            return False
+        blob = os.path.join(self._blobs, digest)
+        try:
+            _copy(blob, out)
+        except FileNotFoundError:
+            return False
+        try:
+            os.utime(blob)  # Mark it as recently used.
+        except OSError:
+            pass
+        return True
+
+    def put(self, url: str, path: str) -> str:
+        """Add the wheel at path, which was downloaded from url, to the cache.
+
+        Returns its sha256.
+
+        """
+        digest = _sha256(path)
+        blob = os.path.join(self._blobs, digest)
+        if not os.path.exists(blob):
+            _copy(path, blob, mode=0o444)
+        fd, tmp = tempfile.mkstemp(dir=self._urls, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            f.write(digest)
+        os.replace(tmp, self._ref(url))
+        self._evict()
+        return digest
+
+    def _digest(self, url: str) -> typing.Optional[str]:
+        try:
+            with open(self._ref(url)) as f:
+                return f.read().strip() or None
+        except OSError:
+            return None
+
+    def _ref(self, url: str) -> str:
+        return os.path.join(self._urls, hashlib.sha256(url.encode()).hexdigest())
+
+    def _evict(self) -> None:
+        """Evict the least recently used wheels until the cache fits in max_size."""
+        if not self._max_size:
+            return
+        blobs = []
+        for name in os.listdir(self._blobs):
+            path = os.path.join(self._blobs, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # Evicted by someone else.
+            blobs.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in blobs)
+        for _, size, path in sorted(blobs):
+            if total <= self._max_size:
+                break
+            _LOGGER.debug("evicting %s from the wheel cache", path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _copy(src: str, dest: str, mode: typing.Optional[int] = None) -> None:
+    """Atomically put a copy of src at dest, as a reflink if the filesystem
+    supports them. The copy is given the mode, if any, before it's put in
+    place."""
+    tmp = os.path.join(
+        os.path.dirname(os.path.abspath(dest)), f".tmp-{uuid.uuid4().hex}"
+    )
+    try:
+        try:
+            _reflink(src, tmp)
+        except (OSError, ImportError):
+            shutil.copyfile(src, tmp)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, dest)
+    finally:
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+
+
+def _reflink(src: str, dest: str) -> None:
+    """Clone src to dest on filesystems that support copy-on-write (Linux only)."""
+    import fcntl
+
+    with open(src, "rb") as s, open(dest, "wb") as d:
+        fcntl.ioctl(d.fileno(), 0x40049409, s.fileno())  # FICLONE
@@ -0,0 +1,139 @@
+import email.message
+import io
+import os
+import stat
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+import urllib.response
+import tools.wheel_resolver.cache as sut
+
+_URL = "https://example.com/simple/six/"
+
+
+class FakeOpener:
+    def __init__(self) -> None:
+        self.requests = []
+        self.not_modified = False
+
+    def open(self, req: urllib.request.Request, timeout=None):
+        self.requests.append(req)
+        if self.not_modified:
+            raise urllib.error.HTTPError(req.full_url, 304, "Not Modified", {}, None)
+        headers = email.message.Message()
+        headers["Content-Type"] = "text/html"
+        headers["ETag"] = '"v1"'
+        return urllib.response.addinfourl(
+            io.BytesIO(b"<html>six</html>"), headers, req.full_url, 200
+        )
+
+
+class TestCachingOpener(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.opener = FakeOpener()
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _open(self, ttl: float):
+        opener = sut.CachingOpener(self.opener, self.dir.name, ttl)
+        return opener.open(urllib.request.Request(_URL))
+
+    def test_fresh_entries_are_served_from_cache(self) -> None:
+        assert self._open(ttl=600).read() == b"<html>six</html>"
+        resp = self._open(ttl=600)
+        assert resp.read() == b"<html>six</html>"
+        assert resp.info()["Content-Type"] == "text/html"
+        assert resp.geturl() == _URL
+        assert len(self.opener.requests) == 1
+
+    def test_stale_entries_are_revalidated(self) -> None:
+        self._open(ttl=0)
+        self.opener.not_modified = True
+        assert self._open(ttl=0).read() == b"<html>six</html>"
+        assert len(self.opener.requests) == 2
+        assert self.opener.requests[1].get_header("If-none-match") == '"v1"'
+
+    def test_not_modified_without_entry_is_raised(self) -> None:
+        self.opener.not_modified = True
+        with self.assertRaises(urllib.error.HTTPError):
+            self._open(ttl=600)
+
+    def test_no_temporary_files_are_left(self) -> None:
+        self._open(ttl=600)
+        assert not [f for f in os.listdir(self.dir.name) if f.startswith(".tmp-")]
+
+
+class TestWheelCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, "cache")
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def _wheel(self, name: str, contents: bytes) -> str:
+        path = os.path.join(self.dir.name, name)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def test_get_by_url_and_sha256(self) -> None:
+        cache = sut.WheelCache(self.cache_dir)
+        out = os.path.join(self.dir.name, "out.whl")
+        assert not cache.get("https://example.com/a.whl", out)
+
+        digest = cache.put("https://example.com/a.whl", self._wheel("a.whl", b"a"))
+        assert cache.get("https://example.com/a.whl", out)
+        with open(out, "rb") as f:
+            assert f.read() == b"a"
+
+        os.unlink(out)
+        assert cache.get("https://mirror.example.com/a.whl", out, sha256=digest)
+        assert not cache.get("https://mirror.example.com/a.whl", out)
+
+    def test_put_leaves_wheel_alone(self) -> None:
+        cache = sut.WheelCache(self.cache_dir)
+        wheel = self._wheel("a.whl", b"a")
+        cache.put("https://example.com/a.whl", wheel)
+        # The wheel is still writable, and changing it doesn't change the cache.
+        with open(wheel, "wb") as f:
+            f.write(b"b")
+        out = os.path.join(self.dir.name, "out.whl")
+        assert cache.get("https://example.com/a.whl", out)
+        with open(out, "rb") as f:
+            assert f.read() == b"a"
+
+    def test_get_leaves_cache_alone(self) -> None:
+        cache = sut.WheelCache(self.cache_dir)
+        cache.put("https://example.com/a.whl", self._wheel("a.whl", b"a"))
+        out = os.path.join(self.dir.name, "out.whl")
+        assert cache.get("https://example.com/a.whl", out)
+        # The wheel that's handed out is writable, and changing it doesn't
+        # change the cache.
+        assert os.stat(out).st_mode & stat.S_IWUSR
+        with open(out, "wb") as f:
+            f.write(b"b")
+        os.unlink(out)
+        assert cache.get("https://example.com/a.whl", out)
+        with open(out, "rb") as f:
+            assert f.read() == b"a"
+
+    def test_evicts_least_recently_used(self) -> None:
+        cache = sut.WheelCache(self.cache_dir, max_size=2)
+        out = os.path.join(self.dir.name, "out.whl")
+        cache.put("https://example.com/a.whl", self._wheel("a.whl", b"a"))
+        cache.put("https://example.com/b.whl", self._wheel("b.whl", b"b"))
+        # Make a the older of the two, then use it so that b is evicted instead.
+        blobs = os.path.join(self.cache_dir, "sha256")
+        for name in os.listdir(blobs):
+            os.utime(os.path.join(blobs, name), (0, 0))
+        assert cache.get("https://example.com/a.whl", out)
+        cache.put("https://example.com/c.whl", self._wheel("c.whl", b"c"))
+
+        assert cache.get("https://example.com/a.whl", out)
+        assert not cache.get("https://example.com/b.whl", out)
+        assert cache.get("https://example.com/c.whl", out)
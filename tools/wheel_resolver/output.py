@@ -1,10 +1,23 @@
+import collections
+import hashlib
+import http.client
 import os
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.error
 import urllib.request
 import logging
 import typing
+import tools.wheel_resolver.cache as cache
 
 _LOGGER = logging.getLogger(__name__)
 
+_CHUNK_SIZE = 1 << 20
+# How often to log the progress of a download, in seconds.
+_PROGRESS_INTERVAL = 5
+
 
 class OutputNotSetError(RuntimeError):
     pass
@@ -17,21 +30,355 @@ def get() -> str:
     return output
 
 
+class MirrorStats:
+    """Collects how long each mirror takes to respond to requests."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._latencies = collections.defaultdict(list)
+        self._failures = collections.Counter()
+
+    def record(self, url: str, seconds: float, ok: bool) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        mirror = f"{parsed.scheme}://{parsed.netloc}"
+        with self._lock:
+            self._latencies[mirror].append(seconds)
+            if not ok:
+                self._failures[mirror] += 1
+
+    def log(self) -> None:
+        with self._lock:
+            for mirror, latencies in sorted(self._latencies.items()):
+                _LOGGER.debug(
+                    "%s: %d requests, %d failed, latency min %.0fms, median %.0fms, max %.0fms",
+                    mirror,
+                    len(latencies),
+                    self._failures[mirror],
+                    min(latencies) * 1000,
+                    statistics.median(latencies) * 1000,
+                    max(latencies) * 1000,
+                )
+
+
+class DownloadOptions(typing.NamedTuple):
+    wheel_cache: typing.Optional[cache.WheelCache] = None
+    # Timeout in seconds for connecting and for each read.
+    timeout: float = 60
+    # How many times to resume an interrupted download.
+    retries: int = 3
+    stats: typing.Optional[MirrorStats] = None
+
+
+class HashMismatchError(RuntimeError):
+    pass
+
+
+class _TransientError(RuntimeError):
+    pass
+
+
 def download(
     package_name: str,
     package_version: typing.Optional[str],
     url: typing.Tuple[str],
     download_output: str,
+    options: DownloadOptions = DownloadOptions(),
+    hashes: typing.Sequence[str] = (),
 ) -> bool:
-    """Download url to $OUTS."""
-    for u in url:
+    """Download url to $OUTS, or take it from the wheel cache if it's there.
+
+    If any hashes are given (e.g. "sha256:<hex>", or hex digests of sha1 or
+    sha256 without a prefix), the download must match one of them.
+
+    If there's more than one URL, the rest are probed at once while the first
+    is downloaded, and if that fails the wheel is downloaded from the next one
+    (in the order given) that has it.
+
+    """
+    expected = _parse_hashes(hashes)
+    wheel_cache = options.wheel_cache
+    if wheel_cache is not None:
+        for algorithm, digest in expected:
+            if algorithm == "sha256" and wheel_cache.get(None, download_output, digest):
+                _LOGGER.info(f"using cached {package_name}-{package_version}")
+                return True
+        # A wheel cached by URL may not be the one we expect, so if we know
+        # what to expect we only look it up by hash (as above).
+        for u in () if expected else url:
+            if wheel_cache.get(u, download_output):
+                _LOGGER.info(f"using cached {package_name}-{package_version} from {u}")
+                return True
+    for u in _available(url, options):
         try:
-            urllib.request.urlretrieve(u, download_output)
-        except urllib.error.HTTPError as error:
+            _fetch(u, download_output, expected, options)
+        except (
+            OSError,
+            http.client.HTTPException,
+            HashMismatchError,
+            _TransientError,
+        ) as error:
             _LOGGER.warning(
                 f"download {package_name}-{package_version} from {u}: {error}",
             )
         else:
             _LOGGER.info(f"downloaded {package_name}-{package_version} from {u}")
+            if wheel_cache is not None:
+                try:
+                    wheel_cache.put(u, download_output)
+                except OSError as error:
+                    _LOGGER.warning(f"could not cache {u}: {error}")
             return True
     return False
+
+
+def _available(
+    urls: typing.Sequence[str], options: DownloadOptions
+) -> typing.Iterator[str]:
+    """Yield the URLs that might have the wheel, in order.
+
+    The first is yielded straight away, to be downloaded from without waiting
+    for a probe. Meanwhile the rest are all probed with a HEAD request at once,
+    so each of them is yielded as soon as it and all the ones before it have
+    responded, rather than waiting a round trip for each that doesn't have the
+    wheel in turn.
+
+    """
+    if not urls:
+        return
+    probes = [_Probe(u, options) for u in urls[1:]]
+    yield urls[0]
+    for probe in probes:
+        if probe.wait():
+            yield probe.url
+
+
+class _Probe:
+    """Probes a URL on a daemon thread, so that a mirror that doesn't respond
+    doesn't stop the process exiting once the wheel's been downloaded."""
+
+    def __init__(self, url: str, options: DownloadOptions) -> None:
+        self.url = url
+        self._ok = False
+        self._thread = threading.Thread(target=self._run, args=(options,), daemon=True)
+        self._thread.start()
+
+    def _run(self, options: DownloadOptions) -> None:
+        self._ok = _probe(self.url, options)
+
+    def wait(self) -> bool:
+        self._thread.join()
+        return self._ok
+
+
+def _probe(url: str, options: DownloadOptions) -> bool:
+    """Return whether url might have the wheel, i.e. it's worth trying to download it."""
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(url, method="HEAD"), timeout=options.timeout
+        ) as resp:
+            result = str(resp.status)
+        ok = True
+    except urllib.error.HTTPError as error:
+        result = str(error.code)
+        # Some servers don't allow HEAD requests, and errors on the server's
+        # side may not last, so only give up on those that say it isn't there.
+        ok = error.code in (405, 429) or error.code >= 500
+    except (OSError, http.client.HTTPException) as error:
+        result = str(error)
+        ok = False
+    _record(options, "HEAD", url, result, start, ok)
+    return ok
+
+
+def _record(
+    options: DownloadOptions,
+    method: str,
+    url: str,
+    result: str,
+    start: float,
+    ok: bool,
+) -> None:
+    """Log how long a request to url took to get a response, and add it to the stats."""
+    elapsed = time.monotonic() - start
+    _LOGGER.debug("%s %s: %s in %.0fms", method, url, result, elapsed * 1000)
+    if options.stats is not None:
+        options.stats.record(url, elapsed, ok)
+
+
+def _parse_hashes(hashes: typing.Sequence[str]) -> typing.List[typing.Tuple[str, str]]:
+    """Parse hashes into (algorithm, hex digest) pairs, ignoring any we can't check."""
+    parsed = []
+    for h in hashes:
+        algorithm, _, digest = h.replace(" ", "").rpartition(":")
+        digest = digest.lower()
+        if not algorithm:
+            algorithm = {40: "sha1", 64: "sha256"}.get(len(digest), "")
+        if algorithm in hashlib.algorithms_available:
+            parsed.append((algorithm, digest))
+        else:
+            _LOGGER.debug("not checking unrecognised hash %r", h)
+    return parsed
+
+
+def _fetch(
+    url: str,
+    out: str,
+    expected: typing.List[typing.Tuple[str, str]],
+    options: DownloadOptions,
+) -> None:
+    """Stream url to out, hashing it as it's written.
+
+    It's downloaded to a partial file next to out, and resumed from where it
+    left off with a Range request if it's interrupted. Each URL has its own
+    partial file, so a download is only ever resumed from the same URL, and
+    only if the file there hasn't changed since.
+
+    """
+    part = f"{out}.{hashlib.sha256(url.encode()).hexdigest()[:16]}.part"
+    download = _PartialDownload(part, {algorithm for algorithm, _ in expected})
+    for attempt in range(options.retries + 1):
+        try:
+            download.fetch(url, options)
+            break
+        except urllib.error.HTTPError as error:
+            if error.code == 416:  # Our partial download is no good; start again.
+                download.reset()
+            elif error.code < 500 or attempt == options.retries:
+                raise
+        except (
+            _TransientError,
+            urllib.error.URLError,
+            http.client.HTTPException,
+            ConnectionError,
+            TimeoutError,
+        ) as error:
+            if attempt == options.retries:
+                raise
+            _LOGGER.warning(
+                "resuming download of %s from byte %d after error: %s",
+                url,
+                download.size,
+                error,
+            )
+    if expected and not any(
+        download.hexdigest(algorithm) == digest for algorithm, digest in expected
+    ):
+        download.reset()
+        raise HashMismatchError(
+            "got "
+            + ", ".join(
+                f"{a}:{download.hexdigest(a)}" for a in sorted(download.hashers)
+            )
+            + "; expected one of "
+            + ", ".join(f"{a}:{d}" for a, d in expected)
+        )
+    os.replace(part, out)
+    download.set_validator(None)
+
+
+class _PartialDownload:
+    """A partially downloaded file, and the hashes of its contents so far.
+
+    The ETag or Last-Modified time of the response it came from is kept next to
+    it, and sent in an If-Range header when resuming, so that the server sends
+    the whole file again if it's changed.
+
+    """
+
+    def __init__(self, path: str, algorithms: typing.Set[str]) -> None:
+        self.path = path
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.size = 0
+        self.validator = None
+        if os.path.exists(path):
+            # Resume the download from an earlier run, if we can tell that
+            # it's still the same file.
+            try:
+                with open(path + ".validator") as f:
+                    self.validator = f.read() or None
+            except OSError:
+                pass
+            if self.validator is None:
+                self.reset()
+                return
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                    self._update(chunk)
+
+    def reset(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.set_validator(None)
+        self.hashers = {a: hashlib.new(a) for a in self.hashers}
+        self.size = 0
+
+    def set_validator(self, validator: typing.Optional[str]) -> None:
+        self.validator = validator
+        if validator is None:
+            if os.path.exists(self.path + ".validator"):
+                os.unlink(self.path + ".validator")
+        else:
+            with open(self.path + ".validator", "w") as f:
+                f.write(validator)
+
+    def hexdigest(self, algorithm: str) -> str:
+        return self.hashers[algorithm].hexdigest()
+
+    def _update(self, chunk: bytes) -> None:
+        for hasher in self.hashers.values():
+            hasher.update(chunk)
+        self.size += len(chunk)
+
+    def fetch(self, url: str, options: DownloadOptions) -> None:
+        req = urllib.request.Request(url)
+        if self.size:
+            req.add_header("Range", f"bytes={self.size}-")
+            if self.validator is not None:
+                req.add_header("If-Range", self.validator)
+        start = time.monotonic()
+        try:
+            resp = urllib.request.urlopen(req, timeout=options.timeout)
+        except urllib.error.HTTPError as error:
+            _record(options, "GET", url, str(error.code), start, False)
+            raise
+        except (OSError, http.client.HTTPException) as error:
+            _record(options, "GET", url, str(error), start, False)
+            raise
+        _record(options, "GET", url, str(resp.status), start, True)
+        with resp:
+            if self.size and resp.status != 206:
+                _LOGGER.debug("%s has changed or can't be resumed", url)
+                self.reset()
+            if not self.size:
+                self.set_validator(_validator(resp.headers))
+            length = resp.headers.get("Content-Length")
+            total = self.size + int(length) if length else None
+            last_progress = time.monotonic()
+            with open(self.path, "ab" if self.size else "wb") as f:
+                for chunk in iter(lambda: resp.read(_CHUNK_SIZE), b""):
+                    f.write(chunk)
+                    self._update(chunk)
+                    if total is not None and self.size > total:
+                        break
+                    if time.monotonic() - last_progress > _PROGRESS_INTERVAL:
+                        last_progress = time.monotonic()
+                        _LOGGER.info(
+                            "downloaded %.1f of %s MiB from %s",
+                            self.size / 1048576,
+                            "?" if total is None else "%.1f" % (total / 1048576),
+                            url,
+                        )
+        if total is not None and self.size > total:
+            self.reset()  # We can't tell which part is wrong, so start again.
+            raise _TransientError(f"got more than the {total} bytes expected")
+        elif total is not None and self.size < total:
+            raise _TransientError(f"got {self.size} of {total} bytes")
+
+
+def _validator(headers: http.client.HTTPMessage) -> typing.Optional[str]:
+    """Return the value for an If-Range header that only matches this response."""
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):  # Weak ETags can't be used for ranges.
+        return etag
+    return headers.get("Last-Modified")
@@ -0,0 +1,205 @@
+import glob
+import hashlib
+import http.server
+import os
+import tempfile
+import threading
+import time
+import typing
+import unittest
+import tools.wheel_resolver.cache as cache
+import tools.wheel_resolver.output as sut
+
+_BODY = bytes(range(256)) * 4096
+_SHA256 = hashlib.sha256(_BODY).hexdigest()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    # How many more responses to cut off halfway through.
+    interruptions = 0
+    ranges = []
+    gets = []
+    heads = []
+    statuses = []
+    etag = '"v1"'
+
+    def do_HEAD(self) -> None:
+        Handler.heads.append(self.path)
+        if self.path.startswith("/slow/"):
+            time.sleep(0.3)
+        if self.path.startswith("/nohead/"):
+            self.send_error(405)
+        elif not self.path.endswith("/six.whl"):
+            self.send_error(404)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(_BODY)))
+            self.end_headers()
+
+    def do_GET(self) -> None:
+        if not self.path.endswith("/six.whl"):
+            self.send_error(404)
+            return
+        start = 0
+        range_header = self.headers.get("Range")
+        Handler.ranges.append(range_header)
+        Handler.gets.append(self.path)
+        if_range = self.headers.get("If-Range")
+        if range_header and if_range in (None, Handler.etag):
+            start = int(range_header[len("bytes=") : -1])
+            Handler.statuses.append(206)
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(_BODY) - 1}/{len(_BODY)}"
+            )
+        else:
+            Handler.statuses.append(200)
+            self.send_response(200)
+        body = _BODY[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", Handler.etag)
+        self.end_headers()
+        if Handler.interruptions:
+            Handler.interruptions -= 1
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+class ServerTestCase(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.dir.name, "six.whl")
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        Handler.interruptions = 0
+        Handler.ranges = []
+        Handler.gets = []
+        Handler.heads = []
+        Handler.statuses = []
+        Handler.etag = '"v1"'
+
+    def tearDown(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        self.dir.cleanup()
+
+    def _download(self, urls, **kwargs) -> bool:
+        return sut.download("six", "1.16.0", urls, self.out, **kwargs)
+
+    def _parts(self) -> typing.List[str]:
+        return glob.glob(os.path.join(self.dir.name, "*.part"))
+
+    def _contents(self) -> bytes:
+        with open(self.out, "rb") as f:
+            return f.read()
+
+
+class TestDownload(ServerTestCase):
+    def test_download(self) -> None:
+        assert self._download((f"{self.url}/missing.whl", f"{self.url}/six.whl"))
+        assert self._contents() == _BODY
+        assert os.listdir(self.dir.name) == ["six.whl"]
+
+    def test_resume(self) -> None:
+        Handler.interruptions = 1
+        assert self._download((f"{self.url}/six.whl",), hashes=(f"sha256:{_SHA256}",))
+        assert self._contents() == _BODY
+        assert Handler.ranges == [None, f"bytes={len(_BODY) // 2}-"]
+
+    def test_retries_exhausted(self) -> None:
+        Handler.interruptions = 2
+        options = sut.DownloadOptions(retries=1)
+        assert not self._download((f"{self.url}/six.whl",), options=options)
+        assert not os.path.exists(self.out)
+        # What we got so far is kept, to resume from next time.
+        (part,) = self._parts()
+        assert os.path.getsize(part) == len(_BODY) * 3 // 4
+
+        assert self._download((f"{self.url}/six.whl",))
+        assert self._contents() == _BODY
+        assert Handler.ranges[-1] == f"bytes={len(_BODY) * 3 // 4}-"
+        assert os.listdir(self.dir.name) == ["six.whl"]
+
+    def test_resume_changed(self) -> None:
+        Handler.interruptions = 1
+        options = sut.DownloadOptions(retries=0)
+        assert not self._download((f"{self.url}/six.whl",), options=options)
+        Handler.etag = '"v2"'
+        assert self._download((f"{self.url}/six.whl",))
+        assert self._contents() == _BODY
+        assert Handler.ranges[-1] is not None
+        assert Handler.statuses == [200, 200]
+
+    def test_resume_only_from_same_url(self) -> None:
+        Handler.interruptions = 1
+        options = sut.DownloadOptions(retries=0)
+        assert not self._download((f"{self.url}/a/six.whl",), options=options)
+        assert self._download((f"{self.url}/b/six.whl",))
+        assert self._contents() == _BODY
+        assert Handler.ranges == [None, None]
+
+    def test_hash_mismatch(self) -> None:
+        assert not self._download(
+            (f"{self.url}/six.whl",), hashes=("sha256:" + "0" * 64,)
+        )
+        assert not os.path.exists(self.out)
+        assert not self._parts()
+
+    def test_hashes_without_prefix(self) -> None:
+        sha1 = hashlib.sha1(_BODY).hexdigest()
+        assert self._download((f"{self.url}/six.whl",), hashes=("0" * 64, sha1))
+
+    def test_cached_by_hash(self) -> None:
+        wheel_cache = cache.WheelCache(os.path.join(self.dir.name, "cache"))
+        options = sut.DownloadOptions(wheel_cache)
+        hashes = (f"sha256:{_SHA256}",)
+        assert self._download((f"{self.url}/six.whl",), options=options, hashes=hashes)
+        os.unlink(self.out)
+        assert self._download(
+            (f"{self.url}/other.whl",), options=options, hashes=hashes
+        )
+        assert self._contents() == _BODY
+        assert len(Handler.ranges) == 1
+
+
+class TestProbe(ServerTestCase):
+    def test_probes_concurrently(self) -> None:
+        stats = sut.MirrorStats()
+        urls = tuple(f"{self.url}/slow/{i}/missing.whl" for i in range(3))
+        start = time.monotonic()
+        assert self._download(
+            urls + (f"{self.url}/six.whl",), options=sut.DownloadOptions(stats=stats)
+        )
+        assert time.monotonic() - start < 0.8
+        assert Handler.gets == ["/six.whl"]
+        with self.assertLogs(sut._LOGGER, "DEBUG") as logs:
+            stats.log()
+        assert "5 requests, 3 failed" in logs.output[0]
+
+    def test_first_url_not_probed(self) -> None:
+        start = time.monotonic()
+        assert self._download(
+            (f"{self.url}/six.whl", f"{self.url}/slow/missing.whl"),
+        )
+        # It doesn't wait for the other probe.
+        assert time.monotonic() - start < 0.3
+        assert "/six.whl" not in Handler.heads
+
+    def test_priority(self) -> None:
+        assert self._download(
+            (f"{self.url}/slow/six.whl", f"{self.url}/six.whl"),
+        )
+        assert Handler.gets == ["/slow/six.whl"]
+
+    def test_head_not_allowed(self) -> None:
+        assert self._download(
+            (f"{self.url}/missing.whl", f"{self.url}/nohead/six.whl"),
+        )
+        assert Handler.gets == ["/nohead/six.whl"]